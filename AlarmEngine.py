@@ -0,0 +1,362 @@
+import atexit
+import logging
+import mmap
+import multiprocessing
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple, Union
+
+from AlarmSystem import AlarmSystem
+from Clock import Clock, SYSTEM_CLOCK
+from Helper import BotConfig, ConfigWatcher, loadConfig
+from LogSetup import logFields, setupLogging
+from PollScheduler import AdaptivePollScheduler
+from Rules import RuleEngine
+from Sensor import Sensor, SensorValues
+from ThingspeakClient import ThingspeakClient, ThingspeakConnection
+
+
+class ITEM_KINDS:
+    SENSOR = 0
+    RULE = 1
+
+
+def getRuleID(ruleName: str) -> int:
+    """ Rules are identified by name -> Both processes can reload the config independently without mixing up rules. """
+    return zlib.crc32(ruleName.encode('utf-8')) & 0x7fffffff
+
+
+class SnapshotState:
+    """ One consistent read of the sensor snapshot.
+    items: (kind, ID, hasValue, isInteger, triggered, value) per sensor/rule. ID = fieldID for sensors, getRuleID(name) for rules. """
+    __slots__ = ('sequence', 'lastSensorUpdateTimestamp', 'lastEntryID', 'noDataAlarmActive', 'items')
+
+    def __init__(self, sequence: int, lastSensorUpdateTimestamp: float, lastEntryID: Union[int, None], noDataAlarmActive: bool, items: List[tuple]):
+        self.sequence = sequence
+        self.lastSensorUpdateTimestamp = lastSensorUpdateTimestamp
+        self.lastEntryID = lastEntryID
+        self.noDataAlarmActive = noDataAlarmActive
+        self.items = items
+
+
+class SensorSnapshot:
+    """ Latest sensor state in a small memory mapped file: Written by the alarm engine process after every poll, read by the bot process without locks or IPC round trips.
+    Seqlock: The writer makes the sequence number odd while writing and even once done. Readers retry if it is odd or has changed while they were copying.
+    The CRC32 of the body additionally catches torn reads on CPUs which reorder memory accesses e.g. ARM. """
+
+    # sequence, CRC32 of body, padding
+    HEADER = struct.Struct('<QI4x')
+    # number of items, serverside timestamp of last sensor update, last entry ID (-1 = None), no data alarm active
+    BODY_HEADER = struct.Struct('<Idqb3x')
+    # kind, ID, hasValue, isInteger, triggered, value
+    ITEM = struct.Struct('<Bibbbd')
+    MAX_ITEMS = 128
+    SIZE = HEADER.size + BODY_HEADER.size + MAX_ITEMS * ITEM.size
+
+    def __init__(self, path: str, create: bool = False):
+        self.path = path
+        if create:
+            with open(path, 'wb') as outfile:
+                outfile.write(bytes(self.SIZE))
+        self.file = open(path, 'r+b')
+        self.buffer = mmap.mmap(self.file.fileno(), self.SIZE)
+        # Continue the sequence of a previous writer e.g. after the engine has been restarted
+        sequence = self.readSequence()
+        self.sequence = sequence + sequence % 2
+
+    def readSequence(self) -> int:
+        return struct.unpack_from('<Q', self.buffer, 0)[0]
+
+    def write(self, lastSensorUpdateTimestamp: float, lastEntryID: Union[int, None], noDataAlarmActive: bool, items: List[tuple]) -> None:
+        items = items[:self.MAX_ITEMS]
+        body = bytearray(self.BODY_HEADER.size + len(items) * self.ITEM.size)
+        self.BODY_HEADER.pack_into(body, 0, len(items), lastSensorUpdateTimestamp, -1 if lastEntryID is None else lastEntryID, noDataAlarmActive)
+        for index, item in enumerate(items):
+            self.ITEM.pack_into(body, self.BODY_HEADER.size + index * self.ITEM.size, *item)
+        self.sequence += 1
+        struct.pack_into('<Q', self.buffer, 0, self.sequence)
+        struct.pack_into('<I', self.buffer, 8, zlib.crc32(body))
+        self.buffer[self.HEADER.size:self.HEADER.size + len(body)] = body
+        self.sequence += 1
+        struct.pack_into('<Q', self.buffer, 0, self.sequence)
+
+    def writeAlarmSystem(self, alarmsystem: AlarmSystem) -> None:
+        items = []
+        table = alarmsystem.sensorValues
+        for fieldID, sensor in alarmsystem.sensors.items():
+            slot = sensor.slot
+            items.append((ITEM_KINDS.SENSOR, fieldID, table.hasValue[slot], table.isInteger[slot], table.triggered[slot], table.values[slot]))
+        for rule in alarmsystem.ruleEngine.rules:
+            value = rule.getValue()
+            items.append((ITEM_KINDS.RULE, getRuleID(rule.getName()), value is not None, isinstance(value, int), rule.isTriggered(), 0.0 if value is None else value))
+        self.write(alarmsystem.lastSensorUpdateServersideDatetime.timestamp(), alarmsystem.lastEntryID, alarmsystem.noDataAlarmHasBeenTriggered, items)
+
+    def read(self, lastSequence: Union[int, None] = None) -> Union[SnapshotState, None]:
+        """ Returns None if nothing has been written yet, the snapshot hasn't changed since lastSequence or no consistent copy could be obtained. """
+        for attempt in range(1000):
+            sequence = self.readSequence()
+            if sequence == 0 or sequence == lastSequence:
+                return None
+            if sequence % 2 == 1:
+                # Writer is busy -> Takes microseconds
+                time.sleep(0)
+                continue
+            crc = struct.unpack_from('<I', self.buffer, 8)[0]
+            numberOfItems = min(struct.unpack_from('<I', self.buffer, self.HEADER.size)[0], self.MAX_ITEMS)
+            body = self.buffer[self.HEADER.size:self.HEADER.size + self.BODY_HEADER.size + numberOfItems * self.ITEM.size]
+            if self.readSequence() != sequence or zlib.crc32(body) != crc:
+                continue
+            numberOfItems, lastSensorUpdateTimestamp, lastEntryID, noDataAlarmActive = self.BODY_HEADER.unpack_from(body, 0)
+            items = [self.ITEM.unpack_from(body, self.BODY_HEADER.size + index * self.ITEM.size) for index in range(numberOfItems)]
+            return SnapshotState(sequence, lastSensorUpdateTimestamp, None if lastEntryID == -1 else lastEntryID, bool(noDataAlarmActive), items)
+        logging.warning("Failed to read consistent sensor snapshot")
+        return None
+
+    def close(self) -> None:
+        self.buffer.close()
+        self.file.close()
+
+
+class PollResult:
+    """ Sent from the alarm engine to the bot after every successful poll. Alarm texts are None if there are no such alarms. """
+    __slots__ = ('lastEntryID', 'numberOfNewEntries', 'alarmText', 'alarmTextSnoozeOverride', 'alarmTextAdminOnly', 'alarmTextAdminOnlySnoozeOverride')
+
+    def __init__(self, alarmsystem: AlarmSystem):
+        self.lastEntryID = alarmsystem.lastEntryID
+        self.numberOfNewEntries = len(alarmsystem.newEntryTimestamps)
+        self.alarmText = alarmsystem.getAlarmText()
+        self.alarmTextSnoozeOverride = alarmsystem.getAlarmTextSnoozeOverride()
+        self.alarmTextAdminOnly = alarmsystem.getAlarmTextAdminOnly()
+        self.alarmTextAdminOnlySnoozeOverride = alarmsystem.getAlarmTextAdminOnlySnoozeOverride()
+
+
+def runAlarmEngine(configPath: str, dbPrefix: str, snapshotPath: str, eventQueue, stopEvent, snoozeUntil) -> None:
+    """ Main loop of the alarm engine process: Polls Thingspeak, evaluates sensors and rules, publishes the snapshot and sends a PollResult to the bot after every successful poll.
+    :param snoozeUntil: multiprocessing.Value with the end of the global snooze -> Poll interval while snoozed """
+    setupLogging()
+    clock = SYSTEM_CLOCK
+    cfg = loadConfig(configPath, dbPrefix=dbPrefix)
+    configWatcher = ConfigWatcher(configPath)
+    alarmsystem = AlarmSystem(cfg, clock=clock, thingspeakConnection=ThingspeakConnection(timeoutSeconds=cfg.request_timeout_seconds))
+    alarmsystem.setAlarmIntervalNoData(600)
+    pollScheduler = AdaptivePollScheduler(clock=clock)
+    snapshot = SensorSnapshot(snapshotPath)
+    logging.info("Alarm engine started", extra=logFields(bot=cfg.bot_name, pid=os.getpid()))
+    while not stopEvent.is_set():
+        noDataAlarmDeadline = alarmsystem.getNoDataAlarmDeadline()
+        if pollScheduler.isPollDue() or (noDataAlarmDeadline is not None and clock.now() >= noDataAlarmDeadline):
+            if configWatcher.hasChanged():
+                try:
+                    cfg = loadConfig(configPath, dbPrefix=dbPrefix)
+                    alarmsystem.updateConfig(cfg)
+                except:
+                    logging.warning("Ignoring changed config because it is invalid", exc_info=True)
+            pollScheduler.minIntervalSeconds = cfg.poll_min_interval_seconds
+            pollScheduler.maxIntervalSeconds = cfg.poll_max_interval_seconds
+            pollScheduler.snoozedIntervalSeconds = cfg.poll_snoozed_interval_seconds
+            try:
+                alarmsystem.updateAlarms()
+            except:
+                logging.warning("Alarm engine poll failed", exc_info=True)
+                pollScheduler.onPollError()
+            else:
+                snapshot.writeAlarmSystem(alarmsystem)
+                eventQueue.put(PollResult(alarmsystem))
+                pollScheduler.onPollSuccess(alarmsystem.newEntryTimestamps, alarmsystem.hasAlarms(), snoozeUntil.value > clock.now())
+        waitSeconds = min(pollScheduler.getSecondsUntilNextPoll(), 60)
+        noDataAlarmDeadline = alarmsystem.getNoDataAlarmDeadline()
+        if noDataAlarmDeadline is not None:
+            waitSeconds = min(waitSeconds, max(0.0, noDataAlarmDeadline - clock.now()))
+        stopEvent.wait(waitSeconds)
+    snapshot.close()
+
+
+class AlarmEngineProcess:
+    """ Runs polling and alarm evaluation of one bot in its own process so busy handlers (broadcasts, ACP, charts) can't delay alarms via the GIL. """
+
+    def __init__(self, cfg: BotConfig, configPath: str = 'config.json'):
+        self.cfg = cfg
+        self.configPath = configPath
+        # Fresh interpreter instead of fork -> No locks of other threads get copied in a locked state
+        self.context = multiprocessing.get_context('spawn')
+        snapshotDir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.snapshotPath = os.path.join(snapshotDir, 'antiBurglaryBot_' + cfg.db_prefix + str(os.getpid()) + '.snapshot')
+        self.snapshot = SensorSnapshot(self.snapshotPath, create=True)
+        self.snoozeUntil = self.context.Value('d', 0, lock=False)
+        self.isStopped = False
+        self.stopEvent = None
+        self.eventQueue = None
+        self.process = None
+        self.eventThread = None
+        atexit.register(self.stop)
+
+    def start(self) -> None:
+        # New queue and event -> A process which died while holding one of their locks can't block us
+        self.eventQueue = self.context.Queue()
+        self.stopEvent = self.context.Event()
+        self.process = self.context.Process(target=runAlarmEngine, args=(self.configPath, self.cfg.db_prefix, self.snapshotPath, self.eventQueue, self.stopEvent, self.snoozeUntil),
+                                            name='AlarmEngine_' + self.cfg.bot_name, daemon=True)
+        self.process.start()
+
+    def ensureRunning(self) -> None:
+        """ Restarts the engine process if it has died. Cheap enough to be called on every loop run. """
+        if self.process is not None and not self.process.is_alive() and not self.isStopped:
+            logging.warning("Alarm engine process has died -> Restarting it", extra=logFields(exitcode=self.process.exitcode))
+            self.start()
+
+    def setSnoozeUntil(self, snoozeUntil: float) -> None:
+        self.snoozeUntil.value = snoozeUntil
+
+    def startEventThread(self, callback: Callable[[PollResult], None]) -> None:
+        def run():
+            while not self.isStopped:
+                try:
+                    pollResult = self.eventQueue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                try:
+                    callback(pollResult)
+                except:
+                    logging.warning("Handling alarm engine event failed", exc_info=True)
+
+        self.eventThread = threading.Thread(target=run, name='AlarmEngineEvents_' + self.cfg.bot_name, daemon=True)
+        self.eventThread.start()
+
+    def stop(self) -> None:
+        if self.isStopped:
+            return
+        self.isStopped = True
+        if self.process is not None:
+            self.stopEvent.set()
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.snapshot.close()
+        try:
+            os.remove(self.snapshotPath)
+        except OSError:
+            pass
+
+
+class RemoteAlarmSystem:
+    """ Read-only view of the AlarmSystem which runs in the alarm engine process. Provides the parts of the AlarmSystem interface the bot uses.
+    Sensor values and trigger states come from the shared snapshot. It is only parsed again if its sequence number has changed. Alarm texts come from the last PollResult. """
+
+    def __init__(self, config: BotConfig, snapshot: SensorSnapshot, clock: Clock = SYSTEM_CLOCK, thingspeakConnection: ThingspeakConnection = None):
+        self.snapshot = snapshot
+        self.clock = clock
+        if thingspeakConnection is None:
+            thingspeakConnection = ThingspeakConnection()
+        self.thingspeakConnection = thingspeakConnection
+        self.lock = threading.Lock()
+        self.state = None
+        self.lastPollResult = None
+        self.cfg = None
+        self.updateConfig(config)
+
+    def updateConfig(self, config: BotConfig) -> None:
+        if self.cfg is None or config.thingspeak_channel != self.cfg.thingspeak_channel or config.thingspeak_read_apikey != self.cfg.thingspeak_read_apikey:
+            # Only used for charts. Alarms are handled by the engine.
+            self.client = ThingspeakClient(config.thingspeak_channel, config.thingspeak_read_apikey, self.thingspeakConnection)
+        self.sensorValues = SensorValues(self.clock)
+        self.localSensors = {fieldID: Sensor(sensorConfig, self.sensorValues) for fieldID, sensorConfig in config.thingspeak_fields_alarm_state_mapping.items()}
+        self.localRuleEngine = RuleEngine(config.thingspeak_rules)
+        self.rulesByID = {getRuleID(rule.getName()): rule for rule in self.localRuleEngine.rules}
+        self.cfg = config
+        with self.lock:
+            # Apply the current snapshot to the new sensors
+            self.state = None
+
+    def refresh(self) -> SnapshotState:
+        """ Applies the snapshot to the local sensors and rules if it has changed. Costs one read of the sequence number otherwise. """
+        with self.lock:
+            state = self.snapshot.read(self.state.sequence if self.state is not None else None)
+            if state is None:
+                return self.state
+            table = self.sensorValues
+            for kind, itemID, hasValue, isInteger, triggered, value in state.items:
+                if kind == ITEM_KINDS.SENSOR:
+                    sensor = self.localSensors.get(itemID)
+                    if sensor is not None:
+                        table.values[sensor.slot] = value
+                        table.hasValue[sensor.slot] = hasValue
+                        table.isInteger[sensor.slot] = isInteger
+                        table.triggered[sensor.slot] = triggered
+                else:
+                    rule = self.rulesByID.get(itemID)
+                    if rule is not None:
+                        rule.triggered = bool(triggered)
+                        rule.lastValue = (int(value) if isInteger else value) if hasValue else None
+            self.state = state
+            return state
+
+    @property
+    def sensors(self) -> dict:
+        self.refresh()
+        return self.localSensors
+
+    @property
+    def ruleEngine(self) -> RuleEngine:
+        self.refresh()
+        return self.localRuleEngine
+
+    @property
+    def noDataAlarmHasBeenTriggered(self) -> bool:
+        state = self.refresh()
+        return state is not None and state.noDataAlarmActive
+
+    @property
+    def lastSensorUpdateServersideDatetime(self) -> datetime:
+        state = self.refresh()
+        if state is None:
+            return self.clock.nowDatetime()
+        return datetime.fromtimestamp(state.lastSensorUpdateTimestamp, timezone.utc)
+
+    @property
+    def lastEntryID(self) -> Union[int, None]:
+        state = self.refresh()
+        return state.lastEntryID if state is not None else None
+
+    @property
+    def newEntryTimestamps(self) -> list:
+        # Only used for poll scheduling which happens in the engine
+        return []
+
+    def setAlarmIntervalNoData(self, seconds: int) -> None:
+        """ No data alarms are handled by the engine """
+        pass
+
+    def updateAlarms(self) -> None:
+        """ Polling happens in the engine process """
+        pass
+
+    def onPollResult(self, pollResult: PollResult) -> None:
+        self.lastPollResult = pollResult
+
+    def getFieldHistory(self, fieldID: int, seconds: int) -> List[Tuple[float, float]]:
+        return self.client.getFieldHistory(fieldID, seconds)
+
+    def getNoDataAlarmDeadline(self) -> Union[float, None]:
+        return None
+
+    def hasAlarms(self) -> bool:
+        pollResult = self.lastPollResult
+        return pollResult is not None and any(text is not None for text in (pollResult.alarmText, pollResult.alarmTextSnoozeOverride, pollResult.alarmTextAdminOnly, pollResult.alarmTextAdminOnlySnoozeOverride))
+
+    def getAlarmText(self) -> Union[str, None]:
+        return self.lastPollResult.alarmText if self.lastPollResult is not None else None
+
+    def getAlarmTextSnoozeOverride(self) -> Union[str, None]:
+        return self.lastPollResult.alarmTextSnoozeOverride if self.lastPollResult is not None else None
+
+    def getAlarmTextAdminOnly(self) -> Union[str, None]:
+        return self.lastPollResult.alarmTextAdminOnly if self.lastPollResult is not None else None
+
+    def getAlarmTextAdminOnlySnoozeOverride(self) -> Union[str, None]:
+        return self.lastPollResult.alarmTextAdminOnlySnoozeOverride if self.lastPollResult is not None else None
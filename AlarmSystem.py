@@ -1,32 +1,47 @@
 import logging
 from datetime import datetime
-from json import loads
-from typing import Union
+from typing import Union, Iterator, List, Tuple
 
-from hyper import HTTP20Connection
-
-from Helper import Config, formatDatetimeToGermanDate, SYMBOLS, getFormattedDuration
-from Sensor import Sensor, SensorConfig
+from AnomalyDetector import AnomalyDetector
+from Clock import Clock, SYSTEM_CLOCK
+from EventLog import EventLog
+from LogSetup import logFields
+from Helper import BotConfig, formatDatetimeToGermanDate, SYMBOLS, getFormattedDuration
+from Rules import RuleEngine
+from Sensor import Sensor, SensorValues
+from ThingspeakClient import ThingspeakClient, ThingspeakConnection
 
 
 class AlarmSystem:
 
-    def __init__(self, config: dict):
+    def __init__(self, config: BotConfig, clock: Clock = SYSTEM_CLOCK, thingspeakConnection: ThingspeakConnection = None):
         self.cfg = config
-        self.lastSensorAlarmSentTimestamp = -1
+        self.clock = clock
+        # Might be shared with the alarm systems of other bots. Stays the same if the channel changes.
+        if thingspeakConnection is None:
+            thingspeakConnection = ThingspeakConnection()
+        self.thingspeakConnection = thingspeakConnection
+        self.client = ThingspeakClient(self.cfg.thingspeak_channel, self.cfg.thingspeak_read_apikey, self.thingspeakConnection)
+        # Monotonic time of the last sensor alarms -> Flood protection is not affected by wall clock changes
+        self.lastSensorAlarmSentMonotonic = None
         self.sensorAlarmIntervalSeconds = 60
         self.lastEntryIDChangeTimestamp = -1
-        self.lastSensorUpdateServersideDatetime = datetime.now()
+        self.lastSensorUpdateServersideDatetime = self.clock.nowDatetime()
         # Init sensors we want to check later
         self.sensors = {}
-        for fieldIDStr, sensorUserConfig in self.cfg[Config.THINGSPEAK_FIELDS_ALARM_STATE_MAPPING].items():
-            self.sensors[int(fieldIDStr)] = Sensor(SensorConfig(name=sensorUserConfig['name'], triggerValue=sensorUserConfig['trigger'],
-                                                   triggerOperator=sensorUserConfig['operator'],
-                                                   alarmOnlyOnceUntilUntriggered=sensorUserConfig.get('alarmOnlyOnceUntilUntriggered', False),
-                                                                triggeredText=sensorUserConfig.get('triggeredText', None),
-                                                                unTriggeredText=sensorUserConfig.get('unTriggeredText', None),
-                                                                overridesSnooze=sensorUserConfig.get('overridesSnooze', False),
-                                                                adminOnly=sensorUserConfig.get('adminOnly', False)))
+        self.sensorConfigs = {}
+        self.sensorValues = SensorValues(self.clock)
+        # fieldID -> AnomalyDetector for sensors which have "anomaly" configured
+        self.anomalyDetectors = {}
+        for fieldID, sensorConfig in self.cfg.thingspeak_fields_alarm_state_mapping.items():
+            self.sensors[fieldID] = Sensor(sensorConfig, self.sensorValues)
+            self.sensorConfigs[fieldID] = sensorConfig
+            if sensorConfig.anomaly is not None:
+                self.anomalyDetectors[fieldID] = AnomalyDetector(sensorConfig.anomaly, sensorConfig.name)
+        # (fieldID, feed key e.g. "field1", sensor, anomaly detector or None) -> Avoids building these strings for every feed entry
+        self.sensorFields = self.getSensorFields()
+        # Derived sensors e.g. "Door open AND Movement within 30 seconds"
+        self.ruleEngine = RuleEngine(self.cfg.thingspeak_rules)
         # Vars for "no data" warning
         self.noDataAlarmIntervalSeconds = 600
         self.noDataAlarmHasBeenTriggered = False
@@ -37,6 +52,61 @@ class AlarmSystem:
         self.alarmsAdminOnlySnoozeOverride = []
         self.lastEntryID = None
         self.channelName = None
+        # Serverside timestamps of all entries which were new during the last update
+        self.newEntryTimestamps = []
+        # Records all fetched data if enabled
+        self.eventLog = None
+        if self.cfg.event_log_dir is not None:
+            self.eventLog = EventLog(self.cfg.event_log_dir)
+
+    def updateConfig(self, config: BotConfig) -> None:
+        """ Applies a changed config at runtime. Only sensors whose config has changed will be re-created. Their current values and trigger state are kept. """
+        if config.thingspeak_channel != self.cfg.thingspeak_channel or config.thingspeak_read_apikey != self.cfg.thingspeak_read_apikey:
+            logging.info("Thingspeak channel has changed -> Full resync on next run")
+            self.lastEntryID = None
+            self.client = ThingspeakClient(config.thingspeak_channel, config.thingspeak_read_apikey, self.thingspeakConnection)
+        newSensors = {}
+        newAnomalyDetectors = {}
+        for fieldID, sensorConfig in config.thingspeak_fields_alarm_state_mapping.items():
+            if sensorConfig.anomaly is not None:
+                oldDetector = self.anomalyDetectors.get(fieldID)
+                if oldDetector is not None and oldDetector.cfg == sensorConfig.anomaly and oldDetector.sensorName == sensorConfig.name:
+                    # Keep learned mean/variance
+                    newAnomalyDetectors[fieldID] = oldDetector
+                else:
+                    newAnomalyDetectors[fieldID] = AnomalyDetector(sensorConfig.anomaly, sensorConfig.name)
+            oldSensor = self.sensors.get(fieldID)
+            if oldSensor is not None and self.sensorConfigs.get(fieldID) == sensorConfig:
+                newSensors[fieldID] = oldSensor
+                continue
+            if oldSensor is not None:
+                # Keep slot -> Keeps current value and trigger state
+                sensor = Sensor(sensorConfig, self.sensorValues, slot=oldSensor.slot)
+                logging.info("Sensor config changed: field" + str(fieldID) + " | " + sensor.getName())
+            else:
+                sensor = Sensor(sensorConfig, self.sensorValues)
+                logging.info("Sensor added: field" + str(fieldID) + " | " + sensor.getName())
+            newSensors[fieldID] = sensor
+        for fieldID in self.sensors.keys() - newSensors.keys():
+            logging.info("Sensor removed: field" + str(fieldID) + " | " + self.sensors[fieldID].getName())
+            self.sensorValues.freeSlot(self.sensors[fieldID].slot)
+        self.sensorConfigs = dict(config.thingspeak_fields_alarm_state_mapping)
+        # Replace dict at once so other threads (e.g. menus) always see a consistent state
+        self.sensors = newSensors
+        self.anomalyDetectors = newAnomalyDetectors
+        self.sensorFields = self.getSensorFields()
+        # Rules with unchanged config keep their state
+        self.ruleEngine = RuleEngine(config.thingspeak_rules, self.ruleEngine)
+        if config.event_log_dir != self.cfg.event_log_dir:
+            if self.eventLog is not None:
+                self.eventLog.close()
+                self.eventLog = None
+            if config.event_log_dir is not None:
+                self.eventLog = EventLog(config.event_log_dir)
+        self.cfg = config
+
+    def getSensorFields(self) -> list:
+        return [(fieldID, 'field' + str(fieldID), sensor, self.anomalyDetectors.get(fieldID)) for fieldID, sensor in self.sensors.items()]
 
     def getNoDataStatus(self) -> str:
         if self.noDataAlarmHasBeenTriggered:
@@ -44,12 +114,18 @@ class AlarmSystem:
         else:
             return "Ok"
 
-    def getSensorAPIResponse(self) -> dict:
-        # https://community.thingspeak.com/documentation%20.../api/
-        conn = HTTP20Connection('api.thingspeak.com')
-        conn.request("GET", '/channels/' + str(self.cfg[Config.THINGSPEAK_CHANNEL]) + '/feed.json?key=' + self.cfg[Config.THINGSPEAK_READ_APIKEY] + '&offset=1')
-        apiResult = loads(conn.get_response().read())
-        return apiResult
+    def getFeedEntries(self, minEntryID: Union[int, None], numberOfEntries: Union[int, None]) -> Iterator[dict]:
+        """ Yields feed entries. Skips entries with entry_id <= minEntryID. """
+        return self.client.streamFeed(minEntryID=minEntryID, numberOfEntries=numberOfEntries, onChannelInfo=self.setChannelInfo)
+
+    def setChannelInfo(self, channelInfo: dict) -> None:
+        self.channelName = channelInfo.get('name')
+
+    def getLastEntryID(self) -> Union[int, None]:
+        return self.client.getLastEntryID()
+
+    def getFieldHistory(self, fieldID: int, seconds: int) -> List[Tuple[float, float]]:
+        return self.client.getFieldHistory(fieldID, seconds)
 
     def setAlarmIntervalNoData(self, seconds: int):
         """ Return alarms if no new sensor data is available every X minutes.
@@ -104,64 +180,149 @@ class AlarmSystem:
                 text += "\n" + alarmMsg
             return text
 
+    def recordPoll(self, lastEntryID: Union[int, None], entries: list) -> None:
+        if self.eventLog is None:
+            return
+        try:
+            self.eventLog.record(self.clock.now(), lastEntryID, entries)
+        except Exception:
+            # Never let the event log break alarms
+            logging.exception("Failed to write event log")
+
+    def checkNoNewData(self) -> None:
+        """ Check if our alarm system maybe hasn't been responding for a long amount of time. Only send alarm for this once until data is back! """
+        durationNoNewData = self.clock.now() - self.lastSensorUpdateServersideDatetime.timestamp()
+        infoText = "No new data available this run | Last data is from: " + formatDatetimeToGermanDate(
+            self.lastSensorUpdateServersideDatetime) + " -> FieldID [" + str(self.lastEntryID) + "]"
+        if self.noDataAlarmIntervalSeconds > -1:
+            # Only check for NoNewData alarms if wished
+            if durationNoNewData > self.noDataAlarmIntervalSeconds:
+                if not self.noDataAlarmHasBeenTriggered:
+                    logging.warning("NoDataAlarm triggered!", extra=logFields(last_entry_id=self.lastEntryID))
+                    self.alarmsAdminOnly.append(SYMBOLS.DENY + "<b>Fehler Alarmanlage!Keine neuen Daten verfügbar!\nLetzte Sensordaten vom: " + formatDatetimeToGermanDate(self.lastSensorUpdateServersideDatetime) + "</b>")
+                    self.lastNoNewSensorDataAvailableAlarmSentTimestamp = self.clock.now()
+                    self.noDataAlarmHasBeenTriggered = True
+                infoText += "\n--> NoDataAlarm is active because no new data since: " + getFormattedDuration(durationNoNewData)
+            else:
+                self.noDataAlarmHasBeenTriggered = False
+                infoText += "\n--> Time until no data alarm: " + getFormattedDuration(self.noDataAlarmIntervalSeconds - durationNoNewData)
+            logging.info(infoText, extra=logFields('noNewData'))
+
+    def getNoDataAlarmDeadline(self) -> Union[float, None]:
+        """ Returns timestamp at which the no data alarm will be triggered if no new data arrives until then. None = No data alarm is disabled or already active. """
+        if self.noDataAlarmIntervalSeconds < 0 or self.noDataAlarmHasBeenTriggered or self.lastEntryID is None:
+            return None
+        return self.lastSensorUpdateServersideDatetime.timestamp() + self.noDataAlarmIntervalSeconds + 1
+
+    def hasAlarms(self) -> bool:
+        return len(self.alarms) > 0 or len(self.alarmsSnoozeOverride) > 0 or len(self.alarmsAdminOnly) > 0 or len(self.alarmsAdminOnlySnoozeOverride) > 0
+
     def updateAlarms(self):
         """ Updates sensor states and saves/sets resulting alarms """
         # Clear last list of alarms
         self.alarms = []
         self.alarmsSnoozeOverride = []
         self.alarmsAdminOnly = []
-        apiResult = self.getSensorAPIResponse()
-        channelInfo = apiResult['channel']
-        self.channelName = channelInfo["name"]
-        sensorResults = apiResult['feeds']
+        self.alarmsAdminOnlySnoozeOverride = []
+        self.newEntryTimestamps = []
+        # Cheap check first: Only download- and parse the feed if there is new data
+        currentLastEntryID = self.getLastEntryID()
+        if currentLastEntryID is None or currentLastEntryID == self.lastEntryID:
+            self.recordPoll(currentLastEntryID, [])
+        if currentLastEntryID is None:
+            logging.info("Channel has no entries yet", extra=logFields('noEntries'))
+            return
+        elif currentLastEntryID == self.lastEntryID:
+            self.checkNoNewData()
+            self.lastEntryIDChangeTimestamp = self.clock.now()
+            return
         # Most of all times we want to check only new entries but if e.g. the channel gets reset we need to check entries lower than our last saved number!
         checkOnlyHigherEntryIDs = True
-        currentLastEntryID = channelInfo['last_entry_id']
-        if self.lastEntryID is None:
+        isFirstRun = self.lastEntryID is None
+        if isFirstRun:
             # First run -> Make sure we don't return alarms immediately!
             self.lastEntryID = currentLastEntryID
-            # Obtain serverside last updated timestamp
-            self.lastSensorUpdateServersideDatetime = datetime.strptime(sensorResults[len(sensorResults) - 1]["created_at"], '%Y-%m-%dT%H:%M:%S%z')
             # Set dummy value
-            self.lastEntryIDChangeTimestamp = datetime.now().timestamp()
+            self.lastEntryIDChangeTimestamp = self.clock.now()
         elif currentLastEntryID < self.lastEntryID:
             # Rare case
             checkOnlyHigherEntryIDs = False
             logging.info("Thingspeak channel has been reset(?) -> Checking ALL entryIDs")
         else:
-            logging.info("Checking all entryIDs > " + str(self.lastEntryID))
+            logging.info("Checking new entries", extra=logFields('checkingEntries', last_entry_id=self.lastEntryID, current_last_entry_id=currentLastEntryID))
         # The following two lines are debug code
         # allowSendSensorAlarms = True
         # self.lastEntryID = 0
-
+        if isFirstRun or not checkOnlyHigherEntryIDs:
+            # We need all entries e.g. to fill all sensor values right on the first start
+            minEntryID = None
+            numberOfEntries = None
+        else:
+            # Entries we've checked before will be skipped by the parser without even creating dicts for them
+            minEntryID = self.lastEntryID
+            # Catch up after e.g. an outage: Feed returns only the last 100 entries by default
+            numberOfEntries = min(currentLastEntryID - self.lastEntryID, 8000) if currentLastEntryID - self.lastEntryID > 100 else None
+        lastEntryCreatedAt = None
+        fetchedEntries = []
         alarmDatetime = None
         triggeredSensors = []
         alarmSensorsNames = []
-        for feed in sensorResults:
+        # Many entries at once e.g. on startup or after an outage -> Feed anomaly detectors in one (vectorized) batch per sensor after download
+        batchAnomalies = isFirstRun or not checkOnlyHigherEntryIDs or numberOfEntries is not None
+        # fieldID -> ([values], [(entry datetime, isUncheckedEntry)])
+        anomalyBatches = {}
+        for feed in self.getFeedEntries(minEntryID, numberOfEntries):
             # Check all fields for which we got alarm state mapping
             entryID = feed['entry_id']
-            for fieldID, sensor in self.sensors.items():
-                fieldKey = 'field' + str(fieldID)
-                if fieldKey not in feed:
+            lastEntryCreatedAt = feed['created_at']
+            if self.eventLog is not None:
+                fetchedEntries.append(feed)
+            # Ignore possible alarms of entries we've checked before --> We still set the sensor values to be able to fill all sensor values right on the first start
+            isUncheckedEntry = entryID > self.lastEntryID or not checkOnlyHigherEntryIDs
+            # Rules need every entry exactly once. On the first run all entries are used to fill their time windows.
+            feedRules = isUncheckedEntry or isFirstRun
+            thisDatetime = None
+            for fieldID, fieldKey, sensor, anomalyDetector in self.sensorFields:
+                fieldValueRaw = feed.get(fieldKey, False)
+                if fieldValueRaw is False:
                     logging.warning("One of your configured sensors is not available in feed: " + fieldKey + " | " + sensor.getName())
                     continue
-                sensorWasTriggeredBefore = sensor.isTriggered()
-                # Thingspeak sends all values as String but we need float or int
-                fieldValueRaw = feed[fieldKey]
-                # Skip invalid fields e.g. containing value "nAn"
-                if not fieldValueRaw.replace('.', '', 1).isdigit():
+                # Skip empty fields and invalid fields e.g. containing value "nAn"
+                if fieldValueRaw is None or not fieldValueRaw.replace('.', '', 1).isdigit():
                     # https://stackoverflow.com/questions/354038/how-do-i-check-if-a-string-is-a-number-float
                     continue
-                # String to number
+                sensorWasTriggeredBefore = sensor.isTriggered()
+                # Thingspeak sends all values as String but we need float or int
                 if '.' in fieldValueRaw:
                     sensor.setValue(float(fieldValueRaw))
                 else:
                     sensor.setValue(int(fieldValueRaw))
-                if entryID <= self.lastEntryID and checkOnlyHigherEntryIDs:
-                    # Ignore possible alarms of entries we've checked before --> We actually do this inside this loop to be able to full all sensor values right on the first start
+                if not feedRules:
+                    continue
+                if thisDatetime is None:
+                    thisDatetime = datetime.strptime(feed['created_at'], '%Y-%m-%dT%H:%M:%S%z')
+                    self.newEntryTimestamps.append(thisDatetime.timestamp())
+                alarmRules = self.ruleEngine.onSample(fieldID, sensor, thisDatetime.timestamp())
+                anomalyAlarm = None
+                if anomalyDetector is not None:
+                    if batchAnomalies:
+                        values, entryInfos = anomalyBatches.setdefault(fieldID, ([], []))
+                        values.append(sensor.getValue())
+                        entryInfos.append((thisDatetime, isUncheckedEntry))
+                    else:
+                        anomalyAlarm = anomalyDetector.onSample(sensor.getValue())
+                if not isUncheckedEntry:
                     continue
-                thisDatetime = datetime.strptime(feed['created_at'], '%Y-%m-%dT%H:%M:%S%z')
                 self.lastSensorUpdateServersideDatetime = thisDatetime
+                for rule in alarmRules:
+                    if rule.getName() not in alarmSensorsNames:
+                        alarmSensorsNames.append(rule.getName())
+                        triggeredSensors.append(rule)
+                        alarmDatetime = thisDatetime
+                if anomalyAlarm is not None and anomalyAlarm.getName() not in alarmSensorsNames:
+                    alarmSensorsNames.append(anomalyAlarm.getName())
+                    triggeredSensors.append(anomalyAlarm)
+                    alarmDatetime = thisDatetime
                 # Check if alarm state is given
                 if sensor.isTriggered():
                     if sensor.isAlarmOnlyOnceUntilUntriggered() and sensorWasTriggeredBefore:
@@ -172,27 +333,23 @@ class AlarmSystem:
                         triggeredSensors.append(sensor)
                         alarmDatetime = thisDatetime
 
+        for fieldID, (values, entryInfos) in anomalyBatches.items():
+            for index, anomalyAlarm in self.anomalyDetectors[fieldID].onSamples(values):
+                thisDatetime, isUncheckedEntry = entryInfos[index]
+                if isUncheckedEntry and anomalyAlarm.getName() not in alarmSensorsNames:
+                    alarmSensorsNames.append(anomalyAlarm.getName())
+                    triggeredSensors.append(anomalyAlarm)
+                    if alarmDatetime is None or thisDatetime > alarmDatetime:
+                        alarmDatetime = thisDatetime
+        self.recordPoll(currentLastEntryID, fetchedEntries)
+        if isFirstRun and lastEntryCreatedAt is not None:
+            # Obtain serverside last updated timestamp
+            self.lastSensorUpdateServersideDatetime = datetime.strptime(lastEntryCreatedAt, '%Y-%m-%dT%H:%M:%S%z')
         if currentLastEntryID == self.lastEntryID:
-            # Check if our alarm system maybe hasn't been responding for a long amount of time. Only send alarm for this once until data is back!
-            durationNoNewData = datetime.now().timestamp() - self.lastSensorUpdateServersideDatetime.timestamp()
-            infoText = "No new data available this run | Last data is from: " + formatDatetimeToGermanDate(
-                self.lastSensorUpdateServersideDatetime) + " -> FieldID [" + str(self.lastEntryID) + "]"
-            if self.noDataAlarmIntervalSeconds > -1:
-                # Only check for NoNewData alarms if wished
-                if durationNoNewData > self.noDataAlarmIntervalSeconds:
-                    if not self.noDataAlarmHasBeenTriggered:
-                        logging.info("NoDataAlarm triggered!")
-                        self.alarmsAdminOnly.append(SYMBOLS.DENY + "<b>Fehler Alarmanlage!Keine neuen Daten verfügbar!\nLetzte Sensordaten vom: " + formatDatetimeToGermanDate(self.lastSensorUpdateServersideDatetime) + "</b>")
-                        self.lastNoNewSensorDataAvailableAlarmSentTimestamp = datetime.now().timestamp()
-                        self.noDataAlarmHasBeenTriggered = True
-                    infoText += "\n--> NoDataAlarm is active because no new data since: " + getFormattedDuration(durationNoNewData)
-                else:
-                    self.noDataAlarmHasBeenTriggered = False
-                    infoText += "\n--> Time until no data alarm: " + getFormattedDuration(self.noDataAlarmIntervalSeconds - durationNoNewData)
-                logging.info(infoText)
+            self.checkNoNewData()
         elif len(alarmSensorsNames) > 0:
-            print("Alarms triggered: " + formatDatetimeToGermanDate(alarmDatetime) + " | " + ', '.join(alarmSensorsNames))
-            if datetime.now().timestamp() < (self.lastSensorAlarmSentTimestamp + self.sensorAlarmIntervalSeconds):
+            logging.warning("Alarms triggered: " + formatDatetimeToGermanDate(alarmDatetime) + " | " + ', '.join(alarmSensorsNames), extra=logFields(entry_id=currentLastEntryID))
+            if self.lastSensorAlarmSentMonotonic is not None and self.clock.monotonic() < (self.lastSensorAlarmSentMonotonic + self.sensorAlarmIntervalSeconds):
                 # Only allow alarms every X minutes otherwise we'd send new messages every time this code gets executed!
                 logging.info("Not setting alarms because: Flood protection")
             else:
@@ -200,20 +357,18 @@ class AlarmSystem:
                 for triggeredSensor in triggeredSensors:
                     # TODO: Make use of Sensor.getAlarmText()
                     alarmText = formatDatetimeToGermanDate(alarmDatetime) + ' | ' + triggeredSensor.getName()
-                    if triggeredSensor.isAdminOnlyAlarm and triggeredSensor.overridesSnooze:
-                        self.alarmsAdminOnlySnoozeOverride.append(alarmText)
-                    elif triggeredSensor.isAdminOnlyAlarm:
+                    if triggeredSensor.isAdminOnlyAlarm:
                         self.alarmsAdminOnly.append(alarmText)
-                    elif triggeredSensor.overridesSnooze:
-                        self.alarmsSnoozeOverride.append(alarmText)
                     else:
                         self.alarms.append(alarmText)
-                    # Store these separately
-                    if triggeredSensor.overridesSnooze:
+                    # Store these separately: These are the only ones which will be sent while alarms are snoozed
+                    if triggeredSensor.isAdminOnlyAlarm and triggeredSensor.overridesSnooze:
+                        self.alarmsAdminOnlySnoozeOverride.append(alarmText)
+                    elif triggeredSensor.overridesSnooze:
                         self.alarmsSnoozeOverride.append(alarmText)
-                self.lastSensorAlarmSentTimestamp = datetime.now().timestamp()
+                self.lastSensorAlarmSentMonotonic = self.clock.monotonic()
         else:
             # No alarms
-            logging.info("Detected no alarms this run")
+            logging.info("Detected no alarms this run", extra=logFields('noAlarms', entry_id=currentLastEntryID, new_entries=len(self.newEntryTimestamps)))
         self.lastEntryID = currentLastEntryID
-        self.lastEntryIDChangeTimestamp = datetime.now().timestamp()
\ No newline at end of file
+        self.lastEntryIDChangeTimestamp = self.clock.now()
\ No newline at end of file
@@ -0,0 +1,176 @@
+import math
+from typing import List, Tuple, Union
+
+from pydantic import BaseModel, validator
+
+try:
+    import numpy
+except ImportError:
+    # Optional: Only speeds up catch-up of large batches
+    numpy = None
+
+
+class DIRECTIONS:
+    BOTH = 'BOTH'
+    UP = 'UP'  # Only values above normal are anomalies e.g. temperature
+    DOWN = 'DOWN'  # Only values below normal are anomalies e.g. battery voltage
+
+
+class AnomalyConfig(BaseModel):
+    """ Optional "anomaly" entry of a sensor in thingspeak_fields_alarm_state_mapping """
+    # Weight of new samples: Higher = adapts faster, lower = remembers longer
+    alpha: float = 0.05
+    zThreshold: float = 4.0
+    # No alarms until the detector has seen this many samples
+    warmupSamples: int = 50
+    # Lower bound for the standard deviation so tiny changes of almost constant values don't count as anomaly
+    minStd: float = 0.01
+    direction: str = DIRECTIONS.BOTH
+    overridesSnooze: bool = False
+
+    @validator('alpha')
+    def checkAlpha(cls, alpha):
+        if not 0 < alpha < 1:
+            raise ValueError('alpha must be between 0 and 1')
+        return alpha
+
+    @validator('direction')
+    def checkDirection(cls, direction):
+        if direction not in (DIRECTIONS.BOTH, DIRECTIONS.UP, DIRECTIONS.DOWN):
+            raise ValueError('Unknown direction ' + direction)
+        return direction
+
+
+# Max. number of samples per vectorized step
+BATCH_CHUNK_SIZE = 256
+# Max. decades the (1 - alpha)^n factors of one step may span. Inputs get divided by them, so this must leave enough of float64's ~1e308 range
+# for the inputs themselves: 150 keeps squared diffs up to 1e150 finite -> Big alpha needs shorter steps
+MAX_DECAY_EXPONENT = 150
+
+
+def getChunkSize(alpha: float) -> int:
+    """ Returns max. number of samples per vectorized step for which (1 - alpha)^n stays above 1e-150 """
+    return max(1, min(BATCH_CHUNK_SIZE, int(-MAX_DECAY_EXPONENT / math.log10(1 - alpha))))
+
+
+class AnomalyDetector:
+    """ Detects values which are unusual compared to the recent history of one sensor via z-score against an exponentially weighted moving mean/variance.
+    State = 3 numbers per sensor, O(1) per sample. Alarms are admin-only and routed like alarms of sensors with adminOnly. """
+    __slots__ = ('cfg', 'sensorName', 'mean', 'variance', 'numberOfSamples', 'triggered')
+
+    def __init__(self, cfg: AnomalyConfig, sensorName: str):
+        self.cfg = cfg
+        self.sensorName = sensorName
+        self.mean = 0.0
+        self.variance = 0.0
+        self.numberOfSamples = 0
+        self.triggered = False
+
+    def getZScore(self, value: float) -> float:
+        std = max(math.sqrt(self.variance), self.cfg.minStd)
+        return (value - self.mean) / std
+
+    def isAnomaly(self, zScore: float) -> bool:
+        if self.cfg.direction == DIRECTIONS.UP:
+            return zScore > self.cfg.zThreshold
+        elif self.cfg.direction == DIRECTIONS.DOWN:
+            return zScore < -self.cfg.zThreshold
+        else:
+            return abs(zScore) > self.cfg.zThreshold
+
+    def onSample(self, value: float) -> Union['AnomalyAlarm', None]:
+        """ Evaluates value against the history so far, then adds it. Returns an alarm if value is anomalous and the previous one wasn't. """
+        wasTriggeredBefore = self.triggered
+        meanBefore = self.mean
+        if self.numberOfSamples == 0:
+            self.mean = value
+            zScore = 0.0
+        else:
+            zScore = self.getZScore(value)
+            # Incremental EWMA mean/variance (West 1979): Numerically stable, no history needed
+            diff = value - self.mean
+            increment = self.cfg.alpha * diff
+            self.mean += increment
+            self.variance = (1 - self.cfg.alpha) * (self.variance + diff * increment)
+        self.numberOfSamples += 1
+        self.triggered = self.numberOfSamples > self.cfg.warmupSamples and self.isAnomaly(zScore)
+        if self.triggered and not wasTriggeredBefore:
+            return self.getAlarm(value, meanBefore, zScore)
+        return None
+
+    def onSamples(self, values: List[float]) -> List[Tuple[int, 'AnomalyAlarm']]:
+        """ Same as calling onSample for every value but vectorized via numpy if available -> Fast catch-up after outages or on startup.
+        Returns (index of value, alarm) for all values which raise an alarm. """
+        if numpy is None or len(values) < 2 * BATCH_CHUNK_SIZE:
+            alarms = []
+            for index, value in enumerate(values):
+                alarm = self.onSample(value)
+                if alarm is not None:
+                    alarms.append((index, alarm))
+            return alarms
+        alarms = []
+        if self.numberOfSamples == 0:
+            # First value only initializes the mean
+            self.onSample(values[0])
+            offset = 1
+        else:
+            offset = 0
+        chunkSize = getChunkSize(self.cfg.alpha)
+        while offset < len(values):
+            chunk = numpy.asarray(values[offset:offset + chunkSize], dtype=numpy.float64)
+            for index, alarm in self.onChunk(chunk):
+                alarms.append((offset + index, alarm))
+            offset += len(chunk)
+        return alarms
+
+    def onChunk(self, chunk) -> List[Tuple[int, 'AnomalyAlarm']]:
+        alpha = self.cfg.alpha
+        decay = 1 - alpha
+        n = len(chunk)
+        # Means before each sample: mean_t = decay * mean_t-1 + alpha * x_t is a linear recurrence -> Solved via cumulative sums
+        meansAfter = self.solveRecurrence(self.mean, alpha * chunk, decay)
+        meansBefore = numpy.concatenate(([self.mean], meansAfter[:-1]))
+        diffs = chunk - meansBefore
+        # variance_t = decay * (variance_t-1 + alpha * diff_t^2)
+        variancesAfter = self.solveRecurrence(self.variance, decay * alpha * diffs * diffs, decay)
+        variancesBefore = numpy.concatenate(([self.variance], variancesAfter[:-1]))
+        zScores = diffs / numpy.maximum(numpy.sqrt(variancesBefore), self.cfg.minStd)
+        if self.cfg.direction == DIRECTIONS.UP:
+            anomalies = zScores > self.cfg.zThreshold
+        elif self.cfg.direction == DIRECTIONS.DOWN:
+            anomalies = zScores < -self.cfg.zThreshold
+        else:
+            anomalies = numpy.abs(zScores) > self.cfg.zThreshold
+        sampleNumbers = numpy.arange(self.numberOfSamples + 1, self.numberOfSamples + n + 1)
+        triggered = anomalies & (sampleNumbers > self.cfg.warmupSamples)
+        # Alarm only on transition to triggered
+        triggeredBefore = numpy.concatenate(([self.triggered], triggered[:-1]))
+        alarms = [(index, self.getAlarm(float(chunk[index]), float(meansBefore[index]), float(zScores[index]))) for index in numpy.nonzero(triggered & ~triggeredBefore)[0].tolist()]
+        self.mean = float(meansAfter[-1])
+        self.variance = float(variancesAfter[-1])
+        self.numberOfSamples += n
+        self.triggered = bool(triggered[-1])
+        return alarms
+
+    @staticmethod
+    def solveRecurrence(start: float, inputs, decay: float):
+        """ Returns y with y_t = decay * y_t-1 + inputs_t and y_-1 = start for all t at once. inputs / decay^len(inputs) must not overflow, see getChunkSize. """
+        powers = decay ** numpy.arange(1, len(inputs) + 1)
+        return powers * (start + numpy.cumsum(inputs / powers))
+
+    def getAlarm(self, value: float, mean: float, zScore: float) -> 'AnomalyAlarm':
+        return AnomalyAlarm(self.sensorName + ": Ungewöhnlicher Wert " + str(value) + " (normal ~" + "{:.2f}".format(mean) + ", z=" + "{:.1f}".format(zScore) + ")",
+                            self.cfg.overridesSnooze)
+
+
+class AnomalyAlarm:
+    """ Provides what AlarmSystem needs to route an alarm just like a triggered sensor. """
+    __slots__ = ('name', 'overridesSnooze')
+    isAdminOnlyAlarm = True
+
+    def __init__(self, name: str, overridesSnooze: bool):
+        self.name = name
+        self.overridesSnooze = overridesSnooze
+
+    def getName(self) -> str:
+        return self.name
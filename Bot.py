@@ -1,20 +1,34 @@
 import logging
+import threading
 import time
-import traceback
-from datetime import datetime
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 
-import couchdb
-import schedule
-from telegram import Update, ReplyMarkup, InlineKeyboardButton, InlineKeyboardMarkup, Message
-from telegram.error import BadRequest, Unauthorized
+from telegram import Update, ReplyMarkup, InlineKeyboardButton, InlineKeyboardMarkup, Message, Bot as TelegramBot
+from telegram.error import BadRequest, TelegramError, Unauthorized
+from telegram.utils.request import Request
 from telegram.ext import Updater, ConversationHandler, CommandHandler, CallbackContext, CallbackQueryHandler, \
-    MessageHandler, Filters
+    MessageHandler, Filters, TypeHandler
 
+from AlarmEngine import AlarmEngineProcess, PollResult, RemoteAlarmSystem
 from AlarmSystem import AlarmSystem
-from Helper import Config, loadConfig, SYMBOLS, getFormattedTimeDelta, formatTimestampToGermanDate, BotException, formatDatetimeToGermanDate, getFormattedDuration
-
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+from Chart import ChartCache, CHART_RANGES, renderLineChart
+from Clock import Clock, SYSTEM_CLOCK
+from HandlerLanes import createHandlerLanes, LANES
+from MessageEditCache import EDIT_ACTIONS, MessageEditCache
+from Persistence import SQLitePersistence
+from PollScheduler import AdaptivePollScheduler
+from Profiler import SamplingProfiler
+from ResilientStorage import ResilientStorage, StorageUnavailableError
+from Storage import STORAGE_BACKENDS, USERDB, CouchDBStorage, DatabaseNames, SQLiteStorage, withoutMetadata
+from ThingspeakClient import ThingspeakConnection
+from TimerScheduler import TimerScheduler
+from Watchdog import Watchdog
+from LogSetup import setupLogging, logFields
+from Helper import BotConfig, loadConfig, loadBotConfigs, ConfigWatcher, PhaseTimer, SYMBOLS, getFormattedTimeDelta, formatTimestampToGermanDate, BotException, formatDatetimeToGermanDate, getFormattedDuration
+
+setupLogging()
 
 
 class CallbackVars:
@@ -29,38 +43,31 @@ class CallbackVars:
     MENU_SETTINGS = 'MENU_SETTINGS'
     MENU_SETTINGS_DISPLAY_OWN_DATA = 'MENU_SETTINGS_DISPLAY_OWN_DATA'
     MENU_SETTINGS_DELETE_ACCOUNT = 'MENU_SETTINGS_DELETE_ACCOUNT'
+    MENU_SETTINGS_TRIGGER_LIVE_STATUS = 'MENU_SETTINGS_TRIGGER_LIVE_STATUS'
     MENU_ACP = 'MENU_ACP'
     MENU_ACP_APPROVE_USER = 'MENU_ACP_APPROVE_USER'
     MENU_ACP_DECLINE_USER = 'MENU_ACP_DECLINE_USER'
     MENU_ACP_ACTIONS = 'MENU_ACP_ACTIONS'
     MENU_ACP_ACTION_TRIGGER_ADMIN = 'MENU_ACP_ACTION_TRIGGER_ADMIN'
     MENU_ACP_ACTION_DELETE_USER = 'MENU_ACP_ACTION_DELETE_USER'
+    MENU_ACP_PAGE = 'MENU_ACP_PAGE_'
+    MENU_ACP_SEARCH = 'MENU_ACP_SEARCH'
+    MENU_ACP_PROFILE = 'MENU_ACP_PROFILE_'
+    MENU_CHARTS = 'MENU_CHARTS'
+    CHART = 'CHART_'
 
 
-class DATABASES:
-    USERS = 'users'
-    BOTSTATE = 'botstate'
+class USERDATA:
+    """ Keys of context.user_data """
+    ACP_PAGE = 'acp_page'
+    ACP_PAGE_CURSORS = 'acp_page_cursors'
 
 
-class USERDB:
-    USERNAME = 'username'
-    FIRST_NAME = 'first_name'
-    LAST_NAME = 'last_name'
-    IS_APPROVED = 'is_approved'
-    APPROVED_BY = 'approved_by'
-    IS_ADMIN = 'is_admin'
-    APPROVAL_REQUEST_HAS_BEEN_SENT = 'approval_request_has_been_sent'
-    TIMESTAMP_SNOOZE_UNTIL = 'timestamp_snooze_until'
-    TIMESTAMP_REGISTERED = 'timestamp_registered'  # Timestamp when user entered correct password
-    TIMESTAMP_LAST_SNOOZE = 'timestamp_last_snooze'  # Timestamp when user triggered a snooze last time
-    TIMESTAMP_LAST_BROADCAST_SENT = 'timestamp_last_broadcast_sent'
-    # TIMESTAMP_LAST_PASSWORD_TRY = 'timestamp_last_password_try'
-    TIMESTAMP_LAST_APPROVAL_REQUEST = 'timestamp_last_approval_request'
-    TIMESTAMP_APPROVED = 'timestamp_approved'
-    TIMESTAMP_LAST_TIME_REQUESTED_DSGVO_DATA = 'timestamp_last_time_requested_dsgvo_data'
-    TIMESTAMP_LAST_BLOCKED_BOT_ERROR = 'timestamp_last_blocked_bot_error'
-    MSG_ID_LAST_SNOOZE_NOTIFICATION = 'msg_id_last_snooze_notification'
-    MSG_IDS_APPROVAL_REQUESTS = 'msg_ids_approval_requests'
+ACP_USERS_PER_PAGE = 20
+
+
+class USERS_ARCHIVE:
+    TIMESTAMP_ARCHIVED = 'timestamp_archived'
 
 
 class BOTDB:
@@ -68,58 +75,177 @@ class BOTDB:
     MUTED_BY_USER_ID = 'muted_by'
 
 
+class TIMERS:
+    """ Keys of timers in ABBot.timers """
+    SNOOZE_EXPIRY = 'snooze_expiry'
+    NO_DATA_ALARM = 'no_data_alarm'
+
+
 BOT_VERSION = "0.9.1"
 
 
+class SharedResources:
+    """ Everything the bots served by one process share: Clock, timers, handler lanes, profiler, the CouchDB connection and the HTTP connection pools to Telegram and Thingspeak. """
+
+    def __init__(self, numberOfBots: int = 1, clock: Clock = SYSTEM_CLOCK, handlerLaneConfig: dict = None, requestTimeoutSeconds: float = 30):
+        # All time based behavior e.g. snooze, flood protection and poll intervals uses this clock
+        self.clock = clock
+        # Time based events e.g. end of snooze. Keys are prefixed with the db_prefix of the bot.
+        self.timers = TimerScheduler(self.clock)
+        self.profiler = SamplingProfiler()
+        # Slow handlers get their own worker pools so they can't delay quick ones
+        self.handlerLanes = createHandlerLanes(handlerLaneConfig or {})
+        # Every bot needs one connection for long polling and a few for its dispatcher workers and alarms
+        self.telegramRequest = Request(con_pool_size=4 + 4 * numberOfBots, read_timeout=30)
+        self.thingspeakConnection = ThingspeakConnection(timeoutSeconds=requestTimeoutSeconds)
+        self.requestTimeoutSeconds = requestTimeoutSeconds
+        self.couchdbServers = {}
+        self.couchdbSession = None
+        self.lock = threading.Lock()
+
+    def getCouchDB(self, url: str):
+        """ Returns one CouchDB server object per URL. All of them share one session = one pool of keep-alive connections. """
+        with self.lock:
+            server = self.couchdbServers.get(url)
+            if server is None:
+                import couchdb
+                if self.couchdbSession is None:
+                    self.couchdbSession = couchdb.Session(timeout=self.requestTimeoutSeconds)
+                server = couchdb.Server(url, session=self.couchdbSession)
+                self.couchdbServers[url] = server
+            return server
+
+
 class ABBot:
 
-    def __init__(self):
-        self.cfg = loadConfig()
-        if self.cfg is None or self.cfg.get(Config.DB_URL) is None:
-            raise Exception('Broken config')
-        # Init CouchDB
-        self.couchdb = couchdb.Server(self.cfg[Config.DB_URL])
-        self.alarmsystem = AlarmSystem(self.cfg)
+    def __init__(self, clock: Clock = SYSTEM_CLOCK, cfg: BotConfig = None, shared: SharedResources = None):
+        """ Pass cfg and shared to serve multiple bots from one process. Without them the config of the first bot in config.json is used. """
+        startupTimer = PhaseTimer()
+        if cfg is None:
+            cfg = startupTimer.run('config', loadConfig)
+        self.cfg = cfg
+        if shared is None:
+            shared = SharedResources(clock=clock, handlerLaneConfig=self.cfg.handler_lanes, requestTimeoutSeconds=self.cfg.request_timeout_seconds)
+        self.shared = shared
+        self.clock = shared.clock
+        self.configWatcher = ConfigWatcher()
+        self.alarmEngine = None
+        if self.cfg.alarm_engine_process:
+            # Polling and alarm evaluation run in their own process. This process only reads the shared sensor snapshot and sends notifications.
+            self.alarmEngine = AlarmEngineProcess(self.cfg)
+            self.alarmsystem = RemoteAlarmSystem(self.cfg, self.alarmEngine.snapshot, clock=self.clock, thingspeakConnection=shared.thingspeakConnection)
+        else:
+            self.alarmsystem = AlarmSystem(self.cfg, clock=self.clock, thingspeakConnection=shared.thingspeakConnection)
         self.alarmsystem.setAlarmIntervalNoData(600)
-        # Init that
-        self.alarmsystem.updateAlarms()
-        # Create required DBs
-        if DATABASES.USERS not in self.couchdb:
-            self.couchdb.create(DATABASES.USERS)
-        if DATABASES.BOTSTATE not in self.couchdb:
-            self.couchdb.create(DATABASES.BOTSTATE)
-            # Store everything in one doc
-            self.couchdb[DATABASES.BOTSTATE][DATABASES.BOTSTATE] = {}
-        # Now comes all the bot related stuff
-        self.updater = Updater(self.cfg[Config.BOT_TOKEN], request_kwargs={"read_timeout": 30})
+        self.pollScheduler = AdaptivePollScheduler(clock=self.clock)
+        self.applyPollSchedulerConfig()
+        self.editCache = MessageEditCache(clock=self.clock)
+        self.chartCache = ChartCache()
+        self.timers = shared.timers
+        self.profiler = shared.profiler
+        # Global snooze state is kept in memory and loaded from DB on startup
+        self.isSnoozed = False
+        self.snoozeUntil = 0
+        self.snoozeUserID = None
+        # Live status messages: userID -> messageID. Kept in memory so updating them doesn't require any DB requests.
+        self.liveStatusMessageIDs = {}
+        self.liveStatusLastTextHashes = {}
+        self.liveStatusLastEditTimestamps = {}
+        self.liveStatusEditIntervalSeconds = self.cfg.live_status_edit_interval_seconds
+        # Checked by the watchdog. Startup counts as success so the first poll has some time.
+        self.lastSuccessfulPollMonotonic = self.clock.monotonic()
+        self.lastUpdateStartedMonotonic = self.clock.monotonic()
+        # Independent startup steps run in parallel
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix='Startup') as executor:
+            dbInit = executor.submit(startupTimer.run, 'storage', self.initDB)
+            sensorInit = executor.submit(startupTimer.run, 'sensors', self.alarmsystem.updateAlarms)
+            telegramInit = executor.submit(startupTimer.run, 'telegram', self.initTelegram)
+            dbInit.result()
+            telegramInit.result()
+            try:
+                sensorInit.result()
+            except:
+                # Not fatal: Sensor data will be fetched again on the next batch run
+                logging.warning("Initial sensor update failed", exc_info=True)
+        startupTimer.run('handlers', self.initHandlers)
+        if self.alarmEngine is not None:
+            startupTimer.run('alarmEngine', self.alarmEngine.start)
+            self.alarmEngine.startEventThread(self.onAlarmEngineEvent)
+        logging.info(startupTimer.getSummary())
+
+    def initDB(self) -> None:
+        if self.cfg.storage_backend == STORAGE_BACKENDS.SQLITE:
+            backend = SQLiteStorage(self.cfg.sqlite_file)
+        else:
+            backend = CouchDBStorage(self.shared.getCouchDB(self.cfg.db_url), DatabaseNames(self.cfg.db_prefix))
+        # Keeps the bot working from an in-memory snapshot while the DB is unavailable
+        self.storage = ResilientStorage(backend, clock=self.clock, onAvailabilityChanged=self.onStorageAvailabilityChanged)
+        botDoc = self.getBotDoc()
+        self.setSnoozeState(botDoc.get(BOTDB.TIMESTAMP_SNOOZE_UNTIL, 0), botDoc.get(BOTDB.MUTED_BY_USER_ID))
+        try:
+            users = list(self.storage.getUsers())
+        except StorageUnavailableError:
+            # Bot starts anyway. Users get loaded once the DB is reachable.
+            logging.warning("DB is unavailable during startup -> Live status messages are inactive until restart")
+            users = []
+        for userID, userDoc in users:
+            if USERDB.MSG_ID_LIVE_STATUS in userDoc:
+                self.liveStatusMessageIDs[userID] = userDoc[USERDB.MSG_ID_LIVE_STATUS]
+
+    def onStorageAvailabilityChanged(self, isAvailable: bool) -> None:
+        if isAvailable:
+            text = SYMBOLS.CONFIRM + "Die Datenbank ist wieder erreichbar. Alle zwischenzeitlichen Änderungen wurden gespeichert."
+        else:
+            text = SYMBOLS.WARNING + "Die Datenbank ist nicht erreichbar. Alarme gehen weiterhin an alle bekannten Benutzer. Änderungen werden nachgetragen, sobald die Datenbank wieder erreichbar ist."
+        self.sendMessageToAllAdmins(text)
+
+    def initTelegram(self) -> None:
+        # Open menus keep working after restarts
+        persistence = None
+        if self.cfg.persistence_file is not None:
+            persistence = SQLitePersistence(self.cfg.persistence_file, flushIntervalSeconds=self.cfg.persistence_flush_interval_seconds)
+        self.updater = Updater(bot=TelegramBot(self.cfg.bot_token, request=self.shared.telegramRequest), persistence=persistence)
+        # Fails early on invalid token and caches bot info for later
+        self.updater.bot.get_me()
+
+    def initHandlers(self) -> None:
         dispatcher = self.updater.dispatcher
+        self.handlerLanes = self.shared.handlerLanes
+        interactive = self.handlerLanes[LANES.INTERACTIVE].wrap
+        background = self.handlerLanes[LANES.BACKGROUND].wrap
         # Main conversation handler - handles nearly all bot menus.
         conv_handler = ConversationHandler(
             entry_points=[CommandHandler('start', self.botDisplayMenuMain)],
             states={
                 CallbackVars.MENU_ASK_FOR_PASSWORD: [
                     CallbackQueryHandler(self.botDisplayMenuMain, pattern='^' + CallbackVars.MENU_MAIN + '$'),
-                    MessageHandler(Filters.text, self.botCheckPassword),
+                    MessageHandler(Filters.text, background(self.botCheckPassword)),
                 ],
                 CallbackVars.MENU_MAIN: [
                     # Main menu
                     CallbackQueryHandler(self.botDisplayMenuMain, pattern='^' + CallbackVars.MENU_MAIN + '$'),
-                    CallbackQueryHandler(self.botUnsnooze, pattern='^' + CallbackVars.UNMUTE + '$'),
-                    CallbackQueryHandler(self.botSnooze, pattern='^' + CallbackVars.MUTE_HOURS + '\\d+$'),
+                    CallbackQueryHandler(interactive(self.botUnsnooze), pattern='^' + CallbackVars.UNMUTE + '$'),
+                    CallbackQueryHandler(interactive(self.botSnooze), pattern='^' + CallbackVars.MUTE_HOURS + '\\d+$'),
                     CallbackQueryHandler(self.botSendUserDefinedBroadcastSTART, pattern='^' + CallbackVars.SEND_BROADCAST + '$'),
                     CallbackQueryHandler(self.botDisplaySettings, pattern='^' + CallbackVars.MENU_SETTINGS + '$'),
-                    CallbackQueryHandler(self.botAcpDisplayUserList, pattern='^' + CallbackVars.MENU_ACP + '$'),
+                    CallbackQueryHandler(self.botDisplayCharts, pattern='^' + CallbackVars.MENU_CHARTS + '$'),
+                    CallbackQueryHandler(background(self.botAcpDisplayUserList), pattern='^' + CallbackVars.MENU_ACP + '$'),
                     MessageHandler(filters=Filters.text and (~Filters.command), callback=self.botWTF),
                 ],
                 CallbackVars.SEND_BROADCAST: [
                     # Go back to main menu if user enters ANY command.
                     MessageHandler(Filters.command, self.botDisplayMenuMain),
-                    MessageHandler((Filters.photo | Filters.text), self.botSendUserDefinedBroadcast),
+                    MessageHandler((Filters.photo | Filters.text), background(self.botSendUserDefinedBroadcast)),
                 ],
                 CallbackVars.MENU_SETTINGS: [
                     CallbackQueryHandler(self.botDisplayMenuMain, pattern='^' + CallbackVars.MENU_MAIN + '$'),
                     CallbackQueryHandler(self.botDisplayOwnUserData, pattern='^' + CallbackVars.MENU_SETTINGS_DISPLAY_OWN_DATA + '$'),
                     CallbackQueryHandler(self.botDeleteOwnAccountSTART, pattern='^' + CallbackVars.MENU_SETTINGS_DELETE_ACCOUNT + '$'),
+                    CallbackQueryHandler(self.botTriggerLiveStatus, pattern='^' + CallbackVars.MENU_SETTINGS_TRIGGER_LIVE_STATUS + '$'),
+                ],
+                CallbackVars.MENU_CHARTS: [
+                    CallbackQueryHandler(self.botDisplayMenuMain, pattern='^' + CallbackVars.MENU_MAIN + '$'),
+                    CallbackQueryHandler(background(self.botSendChart), pattern='^' + CallbackVars.CHART + '\\d+_\\w+$'),
                 ],
                 CallbackVars.MENU_SETTINGS_DISPLAY_OWN_DATA: [
                     # Back button
@@ -133,16 +259,27 @@ class ABBot:
                 CallbackVars.MENU_ACP: [
                     CallbackQueryHandler(self.botDisplayMenuMain, pattern='^' + CallbackVars.MENU_MAIN + '$'),
                     CallbackQueryHandler(self.botDisplayACPActions, pattern='^' + CallbackVars.MENU_ACP_ACTIONS + '.+$'),
+                    CallbackQueryHandler(background(self.botAcpDisplayUserList), pattern='^' + CallbackVars.MENU_ACP_PAGE + '\\d+$'),
+                    CallbackQueryHandler(self.botAcpSearchUserSTART, pattern='^' + CallbackVars.MENU_ACP_SEARCH + '$'),
+                    CommandHandler('suche', self.botAcpSearchUser),
+                    CallbackQueryHandler(self.botAcpProfile, pattern='^' + CallbackVars.MENU_ACP_PROFILE + '\\d+$'),
+                ],
+                CallbackVars.MENU_ACP_SEARCH: [
+                    CommandHandler('suche', self.botAcpSearchUser),
+                    CommandHandler('start', self.botDisplayMenuMain),
+                    MessageHandler(Filters.text & (~Filters.command), self.botAcpSearchUser),
                 ],
                 CallbackVars.MENU_ACP_ACTIONS: [
-                    CallbackQueryHandler(self.botAcpDisplayUserList, pattern='^' + CallbackVars.MENU_ACP + '$'),
+                    CallbackQueryHandler(background(self.botAcpDisplayUserList), pattern='^' + CallbackVars.MENU_ACP_PAGE + '\\d+$'),
                     CallbackQueryHandler(self.botAcpApprovalAllow, pattern='^' + CallbackVars.MENU_ACP_APPROVE_USER + '.+$'),
                     CallbackQueryHandler(self.botAcpUserTriggerAdmin, pattern='^' + CallbackVars.MENU_ACP_ACTION_TRIGGER_ADMIN + '.+$'),
-                    CallbackQueryHandler(self.botAcpUserDelete, pattern='^' + CallbackVars.MENU_ACP_ACTION_DELETE_USER + '.+$'),
-                ]
+                    CallbackQueryHandler(background(self.botAcpUserDelete), pattern='^' + CallbackVars.MENU_ACP_ACTION_DELETE_USER + '.+$'),
+                ],
+                ConversationHandler.WAITING: self.getWaitingHandlers(),
             },
             fallbacks=[CommandHandler('start', self.botDisplayMenuMain)],
             name="MainConversationHandler",
+            persistent=dispatcher.persistence is not None,
         )
         dispatcher.add_handler(conv_handler)
         conv_handler2 = ConversationHandler(
@@ -156,29 +293,45 @@ class ABBot:
             },
             fallbacks=[CommandHandler('start', self.botDisplayMenuMain)],
             name="UserApprovalHandler",
+            persistent=dispatcher.persistence is not None,
             # allow_reentry=True,
         )
         dispatcher.add_handler(conv_handler2)
+        # Runs before all other handlers -> Lets the watchdog detect a stuck dispatcher
+        dispatcher.add_handler(TypeHandler(Update, self.onUpdateStarted), group=-1)
         dispatcher.add_error_handler(self.botErrorCallback)
 
+    def getWaitingHandlers(self) -> list:
+        """ Handlers for updates of users whose last lane handler is still running. Without them PTB silently drops these updates. """
+        return [
+            # Approvals belong to the UserApprovalHandler -> Let them through
+            CallbackQueryHandler(self.botBusy, pattern='^(?!' + CallbackVars.APPROVE_USER + '|' + CallbackVars.DECLINE_USER + ')'),
+            MessageHandler(Filters.all, self.botBusy),
+        ]
+
+    def onUpdateStarted(self, update: Update, context: CallbackContext) -> None:
+        self.lastUpdateStartedMonotonic = self.clock.monotonic()
+
     def botErrorCallback(self, update: Update, context: CallbackContext) -> None:
         try:
             raise context.error
         except BotException as botError:
             menuText = botError.getErrorMsg()
+            if update.callback_query is not None:
+                try:
+                    # Stops the loading spinner of the button e.g. if its lane is full. Fails if the handler has already answered.
+                    update.callback_query.answer()
+                except TelegramError:
+                    pass
             try:
                 self.sendMessage(chat_id=update.effective_user.id, text=menuText, reply_markup=botError.getReplyMarkup())
             except:
-                traceback.print_exc()
-                logging.warning('Exception during exception handling -> Raising initial Exception')
+                logging.warning('Exception during exception handling -> Raising initial Exception', exc_info=True)
                 raise botError
         return None
 
     def isNewUser(self, userID: int) -> bool:
-        if str(userID) in self.couchdb[DATABASES.USERS]:
-            return False
-        else:
-            return True
+        return not self.storage.hasUser(str(userID))
 
     def userIsApproved(self, userID: Union[int, str]) -> bool:
         userDoc = self.getUserDoc(userID)
@@ -216,23 +369,26 @@ class ABBot:
         # User has used bot in the meantime so he won't pay attention to that old "snoozed by..." message -> Remove this property from DB in order to save http requests!
         if USERDB.MSG_ID_LAST_SNOOZE_NOTIFICATION in userDoc:
             del userDoc[USERDB.MSG_ID_LAST_SNOOZE_NOTIFICATION]
+        if USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR in userDoc:
+            # User is back -> Include him in notifications again
+            del userDoc[USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR]
         # Update DB
-        self.couchdb[DATABASES.USERS].save(userDoc)
+        self.storage.saveUser(userDoc)
         if not self.userIsApproved(update.effective_user.id):
             menuText = 'Warte auf Freischaltung durch einen Admin.'
             menuText += '\nDu wirst benachrichtigt, sobald dein Account freigeschaltet wurde.'
-            userDoc[USERDB.TIMESTAMP_LAST_APPROVAL_REQUEST] = datetime.now().timestamp()
-            self.couchdb[DATABASES.USERS].save(userDoc)
+            userDoc[USERDB.TIMESTAMP_LAST_APPROVAL_REQUEST] = self.clock.now()
+            self.storage.saveUser(userDoc)
             self.botEditOrSendNewMessage(update, context, menuText)
             return CallbackVars.MENU_MAIN
         else:
             menuText = 'Hallo ' + update.effective_user.first_name + ','
             mainMenuKeyboard = []
-            if self.getCurrentGlobalSnoozeTimestamp() > datetime.now().timestamp():
+            if self.getCurrentGlobalSnoozeTimestamp() > self.clock.now():
                 userWhoSnoozed = self.getCurrentGlobalSnoozeUserID()
                 menuText += '\nBot Alarme:' + SYMBOLS.WARNING
                 menuText += '\n<b>Deaktiviert bis: ' + formatTimestampToGermanDate(
-                    self.getCurrentGlobalSnoozeTimestamp()) + ' (noch ' + getFormattedTimeDelta(self.getCurrentGlobalSnoozeTimestamp()) + ')</b>'
+                    self.getCurrentGlobalSnoozeTimestamp()) + ' (noch ' + getFormattedTimeDelta(self.getCurrentGlobalSnoozeTimestamp(), self.clock) + ')</b>'
                 menuText += '\nVon: ' + self.getMeaningfulUserTitleInContext(userWhoSnoozed, update.effective_user.id)
                 if str(userWhoSnoozed) == str(update.effective_user.id):
                     # Remind user who disarmed alarm system to arm it again ;)
@@ -247,20 +403,12 @@ class ABBot:
                                          InlineKeyboardButton('12 Stunden', callback_data=CallbackVars.MUTE_HOURS + '12')])
                 mainMenuKeyboard.append([InlineKeyboardButton('24 Stunden', callback_data=CallbackVars.MUTE_HOURS + '24'),
                                          InlineKeyboardButton('48 Stunden', callback_data=CallbackVars.MUTE_HOURS + '48')])
-            mainMenuKeyboard.append([InlineKeyboardButton(SYMBOLS.MEGAPHONE + 'Broadcast', callback_data=CallbackVars.SEND_BROADCAST)])
+            mainMenuKeyboard.append([InlineKeyboardButton(SYMBOLS.MEGAPHONE + 'Broadcast', callback_data=CallbackVars.SEND_BROADCAST),
+                                     InlineKeyboardButton(SYMBOLS.CHART + 'Verlauf', callback_data=CallbackVars.MENU_CHARTS)])
             mainMenuKeyboard.append([InlineKeyboardButton(SYMBOLS.WRENCH + 'Einstellungen', callback_data=CallbackVars.MENU_SETTINGS)])
-            # menuText += "\nLetzte Sensordaten vom " + formatDatetimeToGermanDate(self.alarmsystem.lastSensorUpdateServersideDatetime) + " (vor " + getFormattedDuration(datetime.now().timestamp() - self.alarmsystem.lastSensorUpdateServersideDatetime.timestamp()) + "):"
+            # menuText += "\nLetzte Sensordaten vom " + formatDatetimeToGermanDate(self.alarmsystem.lastSensorUpdateServersideDatetime) + " (vor " + getFormattedDuration(self.clock.now() - self.alarmsystem.lastSensorUpdateServersideDatetime.timestamp()) + "):"
             # Only show sensor data if current data is available!
-            if self.alarmsystem.noDataAlarmHasBeenTriggered:
-                menuText += "\nAlarmsystem Sensordaten: " + SYMBOLS.WARNING + formatDatetimeToGermanDate(self.alarmsystem.lastSensorUpdateServersideDatetime)
-                # menuText += "\nLetzte Sensordaten vom " + formatDatetimeToGermanDate(self.alarmsystem.lastSensorUpdateServersideDatetime)
-                menuText += "\n--> Die Alarmanlage ist entweder deaktiviert oder leer!"
-            else:
-                menuText += "\n\nAlarmsystem Sensordaten: " + SYMBOLS.CONFIRM + formatDatetimeToGermanDate(self.alarmsystem.lastSensorUpdateServersideDatetime)
-                menuText += "<pre>"
-                for sensor in list(self.alarmsystem.sensors.values()):
-                    menuText += "\n" + sensor.getName() + ": " + str(sensor.getValue()) + " | " + sensor.getStatusText()
-                menuText += "</pre>"
+            menuText += self.getSensorDataText()
             if userDoc.get(USERDB.IS_ADMIN, False):
                 # menuText += '\n' + SYMBOLS.CONFIRM + '<b>Du bist Admin!</b>'
                 mainMenuKeyboard.append([InlineKeyboardButton(SYMBOLS.FLASH + 'ACP', callback_data=CallbackVars.MENU_ACP)])
@@ -269,28 +417,194 @@ class ABBot:
                                          reply_markup=InlineKeyboardMarkup(mainMenuKeyboard))
         return CallbackVars.MENU_MAIN
 
+    def getSensorDataText(self) -> str:
+        """ Returns current state of all sensors. Only shows sensor data if current data is available! """
+        if self.alarmsystem.noDataAlarmHasBeenTriggered:
+            text = "\nAlarmsystem Sensordaten: " + SYMBOLS.WARNING + formatDatetimeToGermanDate(self.alarmsystem.lastSensorUpdateServersideDatetime)
+            # text += "\nLetzte Sensordaten vom " + formatDatetimeToGermanDate(self.alarmsystem.lastSensorUpdateServersideDatetime)
+            text += "\n--> Die Alarmanlage ist entweder deaktiviert oder leer!"
+        else:
+            text = "\n\nAlarmsystem Sensordaten: " + SYMBOLS.CONFIRM + formatDatetimeToGermanDate(self.alarmsystem.lastSensorUpdateServersideDatetime)
+            text += "<pre>"
+            for sensor in list(self.alarmsystem.sensors.values()):
+                text += "\n" + sensor.getName() + ": " + str(sensor.getValue()) + " | " + sensor.getStatusText()
+            for rule in self.alarmsystem.ruleEngine.rules:
+                text += "\n" + rule.getName() + ": " + rule.getStatusText()
+            text += "</pre>"
+        return text
+
+    def getLiveStatusText(self) -> str:
+        """ Returns text of live status messages. Must not contain anything that changes without sensor- or snooze state changing e.g. the current time! """
+        text = SYMBOLS.INFORMATION + "<b>Live Status</b>"
+        if self.isGloballySnoozed():
+            text += "\nBot Alarme: " + SYMBOLS.WARNING + "Deaktiviert bis: " + formatTimestampToGermanDate(self.getCurrentGlobalSnoozeTimestamp())
+        else:
+            text += "\nBot Alarme: " + SYMBOLS.CONFIRM
+        text += self.getSensorDataText()
+        text += "\n<i>Diese Nachricht wird automatisch aktualisiert. Deaktivieren in den Einstellungen.</i>"
+        return text
+
+    def updateLiveStatusMessages(self) -> None:
+        """ Edits live status messages of all users who enabled them. Skips edits if nothing has changed and allows max. one edit per user every X seconds. """
+        if len(self.liveStatusMessageIDs) == 0:
+            return
+        text = self.getLiveStatusText()
+        textHash = hash(text)
+        now = self.clock.monotonic()
+        for userID, messageID in list(self.liveStatusMessageIDs.items()):
+            lastEditTimestamp = self.liveStatusLastEditTimestamps.get(userID)
+            if self.liveStatusLastTextHashes.get(userID) == textHash:
+                # Nothing has changed
+                continue
+            elif lastEditTimestamp is not None and now - lastEditTimestamp < self.liveStatusEditIntervalSeconds:
+                # Coalesce edits -> Latest state will be sent in one of the next runs
+                continue
+            self.editMessage(userID, messageID, text=text)
+            self.liveStatusLastTextHashes[userID] = textHash
+            self.liveStatusLastEditTimestamps[userID] = now
+
+    def botTriggerLiveStatus(self, update: Update, context: CallbackContext):
+        """ Enables/disables pinned live status message for current user. """
+        query = update.callback_query
+        query.answer()
+        userID = str(update.effective_user.id)
+        userDoc = self.getUserDoc(userID)
+        if USERDB.MSG_ID_LIVE_STATUS in userDoc:
+            messageID = userDoc[USERDB.MSG_ID_LIVE_STATUS]
+            del userDoc[USERDB.MSG_ID_LIVE_STATUS]
+            self.storage.saveUser(userDoc)
+            self.liveStatusMessageIDs.pop(userID, None)
+            self.liveStatusLastTextHashes.pop(userID, None)
+            self.liveStatusLastEditTimestamps.pop(userID, None)
+            self.editMessage(userID, messageID, text=SYMBOLS.INFORMATION + "<b>Live Status beendet</b>")
+            try:
+                context.bot.unpin_chat_message(chat_id=userID, message_id=messageID)
+            except BadRequest:
+                # E.g. user has unpinned that message already
+                pass
+        else:
+            text = self.getLiveStatusText()
+            msg = self.sendMessage(userID, text)
+            if msg is not None:
+                userDoc[USERDB.MSG_ID_LIVE_STATUS] = msg.message_id
+                self.storage.saveUser(userDoc)
+                self.liveStatusMessageIDs[userID] = msg.message_id
+                self.liveStatusLastTextHashes[userID] = hash(text)
+                self.liveStatusLastEditTimestamps[userID] = self.clock.monotonic()
+                try:
+                    context.bot.pin_chat_message(chat_id=userID, message_id=msg.message_id, disable_notification=True)
+                except BadRequest:
+                    pass
+        return self.botDisplaySettings(update, context)
+
     def botAcpDisplayUserList(self, update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
         self.adminOrException(update.effective_user.id)
-        users = self.getAllUsersExceptOne(update.effective_user.id)
+        if query.data.startswith(CallbackVars.MENU_ACP_PAGE):
+            page = int(query.data.replace(CallbackVars.MENU_ACP_PAGE, ""))
+        elif query.data == CallbackVars.MENU_ACP:
+            page = 0
+        else:
+            # E.g. user has just been deleted -> Stay on current page
+            page = context.user_data.get(USERDATA.ACP_PAGE, 0)
+        context.user_data[USERDATA.ACP_PAGE] = page
+        # Cursor = first key + docID of every page -> Each page costs exactly one DB request
+        pageCursors = context.user_data.setdefault(USERDATA.ACP_PAGE_CURSORS, {})
+        # Skip = Fallback e.g. after restart
+        rows = self.storage.getUserList(ACP_USERS_PER_PAGE + 1, cursor=pageCursors.get(page), skip=page * ACP_USERS_PER_PAGE)
+        hasNextPage = len(rows) > ACP_USERS_PER_PAGE
+        if hasNextPage:
+            nextPageFirstRow = rows.pop()
+            pageCursors[page + 1] = [nextPageFirstRow.key, nextPageFirstRow.id]
+        ownUserIDStr = str(update.effective_user.id)
         acpKeyboard = []
-        if len(users) == 0:
+        for row in rows:
+            if row.id == ownUserIDStr:
+                continue
+            acpKeyboard.append([InlineKeyboardButton(self.getUserRightsPrefixFromDoc(row.value) + self.getMeaningfulUserTitleFromDoc(row.id, row.value),
+                                                     callback_data=CallbackVars.MENU_ACP_ACTIONS + row.id)])
+        if len(acpKeyboard) == 0 and page == 0:
             # Edge-case
             menuText = "<b>Es gibt außer dir noch keine weiteren Benutzer!</b>"
         else:
-            for userIDStr in users:
-                userPrefix = self.getUserRightsPrefix(userIDStr)
-                acpKeyboard.append([InlineKeyboardButton(userPrefix + self.getMeaningfulUserTitle(userIDStr), callback_data=CallbackVars.MENU_ACP_ACTIONS + userIDStr)])
-            menuText = "<b>Benutzerliste:</b>"
+            menuText = "<b>Benutzerliste (Seite " + str(page + 1) + "):</b>"
             menuText += "\nBenutzer werden nicht zwangsläufig über Änderungen informiert!"
             menuText += "\n<b>Obacht</b>: Alle Aktionen passieren sofort und ohne Notwendigkeit einer Bestätigung!"
             menuText += "\n" + SYMBOLS.STAR + " = Admin"
             menuText += "\n" + SYMBOLS.WARNING + " = Unbestätigter User"
+            menuText += "\nBenutzer suchen: /suche Name"
+        navigationButtons = []
+        if page > 0:
+            navigationButtons.append(InlineKeyboardButton(SYMBOLS.BACK + 'Seite ' + str(page), callback_data=CallbackVars.MENU_ACP_PAGE + str(page - 1)))
+        if hasNextPage:
+            navigationButtons.append(InlineKeyboardButton(SYMBOLS.ARROW_RIGHT + 'Seite ' + str(page + 2), callback_data=CallbackVars.MENU_ACP_PAGE + str(page + 1)))
+        if len(navigationButtons) > 0:
+            acpKeyboard.append(navigationButtons)
+        acpKeyboard.append([InlineKeyboardButton(SYMBOLS.INFORMATION + 'Suchen', callback_data=CallbackVars.MENU_ACP_SEARCH)])
+        acpKeyboard.append([InlineKeyboardButton(SYMBOLS.WRENCH + 'Profiler 10s', callback_data=CallbackVars.MENU_ACP_PROFILE + '10'),
+                            InlineKeyboardButton(SYMBOLS.WRENCH + 'Profiler 60s', callback_data=CallbackVars.MENU_ACP_PROFILE + '60')])
         acpKeyboard.append([InlineKeyboardButton(SYMBOLS.BACK + 'Zurück ', callback_data=CallbackVars.MENU_MAIN)])
         self.botEditOrSendNewMessage(update, context, menuText, reply_markup=InlineKeyboardMarkup(acpKeyboard))
         return CallbackVars.MENU_ACP
 
+    def botAcpProfile(self, update: Update, context: CallbackContext):
+        """ Samples what all threads are doing for X seconds and sends the result to the admin as a file. """
+        query = update.callback_query
+        self.adminOrException(update.effective_user.id)
+        seconds = int(query.data.replace(CallbackVars.MENU_ACP_PROFILE, ""))
+        chatID = update.effective_user.id
+
+        def onDone(report: str):
+            logging.info("Sending profiler results to " + str(chatID))
+            self.sendDocument(chatID, BytesIO(report.encode('utf-8')), filename='profile.txt', caption=SYMBOLS.WRENCH + "Profiler Ergebnis (" + str(seconds) + "s)")
+
+        if self.profiler.start(seconds, onDone):
+            query.answer(text="Profiler läuft " + str(seconds) + " Sekunden. Das Ergebnis kommt als Datei.", show_alert=True)
+        else:
+            query.answer(text="Der Profiler läuft bereits.", show_alert=True)
+        return CallbackVars.MENU_ACP
+
+    def botAcpSearchUserSTART(self, update: Update, context: CallbackContext):
+        query = update.callback_query
+        query.answer()
+        self.adminOrException(update.effective_user.id)
+        text = SYMBOLS.INFORMATION + "Gib den Anfang eines Namens oder Benutzernamens ein."
+        text += "\nZurück ins Hauptmenü mit /start!"
+        self.botEditOrSendNewMessage(update, context, text)
+        return CallbackVars.MENU_ACP_SEARCH
+
+    def botAcpSearchUser(self, update: Update, context: CallbackContext):
+        """ Searches users by first name, last name or username via prefix search -> One DB request. """
+        self.adminOrException(update.effective_user.id)
+        if context.args is not None:
+            # /suche command
+            searchTerm = ' '.join(context.args)
+        else:
+            searchTerm = update.message.text
+        searchTerm = searchTerm.strip().lstrip('@').lower()
+        if len(searchTerm) == 0:
+            self.botEditOrSendNewMessage(update, context, SYMBOLS.DENY + "Verwendung: /suche Name")
+            return CallbackVars.MENU_ACP_SEARCH
+        rows = self.storage.searchUsers(searchTerm, limit=ACP_USERS_PER_PAGE * 3)
+        acpKeyboard = []
+        foundUserIDs = set()
+        for row in rows:
+            # Multiple names of the same user can match
+            if row.id in foundUserIDs or len(foundUserIDs) >= ACP_USERS_PER_PAGE:
+                continue
+            foundUserIDs.add(row.id)
+            acpKeyboard.append([InlineKeyboardButton(self.getUserRightsPrefixFromDoc(row.value) + self.getMeaningfulUserTitleFromDoc(row.id, row.value),
+                                                     callback_data=CallbackVars.MENU_ACP_ACTIONS + row.id)])
+        if len(acpKeyboard) == 0:
+            menuText = SYMBOLS.DENY + "Keine Benutzer gefunden für: " + searchTerm
+            menuText += "\nErneut suchen: /suche Name"
+        else:
+            menuText = "<b>Suchergebnisse für: " + searchTerm + "</b>"
+        acpKeyboard.append([InlineKeyboardButton(SYMBOLS.BACK + 'Zurück ', callback_data=CallbackVars.MENU_ACP_PAGE + str(context.user_data.get(USERDATA.ACP_PAGE, 0)))])
+        self.botEditOrSendNewMessage(update, context, menuText, reply_markup=InlineKeyboardMarkup(acpKeyboard))
+        return CallbackVars.MENU_ACP
+
     def botDisplayACPActions(self, update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
@@ -321,7 +635,7 @@ class ABBot:
                 menuText += "\nZuletzt snoozed: Nie"
             menuText += "\n" + SYMBOLS.DENY + "Löschen = Benutzer muss sich erneut mit Passwort anmelden und bestätigt werden und kann den Bot ansonsten nicht mehr verwenden."
         userOptions.append([InlineKeyboardButton(SYMBOLS.DENY + 'Löschen', callback_data=CallbackVars.MENU_ACP_ACTION_DELETE_USER + userIDStr)])
-        userOptions.append([InlineKeyboardButton(SYMBOLS.BACK + 'Zurück', callback_data=CallbackVars.MENU_ACP)])
+        userOptions.append([InlineKeyboardButton(SYMBOLS.BACK + 'Zurück', callback_data=CallbackVars.MENU_ACP_PAGE + str(context.user_data.get(USERDATA.ACP_PAGE, 0)))])
         self.botEditOrSendNewMessage(update, context, menuText,
                                      reply_markup=InlineKeyboardMarkup(userOptions))
         return CallbackVars.MENU_ACP_ACTIONS
@@ -329,30 +643,33 @@ class ABBot:
     def botSnooze(self, update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
-        if self.getCurrentGlobalSnoozeTimestamp() < datetime.now().timestamp():
+        if not self.isGloballySnoozed():
             snoozeHours = int(query.data.replace(CallbackVars.MUTE_HOURS, ""))
-            snoozeUntil = datetime.now().timestamp() + snoozeHours * 60 * 60
+            snoozeUntil = self.clock.now() + snoozeHours * 60 * 60
             # Save user state first. This also ensures that an exception will happen if that user e.g. has been removed from DB recently and presses a button afterwards!
             userDoc = self.getUserDoc(update.effective_user.id)
             userDoc[USERDB.TIMESTAMP_SNOOZE_UNTIL] = snoozeUntil
-            userDoc[USERDB.TIMESTAMP_LAST_SNOOZE] = datetime.now().timestamp()
-            self.couchdb[DATABASES.USERS].save(userDoc)
+            userDoc[USERDB.TIMESTAMP_LAST_SNOOZE] = self.clock.now()
+            self.storage.saveUser(userDoc)
             # Save global state
-            botDoc = self.couchdb[DATABASES.BOTSTATE][DATABASES.BOTSTATE]
+            botDoc = self.getBotDoc()
             botDoc[BOTDB.TIMESTAMP_SNOOZE_UNTIL] = snoozeUntil
             botDoc[BOTDB.MUTED_BY_USER_ID] = update.effective_user.id
-            self.couchdb[DATABASES.BOTSTATE].save(botDoc)
+            self.storage.saveBotDoc(botDoc)
+            self.setSnoozeState(snoozeUntil, update.effective_user.id)
             text = SYMBOLS.WARNING + self.getMeaningfulUserTitle(self.getCurrentGlobalSnoozeUserID()) + " hat Benachrichtigungen deaktiviert bis: " + formatTimestampToGermanDate(
-                self.getCurrentGlobalSnoozeTimestamp()) + ' (noch ' + getFormattedTimeDelta(self.getCurrentGlobalSnoozeTimestamp()) + ')!'
+                self.getCurrentGlobalSnoozeTimestamp()) + ' (noch ' + getFormattedTimeDelta(self.getCurrentGlobalSnoozeTimestamp(), self.clock) + ')!'
             text += '\nMit /start siehst du den aktuellen Stand.'
             users = self.getApprovedUsersExceptOne(update.effective_user.id)
             logging.info("Sending messages to " + str(len(users)) + " users...")
             for userID in users:
                 userDoc = self.getUserDoc(userID)
+                if USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR in userDoc:
+                    continue
                 msg = self.sendMessage(userID, text=self.getSnoozedUntilText(True))
                 if msg is not None:
                     userDoc[USERDB.MSG_ID_LAST_SNOOZE_NOTIFICATION] = msg.message_id
-                    self.couchdb[DATABASES.USERS].save(userDoc)
+                    self.storage.saveUser(userDoc)
         else:
             logging.info("User attempted snooze but snooze is already active: " + str(update.effective_user.id))
         return self.botDisplayMenuMain(update, context)
@@ -361,7 +678,7 @@ class ABBot:
         text = SYMBOLS.WARNING + self.getMeaningfulUserTitle(self.getCurrentGlobalSnoozeUserID()) + " hat Benachrichtigungen deaktiviert bis: " + formatTimestampToGermanDate(
             self.getCurrentGlobalSnoozeTimestamp())
         if addETA:
-            text += ' (noch ' + getFormattedTimeDelta(self.getCurrentGlobalSnoozeTimestamp()) + ')'
+            text += ' (noch ' + getFormattedTimeDelta(self.getCurrentGlobalSnoozeTimestamp(), self.clock) + ')'
         text += '!'
         text += '\nMit /start siehst du den aktuellen Stand.'
         return text
@@ -376,7 +693,8 @@ class ABBot:
             del botDoc[BOTDB.TIMESTAMP_SNOOZE_UNTIL]
         if BOTDB.MUTED_BY_USER_ID in botDoc:
             del botDoc[BOTDB.MUTED_BY_USER_ID]
-        self.couchdb[DATABASES.BOTSTATE].save(botDoc)
+        self.storage.saveBotDoc(botDoc)
+        self.setSnoozeState(0, None)
         users = self.getApprovedUsersExceptOne(update.effective_user.id)
         logging.info("Editing snooze messages of " + str(len(users)) + " users...")
         # Edit "snoozed" message of all users for which this still is the last message in their message history with this bot!
@@ -388,6 +706,35 @@ class ABBot:
                 self.editMessage(userID, userDoc[USERDB.MSG_ID_LAST_SNOOZE_NOTIFICATION], text=text)
         return self.botDisplayMenuMain(update, context)
 
+    def setSnoozeState(self, snoozeUntil: float, userID: Union[int, str, None]) -> None:
+        """ Updates in-memory snooze state and (re-)schedules the end of the snooze. """
+        self.snoozeUntil = snoozeUntil
+        self.snoozeUserID = userID
+        self.isSnoozed = snoozeUntil > self.clock.now()
+        if self.alarmEngine is not None:
+            self.alarmEngine.setSnoozeUntil(snoozeUntil)
+        if self.isSnoozed:
+            self.timers.schedule(self.getTimerKey(TIMERS.SNOOZE_EXPIRY), snoozeUntil, self.onSnoozeExpired)
+        else:
+            self.timers.cancel(self.getTimerKey(TIMERS.SNOOZE_EXPIRY))
+
+    def onSnoozeExpired(self) -> None:
+        """ Lets all users know that alarms are active again and marks their old snooze messages as expired. """
+        baseText = self.getSnoozedUntilText(False)
+        botDoc = self.getBotDoc()
+        botDoc.pop(BOTDB.TIMESTAMP_SNOOZE_UNTIL, None)
+        botDoc.pop(BOTDB.MUTED_BY_USER_ID, None)
+        self.storage.saveBotDoc(botDoc)
+        self.setSnoozeState(0, None)
+        logging.info("Snooze has expired")
+        users = self.getApprovedUsers()
+        for userID, userDoc in users.items():
+            if USERDB.MSG_ID_LAST_SNOOZE_NOTIFICATION in userDoc:
+                self.editMessage(userID, userDoc[USERDB.MSG_ID_LAST_SNOOZE_NOTIFICATION], text=baseText + "\n<b>EDIT\nStummschaltung abgelaufen</b>")
+                del userDoc[USERDB.MSG_ID_LAST_SNOOZE_NOTIFICATION]
+                self.storage.saveUser(userDoc)
+        self.sendMessageToMultipleUsers(users, SYMBOLS.CONFIRM + "<b>Stummschaltung abgelaufen: Alarme sind wieder aktiv!</b>")
+
     def botApprovalAllow(self, update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
@@ -427,9 +774,16 @@ class ABBot:
 
     def getUserRightsPrefix(self, userIDStr) -> str:
         """ Returns prefix based on current users rights/state e.g. admin or user waiting for approval. """
-        if not self.userIsApproved(userIDStr):
+        userDoc = self.getUserDoc(userIDStr)
+        if userDoc is None:
             return SYMBOLS.WARNING
-        elif self.userIsAdmin(userIDStr):
+        return self.getUserRightsPrefixFromDoc(userDoc)
+
+    @staticmethod
+    def getUserRightsPrefixFromDoc(userDoc: dict) -> str:
+        if not userDoc.get(USERDB.IS_APPROVED, False):
+            return SYMBOLS.WARNING
+        elif userDoc.get(USERDB.IS_ADMIN, False):
             return SYMBOLS.STAR
         else:
             return ''
@@ -447,13 +801,13 @@ class ABBot:
             return
         userDoc[USERDB.IS_APPROVED] = True
         userDoc[USERDB.APPROVED_BY] = adminUserID
-        userDoc[USERDB.TIMESTAMP_APPROVED] = datetime.now().timestamp()
+        userDoc[USERDB.TIMESTAMP_APPROVED] = self.clock.now()
         # Inform user that he has been approved
         text = SYMBOLS.CONFIRM + "Du wurdest freigeschaltet!"
         text += "\nMit /start kommst du in das Hauptmenü."
         self.sendMessage(userID, text)
         # Update DB
-        self.couchdb[DATABASES.USERS].save(userDoc)
+        self.storage.saveUser(userDoc)
         # Edit approval request messages of all other admins
         allOtherAdmins = self.getAdminsExceptOne(adminUserID)
         text = SYMBOLS.CONFIRM + self.getMeaningfulUserTitle(userID) + " wurde freigeschaltet von " + self.getMeaningfulUserTitle(adminUserID)
@@ -467,7 +821,7 @@ class ABBot:
             self.editMessage(adminUserIDTmp, thisUserApprovalMessageID, text=text)
             # Update DB
             del approvalRequestsMessageIDs[userID]
-            self.couchdb[DATABASES.USERS].save(adminDoc)
+            self.storage.saveUser(adminDoc)
 
     def denyUser(self, userID: Union[int, str], adminUserID: Union[int, str]) -> None:
         """
@@ -500,15 +854,16 @@ class ABBot:
             self.editMessage(adminUserIDTmp, thisUserApprovalMessageID, text=text)
             # Update DB
             del approvalRequestsMessageIDs[userID]
-            self.couchdb[DATABASES.USERS].save(adminDoc)
-        del self.couchdb[DATABASES.USERS][userID]
+            self.storage.saveUser(adminDoc)
+        self.storage.deleteUser(userID)
+        self.liveStatusMessageIDs.pop(userID, None)
 
     def userExistsInDB(self, userID: Union[int, str]) -> bool:
-        return str(userID) in self.couchdb[DATABASES.USERS]
+        return self.storage.hasUser(str(userID))
 
     def botCheckPassword(self, update: Update, context: CallbackContext):
         user_input = update.message.text
-        if user_input == self.cfg[Config.BOT_PASSWORD]:
+        if user_input == self.cfg.bot_password:
             # User entered correct password -> Add userdata to DB
             userData = {
                 USERDB.FIRST_NAME: update.effective_user.first_name
@@ -517,20 +872,20 @@ class ABBot:
                 userData[USERDB.USERNAME] = update.effective_user.username
             if update.effective_user.last_name is not None:
                 userData[USERDB.LAST_NAME] = update.effective_user.last_name
-            userData[USERDB.TIMESTAMP_REGISTERED] = datetime.now().timestamp()
+            userData[USERDB.TIMESTAMP_REGISTERED] = self.clock.now()
             text = SYMBOLS.CONFIRM + "Korrektes Passwort!"
-            if len(self.couchdb[DATABASES.USERS]) == 0:
+            if len(self.getUserIDs()) == 0:
                 # First user is admin
                 userData[USERDB.IS_ADMIN] = True
                 # Update DB
-                self.couchdb[DATABASES.USERS][str(update.effective_user.id)] = userData
+                self.storage.createUser(str(update.effective_user.id), userData)
                 # Small "workaround" as first user is basically approved by itself!
                 self.approveUser(str(update.effective_user.id), str(update.effective_user.id))
                 text += "\n<b>Gratulation! Du bist der erste User -> Admin!</b>"
             else:
                 text += "\nWarte auf Freischaltung durch einen Admin."
                 text += "\nDu wirst benachrichtigt, sobald dein Account freigeschaltet wurde."
-                self.couchdb[DATABASES.USERS][str(update.effective_user.id)] = userData
+                self.storage.createUser(str(update.effective_user.id), userData)
                 self.sendUserApprovalRequestToAllAdmins(update.effective_user.id)
             self.sendMessage(update.effective_message.chat_id, text)
             return CallbackVars.MENU_MAIN
@@ -543,23 +898,68 @@ class ABBot:
         query = update.callback_query
         query.answer()
         text = SYMBOLS.WRENCH + "<b>Einstellungen</b>"
+        if str(update.effective_user.id) in self.liveStatusMessageIDs:
+            liveStatusButton = InlineKeyboardButton(SYMBOLS.CONFIRM + 'Live Status', callback_data=CallbackVars.MENU_SETTINGS_TRIGGER_LIVE_STATUS)
+        else:
+            liveStatusButton = InlineKeyboardButton(SYMBOLS.DENY2 + 'Live Status', callback_data=CallbackVars.MENU_SETTINGS_TRIGGER_LIVE_STATUS)
         settingsKeyboard = [
             [InlineKeyboardButton(SYMBOLS.INFORMATION + 'DSGVO Anfrage', callback_data=CallbackVars.MENU_SETTINGS_DISPLAY_OWN_DATA),
              InlineKeyboardButton(SYMBOLS.DENY + 'Account löschen', callback_data=CallbackVars.MENU_SETTINGS_DELETE_ACCOUNT)],
+            [liveStatusButton],
             [InlineKeyboardButton(SYMBOLS.BACK + 'Zurück', callback_data=CallbackVars.MENU_MAIN)]
         ]
         reply_markup = InlineKeyboardMarkup(settingsKeyboard)
         self.botEditOrSendNewMessage(update, context, text=text, reply_markup=reply_markup)
         return CallbackVars.MENU_SETTINGS
 
+    def botDisplayCharts(self, update: Update, context: CallbackContext):
+        query = update.callback_query
+        query.answer()
+        if not self.userIsApproved(update.effective_user.id):
+            raise BotException(SYMBOLS.WARNING + "Warte auf Freischaltung durch einen Admin.")
+        text = SYMBOLS.CHART + "<b>Verlauf</b>\nFür welchen Sensor und Zeitraum?"
+        chartsKeyboard = []
+        for fieldID, sensor in list(self.alarmsystem.sensors.items()):
+            chartsKeyboard.append([InlineKeyboardButton(sensor.getName() + ' ' + rangeText, callback_data=CallbackVars.CHART + str(fieldID) + '_' + rangeKey)
+                                   for rangeKey, (seconds, rangeText) in CHART_RANGES.items()])
+        chartsKeyboard.append([InlineKeyboardButton(SYMBOLS.BACK + 'Zurück', callback_data=CallbackVars.MENU_MAIN)])
+        self.botEditOrSendNewMessage(update, context, text=text, reply_markup=InlineKeyboardMarkup(chartsKeyboard))
+        return CallbackVars.MENU_CHARTS
+
+    def botSendChart(self, update: Update, context: CallbackContext):
+        """ Sends a chart of the recent values of one sensor. Charts are rendered once per data version and uploaded once -> Repeated views only send the file_id. """
+        query = update.callback_query
+        query.answer()
+        if not self.userIsApproved(update.effective_user.id):
+            raise BotException(SYMBOLS.WARNING + "Warte auf Freischaltung durch einen Admin.")
+        fieldIDStr, rangeKey = query.data.replace(CallbackVars.CHART, "").split('_', 1)
+        fieldID = int(fieldIDStr)
+        sensor = self.alarmsystem.sensors.get(fieldID)
+        if sensor is None or rangeKey not in CHART_RANGES:
+            raise BotException(SYMBOLS.WARNING + "Diesen Sensor gibt es nicht mehr.")
+        seconds, rangeText = CHART_RANGES[rangeKey]
+        cacheKey = (fieldID, rangeKey, self.alarmsystem.lastEntryID)
+        photo = self.chartCache.get(cacheKey)
+        if photo is None:
+            points = self.alarmsystem.getFieldHistory(fieldID, seconds)
+            if len(points) == 0:
+                raise BotException(SYMBOLS.WARNING + "Keine Daten für " + sensor.getName() + " in den letzten " + rangeText)
+            photo = renderLineChart(points, triggerValue=sensor.triggerValue)
+            self.chartCache.put(cacheKey, photo)
+        message = self.sendPhoto(update.effective_user.id, BytesIO(photo) if isinstance(photo, bytes) else photo, caption=SYMBOLS.CHART + sensor.getName() + " | " + rangeText)
+        if message is not None and isinstance(photo, bytes) and len(message.photo) > 0:
+            # Telegram keeps the uploaded image -> Following views don't need to upload it again
+            self.chartCache.put(cacheKey, message.photo[-1].file_id)
+        return CallbackVars.MENU_CHARTS
+
     def botDisplayOwnUserData(self, update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
         text = SYMBOLS.INFORMATION + "<b>Deine Auskunftsunterlagen nach Art. 15 DSGVO</b>"
         text += "<pre>"
         userDoc = self.getUserDoc(update.effective_user.id)
-        userDoc[USERDB.TIMESTAMP_LAST_TIME_REQUESTED_DSGVO_DATA] = datetime.now().timestamp()
-        self.couchdb[DATABASES.USERS].save(userDoc)
+        userDoc[USERDB.TIMESTAMP_LAST_TIME_REQUESTED_DSGVO_DATA] = self.clock.now()
+        self.storage.saveUser(userDoc)
         for key, value in userDoc.items():
             text += "\n" + key + ": " + str(value)
         text += "</pre>"
@@ -578,6 +978,16 @@ class ABBot:
         self.botEditOrSendNewMessage(update, context, text=text)
         return CallbackVars.MENU_SETTINGS_DELETE_ACCOUNT
 
+    def botBusy(self, update: Update, context: CallbackContext) -> None:
+        """ Answers updates which arrive while the last lane handler of this user is still running. The state is decided by that handler. """
+        text = "Einen Moment bitte, deine letzte Eingabe wird noch bearbeitet."
+        query = update.callback_query
+        if query is not None:
+            query.answer(text=text)
+        else:
+            self.sendMessage(chat_id=update.effective_user.id, text=SYMBOLS.INFORMATION + text)
+        return None
+
     def botWTF(self, update: Update, context: CallbackContext):
         """
         Execute this whenever user enters nonsense.
@@ -622,25 +1032,55 @@ class ABBot:
             broadcastMsg += "\n" + userMessage
             self.sendMessageToMultipleUsers(recipients, broadcastMsg)
         userDoc = self.getUserDoc(update.effective_user.id)
-        userDoc[USERDB.TIMESTAMP_LAST_BROADCAST_SENT] = datetime.now().timestamp()
-        self.couchdb[DATABASES.USERS].save(userDoc)
+        userDoc[USERDB.TIMESTAMP_LAST_BROADCAST_SENT] = self.clock.now()
+        self.storage.saveUser(userDoc)
         return ConversationHandler.END
 
     def botEditOrSendNewMessage(self, update: Update, context: CallbackContext, text: str,
                                 reply_markup: ReplyMarkup = None, disable_web_page_preview=None):
         query = update.callback_query
         if query is not None:
-            query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode='HTML')
+            self.editMessageCoalesced(query.message.chat_id, query.message.message_id, text, reply_markup=reply_markup,
+                                      disable_web_page_preview=disable_web_page_preview)
         else:
             context.bot.send_message(chat_id=update.effective_message.chat_id, reply_markup=reply_markup, text=text,
                                      parse_mode='HTML', disable_web_page_preview=disable_web_page_preview)
 
+    def editMessageCoalesced(self, chat_id: Union[int, str], message_id: int, text: str, reply_markup: ReplyMarkup = None,
+                             disable_web_page_preview=None) -> None:
+        """ Edits a message unless it already shows the given content. Multiple edits within a short time will be merged into one edit containing the latest state. """
+        key = (str(chat_id), message_id)
+        renderHash = MessageEditCache.getRenderHash(text, reply_markup)
+        action, delay = self.editCache.planEdit(key, renderHash, (text, reply_markup, disable_web_page_preview))
+        if action == EDIT_ACTIONS.SCHEDULE:
+            self.updater.job_queue.run_once(self.flushPendingEdit, when=delay, context=key)
+        if action != EDIT_ACTIONS.SEND:
+            return
+        try:
+            self.updater.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup, parse_mode='HTML',
+                                               disable_web_page_preview=disable_web_page_preview)
+        except BadRequest as badRequest:
+            if 'not modified' not in badRequest.message:
+                raise
+        self.editCache.markEdited(key, renderHash)
+
+    def flushPendingEdit(self, context: CallbackContext) -> None:
+        """ Sends the latest state of a message whose edits have been coalesced. """
+        chat_id, message_id = context.job.context
+        pendingEdit = self.editCache.popPending((chat_id, message_id))
+        if pendingEdit is None:
+            return
+        text, reply_markup, disable_web_page_preview = pendingEdit
+        try:
+            self.editMessageCoalesced(chat_id, message_id, text, reply_markup=reply_markup, disable_web_page_preview=disable_web_page_preview)
+        except BadRequest:
+            logging.warning("Failed to edit message", exc_info=True)
+
     def sendUserApprovalRequestToAllAdmins(self, userID: Union[int, str]) -> None:
         adminUsers = self.getAdmins()
         index = 0
-        userDB = self.couchdb[DATABASES.USERS]
         userID = str(userID)
-        userDoc = userDB[userID]
+        userDoc = self.getUserDoc(userID)
         menuText = 'Benutzer erbittet Freischaltung: ' + self.getMeaningfulUserTitle(userID)
         approvalKeyboard = [
             [InlineKeyboardButton(SYMBOLS.CONFIRM + 'Annehmen', callback_data=CallbackVars.APPROVE_USER + str(userID)),
@@ -648,17 +1088,17 @@ class ABBot:
         ]
         reply_markup = InlineKeyboardMarkup(approvalKeyboard)
         for adminUserID in adminUsers:
-            print("Sending approval requests to admin " + str((index + 1)) + " / " + str(len(adminUsers)))
+            logging.info("Sending approval requests to admin " + str((index + 1)) + " / " + str(len(adminUsers)))
             approvalMsg = self.sendMessage(adminUserID, menuText, reply_markup=reply_markup)
             # Update DB and save that messageID -> We need that later!
             adminUserDoc = adminUsers[adminUserID]
             approvalMessageIDs = adminUserDoc.get("", {})
             approvalMessageIDs[userID] = approvalMsg.message_id
             adminUserDoc[USERDB.MSG_IDS_APPROVAL_REQUESTS] = approvalMessageIDs
-            userDB.save(adminUserDoc)
+            self.storage.saveUser(adminUserDoc)
             index += 1
         userDoc[USERDB.APPROVAL_REQUEST_HAS_BEEN_SENT] = True
-        userDB.save(userDoc)
+        self.storage.saveUser(userDoc)
 
     def sendAlarmNotifications(self):
         self.alarmsystem.updateAlarms()
@@ -692,41 +1132,54 @@ class ABBot:
         # Send alarms if there are some
         # TODO: Fix issue where when user + admin alarms are present, admins will get two separate messages
         if len(totalAdminOnlyAlarmText) > 0:
-            logging.warning("Sending out admin alarms...")
+            logging.warning("Sending out admin alarms...", extra=logFields(text=totalAdminOnlyAlarmText))
             # Admins of course also get the user alarms
             if len(totalUserAlarmText) > 0:
                 totalAdminOnlyAlarmText += "\n" + totalUserAlarmText
             self.sendMessageToAllAdmins(totalAdminOnlyAlarmText)
         if len(totalUserAlarmText) > 0:
-            logging.warning("Sending out user alarms...")
+            logging.warning("Sending out user alarms...", extra=logFields(text=totalUserAlarmText))
             self.sendMessageToAllApprovedUsers(totalUserAlarmText)
 
     def getCurrentGlobalSnoozeTimestamp(self) -> float:
-        return self.getBotDoc().get(BOTDB.TIMESTAMP_SNOOZE_UNTIL, 0)
+        return self.snoozeUntil
 
     def getCurrentGlobalSnoozeUserID(self) -> str:
         """ Returns ID of user who activated last snooze. """
-        return self.getBotDoc().get(BOTDB.MUTED_BY_USER_ID, "WTF")
+        if self.snoozeUserID is None:
+            return "WTF"
+        return self.snoozeUserID
 
     def isGloballySnoozed(self) -> bool:
-        return self.getCurrentGlobalSnoozeTimestamp() > datetime.now().timestamp()
+        """ Cleared by timer as soon as the snooze expires. """
+        return self.isSnoozed
 
     def sendMessageToAllApprovedUsers(self, text: str):
-        approvedUsers = self.getApprovedUsers()
+        # Recipients come from memory -> Alarms never wait for the DB
+        approvedUsers = self.storage.getApprovedUsersFromSnapshot()
         self.sendMessageToMultipleUsers(approvedUsers, text)
 
     def sendMessageToAllAdmins(self, text: str):
-        adminUsers = self.getAdmins()
+        adminUsers = self.storage.getAdminsFromSnapshot()
         self.sendMessageToMultipleUsers(adminUsers, text)
 
     def sendMessageToMultipleUsers(self, users: dict, text: str):
         logging.info("Sending messages to " + str(len(users)) + " users...")
-        for userID in users:
+        startTime = time.perf_counter()
+        numberOfRecipients = 0
+        for userID, userDoc in users.items():
+            if USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR in userDoc:
+                # Skip dead chats
+                continue
             self.sendMessage(userID, text)
+            numberOfRecipients += 1
+        logging.info("Messages sent", extra=logFields(recipients=numberOfRecipients, skipped=len(users) - numberOfRecipients, duration_ms=int((time.perf_counter() - startTime) * 1000)))
 
     def sendPhotoToMultipleUsers(self, users: dict, photo, caption: str = None):
         logging.info("Sending photo to " + str(len(users)) + " users...")
-        for userID in users:
+        for userID, userDoc in users.items():
+            if USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR in userDoc:
+                continue
             self.sendPhoto(userID, photo=photo, caption=caption)
 
     def sendMessage(self, chat_id: Union[int, str], text: str, reply_markup=None) -> Union[None, Message]:
@@ -736,10 +1189,7 @@ class ABBot:
             pass
         except Unauthorized:
             # E.g. user has blocked bot -> Save that so we can remove such users on DB cleanup
-            userDoc = self.getUserDoc(chat_id)
-            if userDoc is not None:
-                userDoc[USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR] = datetime.now().timestamp()
-                self.couchdb[DATABASES.USERS].save(userDoc)
+            self.markUserHasBlockedBot(chat_id)
             pass
 
     def sendPhoto(self, chat_id: Union[int, str], photo, caption: str = None) -> Union[None, Message]:
@@ -749,23 +1199,44 @@ class ABBot:
             pass
         except Unauthorized:
             # E.g. user has blocked bot -> Save that so we can remove such users on DB cleanup
-            userDoc = self.getUserDoc(chat_id)
-            if userDoc is not None:
-                userDoc[USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR] = datetime.now().timestamp()
-                self.couchdb[DATABASES.USERS].save(userDoc)
+            self.markUserHasBlockedBot(chat_id)
 
-    def editMessage(self, chat_id: Union[int, str], message_id: int, text: str) -> Union[None, Message]:
+    def sendDocument(self, chat_id: Union[int, str], document, filename: str, caption: str = None) -> Union[None, Message]:
         try:
-            return self.updater.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, parse_mode='HTML')
+            return self.updater.bot.send_document(chat_id=chat_id, document=document, filename=filename, parse_mode='HTML', caption=caption)
         except BadRequest:
-            traceback.print_exc()
+            pass
+        except Unauthorized:
+            self.markUserHasBlockedBot(chat_id)
+
+    def markUserHasBlockedBot(self, userID: Union[int, str]) -> None:
+        """ Excludes user from all further notifications. Such users will be archived on DB cleanup after a grace period. """
+        userDoc = self.getUserDoc(userID)
+        if userDoc is not None:
+            userDoc[USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR] = self.clock.now()
+            self.storage.saveUser(userDoc)
+        self.liveStatusMessageIDs.pop(str(userID), None)
+
+    def editMessage(self, chat_id: Union[int, str], message_id: int, text: str) -> Union[None, Message]:
+        key = (str(chat_id), message_id)
+        renderHash = MessageEditCache.getRenderHash(text)
+        # Supersedes coalesced edits which haven't been sent yet
+        self.editCache.popPending(key)
+        if self.editCache.isUnchanged(key, renderHash):
+            return None
+        try:
+            msg = self.updater.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, parse_mode='HTML')
+            self.editCache.markEdited(key, renderHash)
+            return msg
+        except BadRequest as badRequest:
+            if 'not modified' in badRequest.message:
+                self.editCache.markEdited(key, renderHash)
+            else:
+                logging.warning("Failed to edit message", exc_info=True)
             pass
         except Unauthorized:
             # E.g. user has blocked bot -> Save that so we can remove such users on DB cleanup
-            userDoc = self.getUserDoc(chat_id)
-            if userDoc is not None:
-                userDoc[USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR] = datetime.now().timestamp()
-                self.couchdb[DATABASES.USERS].save(userDoc)
+            self.markUserHasBlockedBot(chat_id)
             pass
 
     def getMeaningfulUserTitle(self, userID: Union[int, str]) -> str:
@@ -774,12 +1245,16 @@ class ABBot:
         if userDoc is None:
             # This should never happen
             return "Gelöschter Benutzer"
-        if USERDB.USERNAME in userDoc:
+        return self.getMeaningfulUserTitleFromDoc(userID, userDoc)
+
+    @staticmethod
+    def getMeaningfulUserTitleFromDoc(userID: Union[int, str], userDoc: dict) -> str:
+        if userDoc.get(USERDB.USERNAME) is not None:
             fullname = "@" + userDoc[USERDB.USERNAME]
         else:
             fullname = str(userID)
         fullname += " (" + userDoc[USERDB.FIRST_NAME]
-        if USERDB.LAST_NAME in userDoc:
+        if userDoc.get(USERDB.LAST_NAME) is not None:
             fullname += " " + userDoc[USERDB.LAST_NAME]
         fullname += ")"
         return fullname
@@ -791,63 +1266,31 @@ class ABBot:
             return self.getMeaningfulUserTitle(targetUserID)
 
 
+    def getUserIDs(self) -> list:
+        """ Returns IDs of all users. """
+        return self.storage.getUserIDs()
+
     def getAdmins(self) -> dict:
-        admins = {}
-        userDB = self.couchdb[DATABASES.USERS]
-        for userID in userDB:
-            userDoc = userDB[userID]
-            if userDoc.get(USERDB.IS_ADMIN):
-                admins[userID] = userDoc
-        return admins
+        return self.storage.getAdmins()
 
     def getAdminsExceptOne(self, ignoreUserID: Union[int, str]) -> dict:
-        """ Returns approved users and admins. """
-        users = {}
-        userDB = self.couchdb[DATABASES.USERS]
+        """ Returns all admins except the given one. """
         ignoreUserID = str(ignoreUserID)
-        for userID in userDB:
-            if userID == ignoreUserID:
-                continue
-            elif not self.userIsAdmin(userID):  # Skip all non-admins
-                continue
-            userDoc = userDB[userID]
-            users[userID] = userDoc
-        return users
+        return {userID: userDoc for userID, userDoc in self.storage.getAdmins().items() if userID != ignoreUserID}
 
     def getApprovedUsers(self) -> dict:
         """ Returns approved users and admins. """
-        users = {}
-        userDB = self.couchdb[DATABASES.USERS]
-        for userID in userDB:
-            userDoc = userDB[userID]
-            if userDoc.get(USERDB.IS_ADMIN) or userDoc.get(USERDB.IS_APPROVED, False):
-                users[userID] = userDoc
-        return users
+        return self.storage.getApprovedUsers()
 
     def getApprovedUsersExceptOne(self, ignoreUserID: Union[int, str]) -> dict:
         """ Returns approved users and admins. """
-        users = {}
-        userDB = self.couchdb[DATABASES.USERS]
         ignoreUserID = str(ignoreUserID)
-        for userID in userDB:
-            if userID == ignoreUserID:
-                continue
-            userDoc = userDB[userID]
-            if userDoc.get(USERDB.IS_ADMIN) or userDoc.get(USERDB.IS_APPROVED, False):
-                users[userID] = userDoc
-        return users
+        return {userID: userDoc for userID, userDoc in self.storage.getApprovedUsers().items() if userID != ignoreUserID}
 
     def getAllUsersExceptOne(self, ignoreUserID: Union[int, str]) -> dict:
         """ Returns ALL users and admins. """
-        users = {}
-        userDB = self.couchdb[DATABASES.USERS]
         ignoreUserID = str(ignoreUserID)
-        for userID in userDB:
-            if userID == ignoreUserID:
-                continue
-            userDoc = userDB[userID]
-            users[userID] = userDoc
-        return users
+        return {userID: userDoc for userID, userDoc in self.storage.getUsers() if userID != ignoreUserID}
 
     def botAcpUserTriggerAdmin(self, update: Update, context: CallbackContext):
         query = update.callback_query
@@ -863,15 +1306,15 @@ class ABBot:
             return
         elif userDoc.get(USERDB.IS_ADMIN, False):
             userDoc[USERDB.IS_ADMIN] = False
-            self.couchdb[DATABASES.USERS].save(userDoc)
+            self.storage.saveUser(userDoc)
         else:
             userDoc[USERDB.IS_ADMIN] = True
-            self.couchdb[DATABASES.USERS].save(userDoc)
+            self.storage.saveUser(userDoc)
 
     def deleteUser(self, userID: Union[int, str]) -> bool:
         """ Deletes a user from DB. """
-        if str(userID) in self.couchdb[DATABASES.USERS]:
-            del self.couchdb[DATABASES.USERS][str(userID)]
+        if self.storage.deleteUser(str(userID)):
+            self.liveStatusMessageIDs.pop(str(userID), None)
             return True
         else:
             return False
@@ -886,17 +1329,116 @@ class ABBot:
 
 
     def getUserDoc(self, userID: Union[int, str]):
-        return self.couchdb[DATABASES.USERS].get(str(userID))
+        return self.storage.getUser(str(userID))
 
     def getBotDoc(self):
-        return self.couchdb[DATABASES.BOTSTATE][DATABASES.BOTSTATE]
+        return self.storage.getBotDoc()
+
+    def getTimerKey(self, timer: str) -> str:
+        """ Timers are shared by all bots of this process. """
+        return self.cfg.db_prefix + timer
+
+    def reloadConfigIfChanged(self) -> None:
+        """ Applies changes of config.json without restart. Settings that are used during startup only e.g. bot_token or db_url still require a restart. """
+        if not self.configWatcher.hasChanged():
+            return
+        try:
+            newConfig = loadConfig(dbPrefix=self.cfg.db_prefix)
+        except:
+            logging.warning("Ignoring changed config because it is invalid", exc_info=True)
+            return
+        logging.info("Config has changed -> Applying it")
+        self.alarmsystem.updateConfig(newConfig)
+        self.liveStatusEditIntervalSeconds = newConfig.live_status_edit_interval_seconds
+        self.cfg = newConfig
+        self.applyPollSchedulerConfig()
+
+    def applyPollSchedulerConfig(self) -> None:
+        self.pollScheduler.minIntervalSeconds = self.cfg.poll_min_interval_seconds
+        self.pollScheduler.maxIntervalSeconds = self.cfg.poll_max_interval_seconds
+        self.pollScheduler.snoozedIntervalSeconds = self.cfg.poll_snoozed_interval_seconds
 
     def handleBatchProcess(self) -> None:
+        startTime = time.perf_counter()
         try:
+            self.reloadConfigIfChanged()
             self.sendAlarmNotifications()
         except:
-            traceback.print_exc()
-            logging.warning("Batchprocess failed")
+            logging.warning("Batchprocess failed", exc_info=True)
+            self.pollScheduler.onPollError()
+            return
+        self.lastSuccessfulPollMonotonic = self.clock.monotonic()
+        self.pollScheduler.onPollSuccess(self.alarmsystem.newEntryTimestamps, self.alarmsystem.hasAlarms(), self.isGloballySnoozed())
+        logging.info("Poll done", extra=logFields('poll' + self.cfg.db_prefix, bot=self.cfg.bot_name, duration_ms=int((time.perf_counter() - startTime) * 1000), last_entry_id=self.alarmsystem.lastEntryID,
+                                                  new_entries=len(self.alarmsystem.newEntryTimestamps)))
+        # Check again right when the no data alarm would be due instead of waiting for the next regular poll
+        noDataAlarmDeadline = self.alarmsystem.getNoDataAlarmDeadline()
+        if noDataAlarmDeadline is not None:
+            self.timers.schedule(self.getTimerKey(TIMERS.NO_DATA_ALARM), noDataAlarmDeadline, self.handleBatchProcess)
+        else:
+            self.timers.cancel(self.getTimerKey(TIMERS.NO_DATA_ALARM))
+        try:
+            self.updateLiveStatusMessages()
+        except:
+            logging.warning("Updating live status messages failed", exc_info=True)
+        try:
+            self.storage.checkAvailability()
+        except:
+            logging.warning("Storage availability check failed", exc_info=True)
+
+    def onAlarmEngineEvent(self, pollResult: PollResult) -> None:
+        """ Called from the event thread of the alarm engine after every successful poll of the engine process. """
+        self.reloadConfigIfChanged()
+        self.lastSuccessfulPollMonotonic = self.clock.monotonic()
+        self.alarmsystem.onPollResult(pollResult)
+        logging.info("Alarm engine poll done", extra=logFields('poll' + self.cfg.db_prefix, bot=self.cfg.bot_name, last_entry_id=pollResult.lastEntryID, new_entries=pollResult.numberOfNewEntries))
+        self.sendAlarmNotifications()
+        try:
+            self.updateLiveStatusMessages()
+        except:
+            logging.warning("Updating live status messages failed", exc_info=True)
+        try:
+            self.storage.checkAvailability()
+        except:
+            logging.warning("Storage availability check failed", exc_info=True)
+
+    def handleDBMaintenance(self) -> None:
+        try:
+            self.cleanupDB()
+        except:
+            logging.warning("DB maintenance failed", exc_info=True)
+
+    def cleanupDB(self) -> None:
+        """ Archives users who have blocked the bot for longer than the configured grace period, compacts the DB and reports the results to all admins. """
+        graceSeconds = self.cfg.blocked_users_grace_days * 24 * 60 * 60
+        now = self.clock.now()
+        numberOfArchivedUsers = 0
+        numberOfBlockedUsers = 0
+        for userID, userDoc in self.storage.getUsers():
+            timestampBlocked = userDoc.get(USERDB.TIMESTAMP_LAST_BLOCKED_BOT_ERROR)
+            if timestampBlocked is None:
+                continue
+            numberOfBlockedUsers += 1
+            if now - timestampBlocked < graceSeconds:
+                continue
+            elif userDoc.get(USERDB.IS_ADMIN, False):
+                # Never remove admins automatically
+                logging.info("Not archiving admin who has blocked the bot: " + userID)
+                continue
+            archivedUserDoc = withoutMetadata(userDoc)
+            archivedUserDoc[USERS_ARCHIVE.TIMESTAMP_ARCHIVED] = now
+            self.storage.archiveUser(userID, archivedUserDoc)
+            self.liveStatusMessageIDs.pop(userID, None)
+            numberOfArchivedUsers += 1
+        dbSizeBytes, reclaimableBytes = self.storage.compact()
+        text = SYMBOLS.WRENCH + "<b>DB Wartung</b>"
+        text += "\nBenutzer, die den Bot blockiert haben: " + str(numberOfBlockedUsers)
+        text += "\nDavon archiviert: " + str(numberOfArchivedUsers)
+        text += "\nDB Größe vor Komprimierung: " + str(dbSizeBytes // 1024) + " KB"
+        text += "\nFreigegeben durch Komprimierung: ~" + str(reclaimableBytes // 1024) + " KB"
+        logging.info("DB maintenance done | Archived users: " + str(numberOfArchivedUsers) + " | Reclaimable bytes: " + str(reclaimableBytes))
+        if numberOfArchivedUsers > 0 or reclaimableBytes > 0:
+            self.sendMessageToAllAdmins(text)
 
     def adminOrException(self, userID: Union[int, str]):
         if not self.userIsAdmin(userID):
@@ -907,12 +1449,34 @@ class ABBot:
 
 
 if __name__ == '__main__':
-    bot = ABBot()
-    bot.updater.start_polling()
-    schedule.every(5).seconds.do(bot.handleBatchProcess)
+    import schedule
+    botConfigs = loadBotConfigs()
+    # All bots share one main loop, the timers and all connections
+    shared = SharedResources(numberOfBots=len(botConfigs), handlerLaneConfig=botConfigs[0].handler_lanes, requestTimeoutSeconds=botConfigs[0].request_timeout_seconds)
+    bots = [ABBot(cfg=botConfig, shared=shared) for botConfig in botConfigs]
+    watchdog = Watchdog(shared.thingspeakConnection, shared.handlerLanes, stallSeconds=botConfigs[0].watchdog_stall_seconds, maxPollAgeSeconds=botConfigs[0].watchdog_max_poll_age_seconds,
+                        exitAfterSeconds=botConfigs[0].watchdog_exit_after_seconds, clock=shared.clock)
+    for bot in bots:
+        bot.updater.start_polling()
+        schedule.every().day.at("04:00").do(bot.handleDBMaintenance)
+        watchdog.addBot(bot)
+    watchdog.start()
     counter = 0
     while True:
         counter += 1
+        loopLagSeconds = watchdog.onLoopWakeUp()
         schedule.run_pending()
-        time.sleep(1)
-        logging.info("Looprun: " + str(counter))
+        shared.timers.runDue()
+        for bot in bots:
+            if bot.alarmEngine is not None:
+                # Engine process polls on its own
+                bot.alarmEngine.ensureRunning()
+            elif bot.pollScheduler.isPollDue():
+                # Polling interval adapts to the upload interval of the alarm system
+                bot.handleBatchProcess()
+        # Sleep until the next poll, timer or scheduled job is due
+        secondsUntilNextPoll = min([bot.pollScheduler.getSecondsUntilNextPoll() for bot in bots if bot.alarmEngine is None], default=60)
+        waitSeconds = min(secondsUntilNextPoll, max(0, schedule.idle_seconds()), 60)
+        logging.info("Looprun: " + str(counter), extra=logFields('looprun', lag_ms=int(loopLagSeconds * 1000)))
+        watchdog.onLoopSleep(waitSeconds)
+        shared.timers.wait(waitSeconds)
@@ -0,0 +1,210 @@
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Tuple, Union, Hashable
+
+# Key -> (duration in seconds, button text)
+CHART_RANGES = OrderedDict([
+    ('6h', (6 * 60 * 60, '6 Std.')),
+    ('24h', (24 * 60 * 60, '24 Std.')),
+    ('7d', (7 * 24 * 60 * 60, '7 Tage')),
+])
+
+
+class COLORS:
+    """ Palette indices of the rendered PNGs """
+    BACKGROUND = 0
+    GRID = 1
+    AXIS = 2
+    LINE = 3
+    TRIGGER = 4
+    PALETTE = bytes([255, 255, 255,
+                     225, 225, 225,
+                     70, 70, 70,
+                     30, 100, 200,
+                     220, 40, 40])
+
+
+# 3x5 pixel glyphs for axis labels. Everything else (e.g. the sensor name) goes into the caption.
+GLYPHS = {
+    '0': ['###', '#.#', '#.#', '#.#', '###'],
+    '1': ['.#.', '##.', '.#.', '.#.', '###'],
+    '2': ['###', '..#', '###', '#..', '###'],
+    '3': ['###', '..#', '.##', '..#', '###'],
+    '4': ['#.#', '#.#', '###', '..#', '..#'],
+    '5': ['###', '#..', '###', '..#', '###'],
+    '6': ['###', '#..', '###', '#.#', '###'],
+    '7': ['###', '..#', '.#.', '.#.', '.#.'],
+    '8': ['###', '#.#', '###', '#.#', '###'],
+    '9': ['###', '#.#', '###', '..#', '###'],
+    '.': ['...', '...', '...', '...', '.#.'],
+    ':': ['...', '.#.', '...', '.#.', '...'],
+    '-': ['...', '...', '###', '...', '...'],
+    ' ': ['...', '...', '...', '...', '...'],
+}
+
+
+class Canvas:
+    """ 8 bit palette image in a bytearray. Just enough drawing primitives for line charts -> No plotting library needed on the Raspberry Pi. """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(width * height)
+
+    def setPixel(self, x: int, y: int, color: int) -> None:
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y * self.width + x] = color
+
+    def drawHorizontalLine(self, x1: int, x2: int, y: int, color: int, dashed: bool = False) -> None:
+        if not 0 <= y < self.height:
+            return
+        x1 = max(0, min(x1, x2))
+        x2 = min(self.width - 1, max(x1, x2))
+        start = y * self.width
+        if dashed:
+            for x in range(x1, x2 + 1):
+                if x % 8 < 5:
+                    self.pixels[start + x] = color
+        else:
+            self.pixels[start + x1:start + x2 + 1] = bytes([color]) * (x2 - x1 + 1)
+
+    def drawVerticalLine(self, x: int, y1: int, y2: int, color: int) -> None:
+        for y in range(min(y1, y2), max(y1, y2) + 1):
+            self.setPixel(x, y, color)
+
+    def drawLine(self, x1: int, y1: int, x2: int, y2: int, color: int) -> None:
+        """ Bresenham, 2 pixels thick """
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        stepX = 1 if x1 < x2 else -1
+        stepY = 1 if y1 < y2 else -1
+        error = dx + dy
+        while True:
+            self.setPixel(x1, y1, color)
+            self.setPixel(x1, y1 + 1, color)
+            if x1 == x2 and y1 == y2:
+                return
+            doubleError = 2 * error
+            if doubleError >= dy:
+                error += dy
+                x1 += stepX
+            if doubleError <= dx:
+                error += dx
+                y1 += stepY
+
+    def drawText(self, x: int, y: int, text: str, color: int, scale: int = 2) -> None:
+        for char in text:
+            glyph = GLYPHS.get(char, GLYPHS[' '])
+            for row, line in enumerate(glyph):
+                for column, pixel in enumerate(line):
+                    if pixel == '#':
+                        for offsetY in range(scale):
+                            for offsetX in range(scale):
+                                self.setPixel(x + column * scale + offsetX, y + row * scale + offsetY, color)
+            x += 4 * scale
+
+    @staticmethod
+    def getTextWidth(text: str, scale: int = 2) -> int:
+        return len(text) * 4 * scale - scale
+
+    def toPNG(self) -> bytes:
+        rows = bytearray()
+        for y in range(self.height):
+            # Filter type 0 = none
+            rows.append(0)
+            rows += self.pixels[y * self.width:(y + 1) * self.width]
+
+        def chunk(chunkType: bytes, data: bytes) -> bytes:
+            return struct.pack('>I', len(data)) + chunkType + data + struct.pack('>I', zlib.crc32(chunkType + data))
+
+        # Bit depth 8, color type 3 = palette
+        header = struct.pack('>IIBBBBB', self.width, self.height, 8, 3, 0, 0, 0)
+        return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'PLTE', COLORS.PALETTE) + chunk(b'IDAT', zlib.compress(bytes(rows), 6)) + chunk(b'IEND', b'')
+
+
+def formatValue(value: float) -> str:
+    if abs(value) >= 100:
+        return str(int(round(value)))
+    return ('%.2f' % value).rstrip('0').rstrip('.')
+
+
+def renderLineChart(points: List[Tuple[float, float]], triggerValue: Union[float, None] = None, width: int = 640, height: int = 360) -> bytes:
+    """ Renders (timestamp, value) points sorted by time as PNG. The trigger value of the sensor is drawn as dashed line. """
+    canvas = Canvas(width, height)
+    left, right, top, bottom = 70, width - 15, 15, height - 35
+    minTimestamp = points[0][0]
+    maxTimestamp = max(points[-1][0], minTimestamp + 1)
+    values = [value for timestamp, value in points]
+    if triggerValue is not None:
+        values.append(triggerValue)
+    minValue = min(values)
+    maxValue = max(values)
+    if maxValue - minValue < 1e-9:
+        minValue -= 1
+        maxValue += 1
+    padding = (maxValue - minValue) * 0.05
+    minValue -= padding
+    maxValue += padding
+
+    def getX(timestamp: float) -> int:
+        return left + int((timestamp - minTimestamp) * (right - left) / (maxTimestamp - minTimestamp))
+
+    def getY(value: float) -> int:
+        return bottom - int((value - minValue) * (bottom - top) / (maxValue - minValue))
+
+    numberOfTicks = 5
+    for tick in range(numberOfTicks):
+        value = minValue + (maxValue - minValue) * tick / (numberOfTicks - 1)
+        y = getY(value)
+        canvas.drawHorizontalLine(left, right, y, COLORS.GRID)
+        label = formatValue(value)
+        canvas.drawText(left - 8 - canvas.getTextWidth(label), y - 5, label, COLORS.AXIS)
+    timeFormat = '%H:%M' if maxTimestamp - minTimestamp <= 24 * 60 * 60 else '%d.%m'
+    for tick in range(numberOfTicks):
+        timestamp = minTimestamp + (maxTimestamp - minTimestamp) * tick / (numberOfTicks - 1)
+        x = getX(timestamp)
+        canvas.drawVerticalLine(x, top, bottom, COLORS.GRID)
+        label = datetime.fromtimestamp(timestamp).strftime(timeFormat)
+        labelWidth = canvas.getTextWidth(label)
+        canvas.drawText(min(max(0, x - labelWidth // 2), width - labelWidth), bottom + 12, label, COLORS.AXIS)
+    canvas.drawVerticalLine(left, top, bottom, COLORS.AXIS)
+    canvas.drawHorizontalLine(left, right, bottom, COLORS.AXIS)
+    if triggerValue is not None:
+        canvas.drawHorizontalLine(left, right, getY(triggerValue), COLORS.TRIGGER, dashed=True)
+    lastX, lastY = getX(points[0][0]), getY(points[0][1])
+    canvas.setPixel(lastX, lastY, COLORS.LINE)
+    for timestamp, value in points[1:]:
+        x, y = getX(timestamp), getY(value)
+        if x == lastX and y == lastY:
+            # Many points end up on the same pixel for long ranges
+            continue
+        canvas.drawLine(lastX, lastY, x, y, COLORS.LINE)
+        lastX, lastY = x, y
+    return canvas.toPNG()
+
+
+class ChartCache:
+    """ Rendered charts by (sensor, range, data version). Once a chart has been uploaded, its Telegram file_id replaces the image so repeated views need neither rendering nor upload. """
+
+    def __init__(self, maxSize: int = 50):
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        # key -> PNG bytes or file_id
+        self.entries = OrderedDict()
+
+    def get(self, key: Hashable) -> Union[bytes, str, None]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, imageOrFileID: Union[bytes, str]) -> None:
+        with self.lock:
+            self.entries[key] = imageOrFileID
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
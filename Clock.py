@@ -0,0 +1,62 @@
+import threading
+import time
+from datetime import datetime
+
+
+class Clock:
+    """ Source of the current time. Everything time based should ask its clock instead of calling datetime.now() directly so it can be driven by a virtual clock e.g. during replays or simulations.
+    now() = wall clock time for everything that gets displayed or stored, monotonic() = for measuring intervals e.g. flood protection. Only monotonic() is safe against wall clock jumps. """
+
+    def now(self) -> float:
+        """ Returns current unix timestamp """
+        return time.time()
+
+    def nowDatetime(self) -> datetime:
+        return datetime.fromtimestamp(self.now())
+
+    def monotonic(self) -> float:
+        """ Seconds since an arbitrary point in time. Only differences of these values are meaningful. """
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def waitForEvent(self, event: threading.Event, seconds: float) -> bool:
+        """ Sleeps until given event is set or the given time has passed. Returns True if the event has been set. """
+        return event.wait(seconds)
+
+
+class VirtualClock(Clock):
+    """ Clock which only moves when told to. Sleeping advances it immediately so e.g. weeks of bot runtime can be simulated in seconds. """
+
+    def __init__(self, timestamp: float = 0):
+        self.timestamp = timestamp
+        self.monotonicTimestamp = 0.0
+
+    def now(self) -> float:
+        return self.timestamp
+
+    def monotonic(self) -> float:
+        return self.monotonicTimestamp
+
+    def set(self, timestamp: float) -> None:
+        """ Sets wall clock time. Monotonic time only ever moves forward. """
+        if timestamp > self.timestamp:
+            self.monotonicTimestamp += timestamp - self.timestamp
+        self.timestamp = timestamp
+
+    def advance(self, seconds: float) -> None:
+        self.timestamp += seconds
+        self.monotonicTimestamp += seconds
+
+    def sleep(self, seconds: float) -> None:
+        self.advance(seconds)
+
+    def waitForEvent(self, event: threading.Event, seconds: float) -> bool:
+        if event.is_set():
+            return True
+        self.advance(seconds)
+        return False
+
+
+SYSTEM_CLOCK = Clock()
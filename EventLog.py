@@ -0,0 +1,64 @@
+import gzip
+import json
+import logging
+import os
+import zlib
+from datetime import datetime
+from typing import Iterator, List, Union
+
+
+class EventLog:
+    """ Append-only log of everything fetched from Thingspeak: One gzip compressed JSON line per poll.
+    A new file is started every day and on every start so a crash can only ever truncate the end of the last file.
+    Can be fed into Replay.py to re-run the alarm evaluation against past data. """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.file = None
+        self.fileDay = None
+        os.makedirs(directory, exist_ok=True)
+
+    def getPath(self, timestamp: float) -> str:
+        # File names sort chronologically
+        return os.path.join(self.directory, datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d_%H%M%S') + '.jsonl.gz')
+
+    def record(self, timestamp: float, lastEntryID: Union[int, None], entries: List[dict]) -> None:
+        """ Stores one poll. timestamp = local time of the poll, entries = all feed entries which have been fetched during this poll. """
+        day = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
+        if day != self.fileDay:
+            self.close()
+            self.file = gzip.open(self.getPath(timestamp), 'ab')
+            self.fileDay = day
+        event = {'t': timestamp, 'last_entry_id': lastEntryID}
+        if len(entries) > 0:
+            event['feeds'] = entries
+        self.file.write(json.dumps(event, separators=(',', ':')).encode('utf-8') + b'\n')
+        # Sync flush: Everything written so far stays readable even if we crash before close()
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.fileDay = None
+
+
+def readEventLog(path: str) -> Iterator[dict]:
+    """ Yields all events of one log file or of all log files in given directory in chronological order. """
+    if os.path.isdir(path):
+        paths = [os.path.join(path, filename) for filename in sorted(os.listdir(path)) if filename.endswith('.jsonl.gz')]
+    else:
+        paths = [path]
+    for filePath in paths:
+        with gzip.open(filePath, 'rb') as infile:
+            try:
+                for line in infile:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Incomplete last line
+                        continue
+                    yield event
+            except (EOFError, zlib.error, gzip.BadGzipFile):
+                # Last write of a crashed process -> Everything before it is fine
+                logging.warning("Event log is truncated: " + filePath)
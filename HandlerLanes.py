@@ -0,0 +1,87 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.ext.utils.promise import Promise
+
+from Helper import BotException, SYMBOLS
+
+
+class LANES:
+    INTERACTIVE = 'interactive'  # Quick handlers which should always respond fast e.g. snooze/unsnooze
+    BACKGROUND = 'background'  # Slow handlers which loop over all users e.g. broadcasts or the ACP user list
+
+
+# Default settings for every lane: Number of worker threads and max. number of waiting updates
+LANE_DEFAULTS = {
+    LANES.INTERACTIVE: {'workers': 2, 'max_queue_size': 20},
+    LANES.BACKGROUND: {'workers': 1, 'max_queue_size': 5},
+}
+
+
+class HandlerLane:
+    """ Runs handler callbacks on its own bounded worker pool so slow handlers can't starve quick ones.
+    Wrapped callbacks return a Promise which the ConversationHandler resolves once the callback is done. """
+
+    def __init__(self, name: str, workers: int, maxQueueSize: int):
+        self.name = name
+        self.workers = workers
+        self.maxQueueSize = maxQueueSize
+        self.lock = threading.Lock()
+        self.executor, self.slots = self.createPool()
+
+    def createPool(self) -> Tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='Lane_' + self.name)
+        # Limits running + waiting callbacks
+        slots = threading.BoundedSemaphore(self.workers + self.maxQueueSize)
+        return executor, slots
+
+    def wrap(self, callback: Callable) -> Callable:
+        def laneCallback(update: Update, context: CallbackContext):
+            with self.lock:
+                executor, slots = self.executor, self.slots
+            if not slots.acquire(blocking=False):
+                logging.warning("Handler lane " + self.name + " is full -> Rejecting update")
+                raise BotException(SYMBOLS.WARNING + "Der Bot ist gerade ausgelastet. Bitte versuche es gleich nochmal.")
+            promise = Promise(callback, [update, context], {}, update=update)
+            executor.submit(self.runPromise, promise, context, slots)
+            return promise
+
+        return laneCallback
+
+    def runPromise(self, promise: Promise, context: CallbackContext, slots: threading.BoundedSemaphore) -> None:
+        try:
+            promise.run()
+            if promise.exception is not None:
+                # Route errors to the bots' error handler just like run_async handlers would do
+                context.dispatcher.dispatch_error(promise.update, promise.exception, promise=promise)
+        finally:
+            slots.release()
+
+    def probe(self) -> Future:
+        """ Submits a no-op. If it doesn't complete within reasonable time, all workers of this lane are stuck. """
+        with self.lock:
+            return self.executor.submit(lambda: None)
+
+    def restart(self) -> None:
+        """ Replaces the worker pool. Stuck callbacks keep their threads but no longer block new updates. """
+        with self.lock:
+            oldExecutor = self.executor
+            self.executor, self.slots = self.createPool()
+        oldExecutor.shutdown(wait=False)
+        logging.warning("Handler lane " + self.name + " has been restarted")
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+def createHandlerLanes(laneConfig: dict) -> dict:
+    """ Creates all lanes. Lane settings can be overridden via config. """
+    lanes = {}
+    for laneName, defaults in LANE_DEFAULTS.items():
+        settings = {**defaults, **laneConfig.get(laneName, {})}
+        lanes[laneName] = HandlerLane(laneName, workers=settings['workers'], maxQueueSize=settings['max_queue_size'])
+    return lanes
@@ -1,27 +1,134 @@
 import json
 import os
+import re
+import threading
+import time
 from datetime import datetime
+from typing import Dict, Optional, Callable, List
 
+from pydantic import BaseModel, validator
 from telegram import InlineKeyboardMarkup
 
-
-class Config:
-    BOT_TOKEN = 'bot_token'
-    DB_URL = 'db_url'
-    PUBLIC_CHANNEL_NAME = 'public_channel_name'
-    BOT_NAME = 'bot_name'
-    BOT_PASSWORD = 'bot_password'
-    THINGSPEAK_CHANNEL = 'thingspeak_channel'
-    THINGSPEAK_READ_APIKEY = 'thingspeak_read_apikey'
-    THINGSPEAK_FIELDS_ALARM_STATE_MAPPING = 'thingspeak_fields_alarm_state_mapping'
-
-
-def loadConfig(fallback=None):
-    try:
-        return loadJson('config.json')
-    except Exception as exc:
-        print('Failed to load ' + 'config.json')
-        return fallback
+from Clock import Clock, SYSTEM_CLOCK
+from Rules import RuleConfig
+from Sensor import SensorConfig
+from Storage import STORAGE_BACKENDS
+
+
+class BotConfig(BaseModel):
+    """ Contents of config.json. See README for descriptions of all fields. """
+    bot_token: str
+    # Only needed for storage_backend "couchdb"
+    db_url: Optional[str] = None
+    bot_name: str
+    bot_password: str
+    public_channel_name: Optional[str] = None
+    thingspeak_channel: int
+    thingspeak_read_apikey: str
+    thingspeak_fields_alarm_state_mapping: Dict[int, SensorConfig]
+    thingspeak_rules: List[RuleConfig] = []
+    live_status_edit_interval_seconds: int = 30
+    handler_lanes: Dict[str, Dict[str, int]] = {}
+    blocked_users_grace_days: int = 30
+    poll_min_interval_seconds: float = 5
+    poll_max_interval_seconds: float = 60
+    poll_snoozed_interval_seconds: float = 30
+    event_log_dir: Optional[str] = None
+    persistence_file: Optional[str] = 'bot_state.sqlite'
+    persistence_flush_interval_seconds: float = 5
+    # Prefix of all DB names of this bot -> Several bots can use the same CouchDB. Also identifies the bot within config.json.
+    db_prefix: str = ''
+    # See STORAGE_BACKENDS
+    storage_backend: str = STORAGE_BACKENDS.COUCHDB
+    sqlite_file: str = 'bot.sqlite'
+    # Timeout of every request to Thingspeak and CouchDB
+    request_timeout_seconds: float = 30
+    watchdog_stall_seconds: float = 300
+    watchdog_max_poll_age_seconds: float = 900
+    watchdog_exit_after_seconds: Optional[float] = None
+    # Polls Thingspeak and evaluates alarms in a separate process -> Busy handlers can't delay alarms
+    alarm_engine_process: bool = False
+
+    @validator('db_prefix')
+    def checkDBPrefix(cls, dbPrefix):
+        # CouchDB only allows lowercase letters, digits and a few special chars and names must start with a letter
+        if dbPrefix != '' and re.fullmatch('[a-z][a-z0-9_]*', dbPrefix) is None:
+            raise ValueError('db_prefix must start with a lowercase letter and contain only lowercase letters, digits and underscores')
+        return dbPrefix
+
+    @validator('thingspeak_rules')
+    def checkRuleFields(cls, ruleConfigs, values):
+        # Rules only get samples of configured sensors -> A rule on any other field would never trigger
+        sensorConfigs = values.get('thingspeak_fields_alarm_state_mapping')
+        if sensorConfigs is None:
+            return ruleConfigs
+        for ruleConfig in ruleConfigs:
+            unknownFieldIDs = [fieldID for fieldID in ruleConfig.getFieldIDs() if fieldID not in sensorConfigs]
+            if len(unknownFieldIDs) > 0:
+                raise ValueError('Rule ' + ruleConfig.name + ': Fields ' + ', '.join(str(fieldID) for fieldID in unknownFieldIDs) + ' are missing in thingspeak_fields_alarm_state_mapping')
+        return ruleConfigs
+
+    @validator('storage_backend')
+    def checkStorageBackend(cls, storageBackend, values):
+        if storageBackend not in (STORAGE_BACKENDS.COUCHDB, STORAGE_BACKENDS.SQLITE):
+            raise ValueError('storage_backend must be "couchdb" or "sqlite"')
+        elif storageBackend == STORAGE_BACKENDS.COUCHDB and values.get('db_url') is None:
+            raise ValueError('db_url is required for storage_backend "couchdb"')
+        return storageBackend
+
+
+def loadBotConfigs(path: str = 'config.json') -> List[BotConfig]:
+    """ Loads- and validates the configs of all bots served by this process.
+    config.json either describes one bot or contains a list "bots" whose entries override the top level settings for every bot. """
+    rawConfig = loadJson(path)
+    botEntries = rawConfig.pop('bots', None)
+    if botEntries is None:
+        return [BotConfig.parse_obj(rawConfig)]
+    configs = []
+    for botEntry in botEntries:
+        botConfig = {**rawConfig, **botEntry}
+        for key, defaultFile in (('persistence_file', 'bot_state.sqlite'), ('sqlite_file', 'bot.sqlite')):
+            if key not in botEntry and botConfig.get(key, defaultFile) is not None:
+                # Every bot needs its own file
+                botConfig[key] = botEntry.get('db_prefix', '') + botConfig.get(key, defaultFile)
+        configs.append(BotConfig.parse_obj(botConfig))
+    if len(configs) == 0:
+        raise ValueError('"bots" must contain at least one bot')
+    if len({config.db_prefix for config in configs}) != len(configs):
+        raise ValueError('Every bot needs its own db_prefix')
+    if len({config.bot_token for config in configs}) != len(configs):
+        raise ValueError('Every bot needs its own bot_token')
+    return configs
+
+
+def loadConfig(path: str = 'config.json', dbPrefix: str = None) -> BotConfig:
+    """ Loads- and validates config.json. Returns the config of the bot with the given db_prefix or the first one if dbPrefix is None.
+    Raises an exception if it is missing or invalid. """
+    for config in loadBotConfigs(path):
+        if dbPrefix is None or config.db_prefix == dbPrefix:
+            return config
+    raise ValueError('No bot with db_prefix "' + dbPrefix + '" in ' + path)
+
+
+class ConfigWatcher:
+    """ Detects changes of a config file via its modification time. Cheap enough to be called on every poll. """
+
+    def __init__(self, path: str = 'config.json'):
+        self.path = os.path.join(os.getcwd(), path)
+        self.lastModifiedTime = self.getModifiedTime()
+
+    def getModifiedTime(self) -> float:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return -1
+
+    def hasChanged(self) -> bool:
+        modifiedTime = self.getModifiedTime()
+        if modifiedTime == self.lastModifiedTime:
+            return False
+        self.lastModifiedTime = modifiedTime
+        return True
 
 
 def loadJson(path):
@@ -53,12 +160,13 @@ class SYMBOLS:
     WHITE_DOWN_POINTING_BACKHAND = '👇'
     MEGAPHONE = '📣'
     FLASH = '⚡'
+    CHART = '📈'
 
 
-def getFormattedTimeDelta(futureTimestamp: float) -> str:
+def getFormattedTimeDelta(futureTimestamp: float, clock: Clock = SYSTEM_CLOCK) -> str:
     """ Returns human readable duration until given future timestamp is reached """
     # https://stackoverflow.com/questions/538666/format-timedelta-to-string
-    secondsRemaining = futureTimestamp - datetime.now().timestamp()
+    secondsRemaining = futureTimestamp - clock.now()
     return getFormattedDuration(secondsRemaining)
 
 
@@ -79,6 +187,31 @@ def formatDatetimeToGermanDate(date: datetime) -> str:
     return date.strftime('%d.%m.%Y %H:%M:%S Uhr')
 
 
+class PhaseTimer:
+    """ Measures durations of (possibly parallel) phases e.g. during startup. """
+
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def run(self, phase: str, func: Callable):
+        """ Runs given function and stores its duration under the given phase name. """
+        phaseStartTime = time.perf_counter()
+        try:
+            return func()
+        finally:
+            with self.lock:
+                self.durations[phase] = time.perf_counter() - phaseStartTime
+
+    def getSummary(self) -> str:
+        text = "Startup took " + "{:.2f}".format(time.perf_counter() - self.startTime) + "s"
+        with self.lock:
+            for phase, duration in self.durations.items():
+                text += " | " + phase + ": " + "{:.2f}".format(duration) + "s"
+        return text
+
+
 class BotException(Exception):
     def __init__(self, errorMsg, replyMarkup=None):
         self.errorMsg = errorMsg
@@ -0,0 +1,85 @@
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+def logFields(logKey: str = None, **fields) -> dict:
+    """ Returns "extra" for logging calls.
+    logKey: Lines with the same key get rate limited e.g. lines logged on every loop run. Warnings and errors are never rate limited.
+    fields: Structured fields which get appended to the message as key=value e.g. durations or entry IDs. """
+    extra = {'fields': fields}
+    if logKey is not None:
+        extra['logKey'] = logKey
+    return extra
+
+
+class RateLimitFilter(logging.Filter):
+    """ Lets through max. one record per logKey every X seconds and adds the number of suppressed records to the next one. """
+
+    def __init__(self, intervalSeconds: float = 60):
+        super().__init__()
+        self.intervalSeconds = intervalSeconds
+        self.lock = threading.Lock()
+        # logKey -> (monotonic time of last emitted record, number of suppressed records since then)
+        self.states = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        logKey = getattr(record, 'logKey', None)
+        if logKey is None or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            lastEmitted, numberOfSuppressed = self.states.get(logKey, (None, 0))
+            if lastEmitted is not None and now - lastEmitted < self.intervalSeconds:
+                self.states[logKey] = (lastEmitted, numberOfSuppressed + 1)
+                return False
+            self.states[logKey] = (now, 0)
+        if numberOfSuppressed > 0:
+            record.suppressed = numberOfSuppressed
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """ Appends structured fields and the number of suppressed similar lines to the message. """
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        text = super().formatMessage(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' | ' + ' '.join(key + '=' + str(value) for key, value in fields.items())
+        suppressed = getattr(record, 'suppressed', None)
+        if suppressed:
+            text += ' (+' + str(suppressed) + ' similar lines suppressed)'
+        return text
+
+
+class InProcessQueueHandler(QueueHandler):
+    """ Only freezes the message in the calling thread. Formatting (incl. tracebacks) and writing happens in the listener thread. """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setupLogging(level: int = logging.INFO, rateLimitSeconds: float = 60) -> QueueListener:
+    """ Logging calls only put records into a queue. A background thread formats- and writes them -> Log I/O never blocks the batch process or handler threads. """
+    logQueue = queue.SimpleQueue()
+    queueHandler = InProcessQueueHandler(logQueue)
+    queueHandler.addFilter(RateLimitFilter(rateLimitSeconds))
+    streamHandler = logging.StreamHandler(sys.stdout)
+    streamHandler.setFormatter(StructuredFormatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s'))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queueHandler)
+    root.setLevel(level)
+    listener = QueueListener(logQueue, streamHandler, respect_handler_level=True)
+    listener.start()
+    # Write everything that is still queued on exit
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import Union, Tuple
+
+from telegram import ReplyMarkup
+
+from Clock import Clock, SYSTEM_CLOCK
+
+
+class EDIT_ACTIONS:
+    """ What to do with a new render of a message, see MessageEditCache.planEdit """
+    # Message already shows it
+    SKIP = 'skip'
+    # Send it now
+    SEND = 'send'
+    # Stored as pending edit -> Caller needs to schedule the flush
+    SCHEDULE = 'schedule'
+    # Replaced a pending edit whose flush has already been scheduled
+    MERGED = 'merged'
+
+
+class MessageEditCache:
+    """ Remembers what has been rendered into which message so we can skip edits that wouldn't change anything
+    (Telegram would reply with "BadRequest: message is not modified") and coalesce bursts of edits into the latest state. """
+
+    def __init__(self, maxEntries: int = 1000, coalesceSeconds: float = 1.0, clock: Clock = SYSTEM_CLOCK):
+        self.clock = clock
+        self.maxEntries = maxEntries
+        self.coalesceSeconds = coalesceSeconds
+        self.lock = threading.Lock()
+        # (chatID, messageID) -> (renderHash, monotonic time of last edit)
+        self.lastEdits = OrderedDict()
+        # (chatID, messageID) -> (renderHash, latest state that hasn't been sent yet)
+        self.pendingEdits = {}
+
+    @staticmethod
+    def getRenderHash(text: str, reply_markup: Union[ReplyMarkup, None] = None) -> int:
+        if reply_markup is None:
+            return hash((text, None))
+        else:
+            return hash((text, reply_markup.to_json()))
+
+    def isUnchanged(self, key: Tuple[str, int], renderHash: int) -> bool:
+        with self.lock:
+            lastEdit = self.lastEdits.get(key)
+            return lastEdit is not None and lastEdit[0] == renderHash
+
+    def markEdited(self, key: Tuple[str, int], renderHash: int) -> None:
+        with self.lock:
+            self.lastEdits[key] = (renderHash, self.clock.monotonic())
+            self.lastEdits.move_to_end(key)
+            while len(self.lastEdits) > self.maxEntries:
+                self.lastEdits.popitem(last=False)
+
+    def planEdit(self, key: Tuple[str, int], renderHash: int, edit: tuple) -> Tuple[str, float]:
+        """ Decides what to do with a new render of a message so the last render always wins. Returns (EDIT_ACTIONS, seconds until the flush is due). """
+        with self.lock:
+            lastEdit = self.lastEdits.get(key)
+            if lastEdit is not None and lastEdit[0] == renderHash:
+                # Back at what the message shows -> An older pending render must not be sent anymore
+                self.pendingEdits.pop(key, None)
+                return EDIT_ACTIONS.SKIP, 0
+            if key in self.pendingEdits:
+                # Flush is already scheduled and will send this render instead
+                self.pendingEdits[key] = (renderHash, edit)
+                return EDIT_ACTIONS.MERGED, 0
+            delay = 0 if lastEdit is None else max(0.0, lastEdit[1] + self.coalesceSeconds - self.clock.monotonic())
+            if delay > 0:
+                self.pendingEdits[key] = (renderHash, edit)
+                return EDIT_ACTIONS.SCHEDULE, delay
+            return EDIT_ACTIONS.SEND, 0
+
+    def popPending(self, key: Tuple[str, int]) -> Union[tuple, None]:
+        with self.lock:
+            pendingEdit = self.pendingEdits.pop(key, None)
+            return pendingEdit[1] if pendingEdit is not None else None
@@ -0,0 +1,130 @@
+import atexit
+import logging
+import pickle
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import DefaultDict, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence
+from telegram.ext.utils.promise import Promise
+from telegram.ext.utils.types import ConversationDict
+
+
+class SQLitePersistence(BasePersistence):
+    """ Keeps conversation states and context.user_data across restarts so open menus keep working.
+    Everything is served from memory. Changes are collected and written in one transaction every few seconds by a background thread -> Button presses never wait for the disk. """
+
+    def __init__(self, path: str, flushIntervalSeconds: float = 5):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.path = path
+        self.flushIntervalSeconds = flushIntervalSeconds
+        self.lock = threading.Lock()
+        # Only one flush at a time
+        self.writeLock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # WAL: Writes are appends to the log -> Cheap and crash safe
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS conversations (name TEXT NOT NULL, key BLOB NOT NULL, state BLOB NOT NULL, PRIMARY KEY (name, key))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL)')
+        self.db.commit()
+        self.conversations = {}
+        for name, key, state in self.db.execute('SELECT name, key, state FROM conversations'):
+            self.conversations.setdefault(name, {})[pickle.loads(key)] = pickle.loads(state)
+        self.userData = defaultdict(dict)
+        # user_id -> Serialized data as stored in DB -> Unchanged data doesn't need to be written
+        self.storedUserData = {}
+        for userID, data in self.db.execute('SELECT user_id, data FROM user_data'):
+            self.userData[userID] = pickle.loads(data)
+            self.storedUserData[userID] = data
+        # Changes which haven't been written yet. None = delete
+        self.pendingConversations: Dict[Tuple[str, bytes], Optional[bytes]] = {}
+        self.pendingUserData: Dict[int, bytes] = {}
+        logging.info("Loaded persisted state | Users: " + str(len(self.userData)) + " | Conversations: " + str(sum(len(conversations) for conversations in self.conversations.values())))
+        self.flushEvent = threading.Event()
+        self.flushThread = threading.Thread(target=self.runFlushLoop, name='PersistenceFlush', daemon=True)
+        self.flushThread.start()
+        atexit.register(self.flush)
+
+    def get_user_data(self) -> DefaultDict[int, dict]:
+        return self.userData
+
+    def get_chat_data(self) -> DefaultDict[int, dict]:
+        return defaultdict(dict)
+
+    def get_bot_data(self) -> dict:
+        return {}
+
+    def get_conversations(self, name: str) -> ConversationDict:
+        return self.conversations.setdefault(name, {})
+
+    def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        if isinstance(new_state, (tuple, Promise)):
+            # (old state, Promise) while a handler is still running. Old state may itself be such a tuple -> Keep the persisted state.
+            # The ConversationHandler resolves the promise on the next update and persists its result then.
+            return
+        with self.lock:
+            if new_state is None:
+                self.conversations.setdefault(name, {}).pop(key, None)
+                self.pendingConversations[(name, pickle.dumps(key))] = None
+            else:
+                self.conversations.setdefault(name, {})[key] = new_state
+                self.pendingConversations[(name, pickle.dumps(key))] = pickle.dumps(new_state)
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        serializedData = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.userData[user_id] = data
+            if self.storedUserData.get(user_id) == serializedData:
+                self.pendingUserData.pop(user_id, None)
+                return
+            self.pendingUserData[user_id] = serializedData
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    def update_bot_data(self, data: dict) -> None:
+        pass
+
+    def runFlushLoop(self) -> None:
+        while not self.flushEvent.wait(self.flushIntervalSeconds):
+            try:
+                self.flush()
+            except:
+                logging.warning("Failed to persist bot state", exc_info=True)
+
+    def flush(self) -> None:
+        """ Writes all pending changes in one transaction. """
+        with self.writeLock:
+            with self.lock:
+                if len(self.pendingConversations) == 0 and len(self.pendingUserData) == 0:
+                    return
+                pendingConversations = self.pendingConversations
+                pendingUserData = self.pendingUserData
+                self.pendingConversations = {}
+                self.pendingUserData = {}
+            try:
+                self.writePending(pendingConversations, pendingUserData)
+            except:
+                # Keep changes for the next try unless they've been superseded in the meantime
+                with self.lock:
+                    for key, state in pendingConversations.items():
+                        self.pendingConversations.setdefault(key, state)
+                    for userID, data in pendingUserData.items():
+                        self.pendingUserData.setdefault(userID, data)
+                raise
+            with self.lock:
+                self.storedUserData.update(pendingUserData)
+
+    def writePending(self, pendingConversations: dict, pendingUserData: dict) -> None:
+        with self.db:
+            self.db.executemany('DELETE FROM conversations WHERE name = ? AND key = ?', [key for key, state in pendingConversations.items() if state is None])
+            self.db.executemany('INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)', [(key[0], key[1], state) for key, state in pendingConversations.items() if state is not None])
+            self.db.executemany('INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)', list(pendingUserData.items()))
+
+    def close(self) -> None:
+        atexit.unregister(self.flush)
+        self.flushEvent.set()
+        self.flush()
+        self.db.close()
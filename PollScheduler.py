@@ -0,0 +1,85 @@
+import logging
+from typing import List
+
+from Clock import Clock, SYSTEM_CLOCK
+from LogSetup import logFields
+
+
+class AdaptivePollScheduler:
+    """ Decides when the Thingspeak channel should be polled next.
+    Learns the upload interval of the alarm system from the serverside timestamps of new entries and polls shortly after the next expected upload.
+    Backs off on errors, on missing uploads and while snoozed. Polls as fast as allowed for a while after alarms have been triggered. """
+
+    def __init__(self, minIntervalSeconds: float = 5, maxIntervalSeconds: float = 60, snoozedIntervalSeconds: float = 30, clock: Clock = SYSTEM_CLOCK):
+        self.clock = clock
+        self.minIntervalSeconds = minIntervalSeconds
+        self.maxIntervalSeconds = maxIntervalSeconds
+        self.snoozedIntervalSeconds = snoozedIntervalSeconds
+        # Max. wait time after errors
+        self.maxErrorBackoffSeconds = 300
+        # Time after expected upload until we poll -> Gives Thingspeak some time to process the upload
+        self.uploadMarginSeconds = 2
+        # Poll with min interval for this amount of time after alarms have been triggered
+        self.tightenAfterTriggerSeconds = 120
+        # Thingspeak free accounts allow one upload every 15 seconds -> Good first guess
+        self.estimatedUploadIntervalSeconds = 15.0
+        self.lastUploadTimestamp = None
+        # Monotonic time -> Wall clock changes don't stop polling
+        self.nextPollMonotonic = None
+        self.consecutiveErrors = 0
+        self.consecutivePollsWithoutNewData = 0
+        self.tightenUntilMonotonic = None
+
+    def isPollDue(self) -> bool:
+        return self.nextPollMonotonic is None or self.clock.monotonic() >= self.nextPollMonotonic
+
+    def getSecondsUntilNextPoll(self) -> float:
+        if self.nextPollMonotonic is None:
+            return 0.0
+        return max(0.0, self.nextPollMonotonic - self.clock.monotonic())
+
+    def learnUploadInterval(self, uploadTimestamps: List[float]) -> None:
+        """ Updates estimated upload interval via EWMA of the deltas between serverside timestamps of new entries. """
+        for uploadTimestamp in uploadTimestamps:
+            if self.lastUploadTimestamp is not None and uploadTimestamp > self.lastUploadTimestamp:
+                # Clamp outliers e.g. alarm system was offline for some hours
+                delta = min(uploadTimestamp - self.lastUploadTimestamp, 4 * self.estimatedUploadIntervalSeconds)
+                self.estimatedUploadIntervalSeconds = 0.7 * self.estimatedUploadIntervalSeconds + 0.3 * max(1.0, delta)
+            if self.lastUploadTimestamp is None or uploadTimestamp > self.lastUploadTimestamp:
+                self.lastUploadTimestamp = uploadTimestamp
+
+    def onPollSuccess(self, uploadTimestamps: List[float], alarmsTriggered: bool, isSnoozed: bool) -> None:
+        """
+        :param uploadTimestamps: Serverside timestamps of all new entries of this poll
+        :param alarmsTriggered: True if any sensor was triggered during this poll
+        :param isSnoozed: True if alarms are globally snoozed
+        """
+        now = self.clock.now()
+        self.consecutiveErrors = 0
+        if len(uploadTimestamps) > 0:
+            self.consecutivePollsWithoutNewData = 0
+        else:
+            self.consecutivePollsWithoutNewData += 1
+        self.learnUploadInterval(uploadTimestamps)
+        if alarmsTriggered:
+            self.tightenUntilMonotonic = self.clock.monotonic() + self.tightenAfterTriggerSeconds
+        if self.tightenUntilMonotonic is not None and self.clock.monotonic() < self.tightenUntilMonotonic:
+            waitSeconds = self.minIntervalSeconds
+        elif isSnoozed:
+            # Only sensors which override snooze matter -> No need to be fast
+            waitSeconds = self.snoozedIntervalSeconds
+        elif self.lastUploadTimestamp is not None and self.lastUploadTimestamp + self.estimatedUploadIntervalSeconds + self.uploadMarginSeconds > now:
+            # Poll right after next expected upload
+            waitSeconds = self.lastUploadTimestamp + self.estimatedUploadIntervalSeconds + self.uploadMarginSeconds - now
+        else:
+            # Expected upload is overdue -> Back off until data is flowing again
+            waitSeconds = self.minIntervalSeconds * 2 ** min(self.consecutivePollsWithoutNewData, 6)
+        waitSeconds = min(max(waitSeconds, self.minIntervalSeconds), self.maxIntervalSeconds)
+        self.nextPollMonotonic = self.clock.monotonic() + waitSeconds
+        logging.info("Next poll scheduled", extra=logFields('nextPoll', wait_s=round(waitSeconds, 1), upload_interval_s=round(self.estimatedUploadIntervalSeconds, 1)))
+
+    def onPollError(self) -> None:
+        self.consecutiveErrors += 1
+        waitSeconds = min(self.minIntervalSeconds * 2 ** min(self.consecutiveErrors, 10), self.maxErrorBackoffSeconds)
+        self.nextPollMonotonic = self.clock.monotonic() + waitSeconds
+        logging.warning("Poll failed " + str(self.consecutiveErrors) + "x in a row -> Next poll in " + "{:.1f}".format(waitSeconds) + "s")
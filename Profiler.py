@@ -0,0 +1,109 @@
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable
+
+
+class SamplingProfiler:
+    """ Finds out where time goes in a running bot without restarting it: Samples the stacks of all threads (batch process, handler lanes, dispatcher) every few milliseconds.
+    Overhead is limited to one short walk over all stacks per sample -> Can be used in production.
+    Optionally also records memory allocations via tracemalloc during the same time. """
+
+    def __init__(self, intervalSeconds: float = 0.005, topN: int = 25):
+        self.intervalSeconds = intervalSeconds
+        self.topN = topN
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def isRunning(self) -> bool:
+        with self.lock:
+            return self.thread is not None
+
+    def start(self, durationSeconds: float, onDone: Callable[[str], None], traceMemory: bool = True) -> bool:
+        """ Profiles for the given duration in a background thread and calls onDone with the report afterwards. Returns False if the profiler is already running. """
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.thread = threading.Thread(target=self.run, args=(durationSeconds, onDone, traceMemory), name='Profiler', daemon=True)
+            self.thread.start()
+        return True
+
+    def run(self, durationSeconds: float, onDone: Callable[[str], None], traceMemory: bool) -> None:
+        try:
+            report = self.profile(durationSeconds, traceMemory)
+        except Exception as e:
+            logging.exception("Profiling failed")
+            report = "Profiling failed: " + str(e)
+        finally:
+            with self.lock:
+                self.thread = None
+        onDone(report)
+
+    def profile(self, durationSeconds: float, traceMemory: bool) -> str:
+        ownThreadID = threading.get_ident()
+        # Function = (file, first line, name)
+        selfSamples = Counter()
+        totalSamples = Counter()
+        threadSamples = Counter()
+        numberOfSamples = 0
+        startedTracemalloc = False
+        if traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            startedTracemalloc = True
+        threadNames = {}
+        startTime = time.perf_counter()
+        endTime = startTime + durationSeconds
+        try:
+            while time.perf_counter() < endTime:
+                for thread in threading.enumerate():
+                    threadNames[thread.ident] = thread.name
+                for threadID, frame in sys._current_frames().items():
+                    if threadID == ownThreadID:
+                        continue
+                    numberOfSamples += 1
+                    threadSamples[threadNames.get(threadID, str(threadID))] += 1
+                    code = frame.f_code
+                    selfSamples[(code.co_filename, code.co_firstlineno, code.co_name)] += 1
+                    # Count every function only once per stack e.g. for recursion
+                    seen = set()
+                    while frame is not None:
+                        code = frame.f_code
+                        function = (code.co_filename, code.co_firstlineno, code.co_name)
+                        if function not in seen:
+                            seen.add(function)
+                            totalSamples[function] += 1
+                        frame = frame.f_back
+                time.sleep(self.intervalSeconds)
+            memorySnapshot = None
+            if tracemalloc.is_tracing():
+                # Allocations of the profiler itself are not of interest
+                memorySnapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)])
+        finally:
+            if startedTracemalloc:
+                tracemalloc.stop()
+        duration = time.perf_counter() - startTime
+        text = "Profiled " + "{:.1f}".format(duration) + "s | Samples: " + str(numberOfSamples) + " | Interval: " + str(int(self.intervalSeconds * 1000)) + "ms\n"
+        text += "Threads waiting for I/O or locks show up as well e.g. in select/wait/read.\n"
+        text += self.formatCounter("Samples per thread", threadSamples, numberOfSamples, lambda threadName: threadName)
+        text += self.formatCounter("Top functions (self)", selfSamples, numberOfSamples, self.formatFunction)
+        text += self.formatCounter("Top functions (total, incl. callees)", totalSamples, numberOfSamples, self.formatFunction)
+        if memorySnapshot is not None:
+            text += "\nTop memory allocations (tracemalloc, still allocated):\n"
+            for stat in memorySnapshot.statistics('lineno')[:self.topN]:
+                text += str(stat) + "\n"
+        return text
+
+    def formatCounter(self, title: str, counter: Counter, numberOfSamples: int, formatKey: Callable) -> str:
+        text = "\n" + title + ":\n"
+        for key, count in counter.most_common(self.topN):
+            text += "{:6.1f}%".format(100 * count / max(1, numberOfSamples)) + "  " + formatKey(key) + "\n"
+        return text
+
+    @staticmethod
+    def formatFunction(function: tuple) -> str:
+        filename, lineNumber, name = function
+        return name + " (" + os.path.basename(filename) + ":" + str(lineNumber) + ")"
@@ -0,0 +1,80 @@
+import argparse
+import logging
+import time
+from typing import Iterable, Iterator, List, Union
+
+from AlarmSystem import AlarmSystem
+from Clock import VirtualClock
+from EventLog import readEventLog
+from Helper import BotConfig, loadConfig, formatTimestampToGermanDateWithSeconds
+
+
+class ReplayAlarmSystem(AlarmSystem):
+    """ AlarmSystem which reads its data from recorded events instead of Thingspeak. """
+
+    def __init__(self, config: BotConfig, clock: VirtualClock):
+        # Never record a replay
+        super().__init__(config.copy(update={'event_log_dir': None}), clock=clock)
+        self.currentEvent = None
+
+    def getLastEntryID(self) -> Union[int, None]:
+        return self.currentEvent['last_entry_id']
+
+    def getFeedEntries(self, minEntryID: Union[int, None], numberOfEntries: Union[int, None]) -> Iterator[dict]:
+        for entry in self.currentEvent.get('feeds', []):
+            if minEntryID is None or entry['entry_id'] > minEntryID:
+                yield entry
+
+
+class ReplayResult:
+
+    def __init__(self):
+        self.numberOfPolls = 0
+        self.numberOfEntries = 0
+        self.durationSeconds = 0.0
+        # (local timestamp of the poll, alarm category, alarm text)
+        self.alarms = []
+
+    def getSummary(self) -> str:
+        entriesPerSecond = self.numberOfEntries / self.durationSeconds if self.durationSeconds > 0 else 0
+        text = "Replayed " + str(self.numberOfPolls) + " polls with " + str(self.numberOfEntries) + " entries in " + "{:.3f}".format(self.durationSeconds) + "s"
+        text += " (" + "{:.0f}".format(entriesPerSecond) + " entries/s)"
+        text += " | Alarms: " + str(len(self.alarms))
+        return text
+
+
+def replay(events: Iterable[dict], config: BotConfig) -> ReplayResult:
+    """ Runs all recorded polls through a fresh AlarmSystem as fast as possible and collects all alarms which would have been sent. """
+    clock = VirtualClock()
+    alarmSystem = ReplayAlarmSystem(config, clock)
+    result = ReplayResult()
+    for event in events:
+        clock.set(event['t'])
+        alarmSystem.currentEvent = event
+        startTime = time.perf_counter()
+        alarmSystem.updateAlarms()
+        result.durationSeconds += time.perf_counter() - startTime
+        result.numberOfPolls += 1
+        result.numberOfEntries += len(event.get('feeds', []))
+        for category, alarms in (('user', alarmSystem.alarms), ('admin', alarmSystem.alarmsAdminOnly), ('user snooze override', alarmSystem.alarmsSnoozeOverride),
+                                 ('admin snooze override', alarmSystem.alarmsAdminOnlySnoozeOverride)):
+            for alarmText in alarms:
+                result.alarms.append((event['t'], category, alarmText))
+    return result
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replays a recorded event log (see event_log_dir) and prints all alarms that would have been sent. Use a modified config to test e.g. new trigger values.")
+    parser.add_argument('path', help="Event log file or directory")
+    parser.add_argument('--config', default='config.json', help="Config to evaluate the recorded data with")
+    parser.add_argument('--verbose', action='store_true', help="Print log output of the alarm system")
+    options = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO if options.verbose else logging.ERROR)
+    result = replay(readEventLog(options.path), loadConfig(options.config))
+    for timestamp, category, alarmText in result.alarms:
+        print(formatTimestampToGermanDateWithSeconds(timestamp) + " | " + category + " | " + alarmText)
+    print(result.getSummary())
+
+
+if __name__ == '__main__':
+    main()
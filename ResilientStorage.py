@@ -0,0 +1,359 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+from Clock import Clock, SYSTEM_CLOCK
+from Helper import BotException, SYMBOLS
+from Storage import DATABASES, USERDB, Storage, UserRow, getUserRole, getUserSortName, getUserSummary, withoutMetadata
+
+
+class StorageUnavailableError(BotException):
+    """ Operation isn't possible while the storage backend is unavailable """
+
+    def __init__(self, errorMsg: str = SYMBOLS.WARNING + "Die Datenbank ist gerade nicht erreichbar. Bitte versuche es später nochmal."):
+        super().__init__(errorMsg)
+
+
+class CircuitBreaker:
+    """ Stops sending requests to a backend after several failures in a row. After openSeconds a single trial request is let through: Success closes the breaker again, failure keeps it open. """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failureThreshold: int = 3, openSeconds: float = 30, clock: Clock = SYSTEM_CLOCK):
+        self.failureThreshold = failureThreshold
+        self.openSeconds = openSeconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutiveFailures = 0
+        self.openedMonotonic = None
+
+    def allowRequest(self) -> bool:
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock.monotonic() - self.openedMonotonic >= self.openSeconds:
+                # Only one trial at a time
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def onSuccess(self) -> bool:
+        """ Returns True if the breaker has been closed by this call """
+        with self.lock:
+            self.consecutiveFailures = 0
+            if self.state == self.CLOSED:
+                return False
+            self.state = self.CLOSED
+            return True
+
+    def onFailure(self) -> bool:
+        """ Returns True if the breaker has been opened by this call """
+        with self.lock:
+            self.consecutiveFailures += 1
+            wasClosed = self.state == self.CLOSED
+            if self.state == self.HALF_OPEN or self.consecutiveFailures >= self.failureThreshold:
+                self.state = self.OPEN
+                self.openedMonotonic = self.clock.monotonic()
+            return wasClosed and self.state == self.OPEN
+
+    def isClosed(self) -> bool:
+        return self.state == self.CLOSED
+
+
+class ResilientStorage(Storage):
+    """ Wraps a storage backend so the bot keeps working while it is unavailable.
+    Keeps a write-through snapshot of all users and the bot state in memory. While the circuit breaker is open, reads are served from the snapshot and writes are applied to it and queued.
+    Queued writes are coalesced per doc (last write wins) and replayed in order once the backend is reachable again. They are lost if the bot gets restarted before that.
+    Until the snapshot has been loaded from the backend once, it can't answer anything e.g. "are there any users?" -> Fallbacks raise StorageUnavailableError instead.
+    Docs served from the snapshot have no revision. Saving such a doc replaces the current doc of the backend. """
+
+    # Key of the bot doc in pendingWrites
+    BOT_DOC_KEY = '_botstate'
+
+    def __init__(self, storage: Storage, clock: Clock = SYSTEM_CLOCK, breaker: CircuitBreaker = None, onAvailabilityChanged: Callable[[bool], None] = None):
+        """
+        :param onAvailabilityChanged: Gets called with False when the backend becomes unavailable and with True once it is back and all queued writes have been replayed
+        """
+        self.storage = storage
+        self.breaker = breaker if breaker is not None else CircuitBreaker(clock=clock)
+        self.onAvailabilityChanged = onAvailabilityChanged
+        # Protects snapshot, botDoc and pendingWrites. Never held during backend requests.
+        self.lock = threading.RLock()
+        # userID -> userDoc
+        self.snapshot: Dict[str, dict] = {}
+        self.botDoc = {'_id': DATABASES.BOTSTATE}
+        self.isSnapshotLoaded = False
+        self.isBotDocLoaded = False
+        # userID or BOT_DOC_KEY -> (operation, args)
+        self.pendingWrites = OrderedDict()
+        # Only one thread replays at a time
+        self.replayLock = threading.Lock()
+
+    def execute(self, operation: Callable, fallback: Callable):
+        """ Runs operation on the backend or fallback if the backend is unavailable. """
+        if not self.breaker.allowRequest():
+            return fallback()
+        try:
+            self.replayPendingWrites()
+            self.loadSnapshotIfMissing()
+            result = operation()
+        except self.storage.UNAVAILABLE_ERRORS:
+            logging.warning("Storage backend unavailable -> Using in-memory snapshot", exc_info=True)
+            if self.breaker.onFailure():
+                self.notifyAvailabilityChanged(False)
+            return fallback()
+        except:
+            # E.g. conflicts: Backend is reachable
+            self.onBackendSuccess()
+            raise
+        self.onBackendSuccess()
+        return result
+
+    def onBackendSuccess(self) -> None:
+        if self.breaker.onSuccess():
+            self.notifyAvailabilityChanged(True)
+
+    def notifyAvailabilityChanged(self, isAvailable: bool) -> None:
+        if isAvailable:
+            logging.warning("Storage backend is available again")
+        else:
+            logging.warning("Storage backend is unavailable -> Read-only mode with in-memory snapshot. Writes are queued.")
+        if self.onAvailabilityChanged is not None:
+            try:
+                self.onAvailabilityChanged(isAvailable)
+            except:
+                logging.warning("Storage availability callback failed", exc_info=True)
+
+    def replayPendingWrites(self) -> None:
+        """ Writes everything that has been queued while the backend was unavailable. Raises if the backend is still unavailable. Unsent writes stay queued. """
+        if len(self.pendingWrites) == 0:
+            return
+        with self.replayLock:
+            numberOfReplayedWrites = 0
+            while True:
+                with self.lock:
+                    if len(self.pendingWrites) == 0:
+                        break
+                    key, (operation, args) = next(iter(self.pendingWrites.items()))
+                try:
+                    operation(*args)
+                    # Replay has changed the revision -> Take the doc as it is stored now
+                    currentDoc = self.storage.getBotDoc() if key == self.BOT_DOC_KEY else self.storage.getUser(key)
+                except self.storage.UNAVAILABLE_ERRORS:
+                    raise
+                except:
+                    # E.g. conflict -> Retrying won't help
+                    logging.warning("Dropping queued storage write which failed: " + key, exc_info=True)
+                    currentDoc = None
+                with self.lock:
+                    # Only remove it if it hasn't been replaced in the meantime
+                    if self.pendingWrites.get(key, (None, None))[1] is args:
+                        del self.pendingWrites[key]
+                        if currentDoc is None:
+                            pass
+                        elif key == self.BOT_DOC_KEY:
+                            self.botDoc = dict(currentDoc)
+                        elif key in self.snapshot:
+                            self.setSnapshotUser(key, currentDoc)
+                numberOfReplayedWrites += 1
+            logging.info("Replayed queued storage writes: " + str(numberOfReplayedWrites))
+
+    def loadSnapshotIfMissing(self) -> None:
+        """ Loads users and bot state from the backend if that hasn't worked yet e.g. because the backend was unavailable during startup. """
+        if not self.isSnapshotLoaded:
+            self.loadSnapshot(self.storage.getUsers())
+        if not self.isBotDocLoaded:
+            self.loadBotDoc(self.storage.getBotDoc())
+
+    def loadSnapshot(self, users: Iterator[Tuple[str, dict]]) -> list:
+        """ Full refresh of the snapshot. Returns all users. """
+        users = list(users)
+        with self.lock:
+            self.snapshot = {}
+            for userID, userDoc in users:
+                self.setSnapshotUser(userID, userDoc)
+            self.isSnapshotLoaded = True
+        return users
+
+    def loadBotDoc(self, botDoc: dict) -> dict:
+        with self.lock:
+            self.botDoc = dict(botDoc)
+            self.isBotDocLoaded = True
+        return botDoc
+
+    def requireSnapshot(self) -> None:
+        if not self.isSnapshotLoaded:
+            raise StorageUnavailableError()
+
+    def queueWrite(self, key: str, operation: Callable, *args) -> None:
+        if not (self.isBotDocLoaded if key == self.BOT_DOC_KEY else self.isSnapshotLoaded):
+            # Replay would overwrite docs we've never seen
+            raise StorageUnavailableError()
+        with self.lock:
+            self.pendingWrites.pop(key, None)
+            self.pendingWrites[key] = (operation, args)
+
+    def checkAvailability(self) -> None:
+        """ Sends a trial request once the breaker allows it -> Queued writes get replayed even if nobody uses the bot. """
+        if not self.isAvailable() or len(self.pendingWrites) > 0 or not self.isSnapshotLoaded or not self.isBotDocLoaded:
+            self.getBotDoc()
+
+    def isAvailable(self) -> bool:
+        return self.breaker.isClosed()
+
+    def getNumberOfPendingWrites(self) -> int:
+        return len(self.pendingWrites)
+
+    def setSnapshotUser(self, userID: str, userDoc: Union[dict, None]) -> None:
+        with self.lock:
+            if userDoc is None:
+                self.snapshot.pop(userID, None)
+            else:
+                userDoc = dict(userDoc)
+                userDoc['_id'] = userID
+                self.snapshot[userID] = userDoc
+
+    def getSnapshotUsers(self, condition: Callable[[dict], bool] = None) -> Dict[str, dict]:
+        """ Returns copies without revision of all users in the snapshot which match the given condition """
+        self.requireSnapshot()
+        with self.lock:
+            return {userID: withoutRevision(userDoc) for userID, userDoc in self.snapshot.items() if condition is None or condition(userDoc)}
+
+    def getAdminsFromSnapshot(self) -> Dict[str, dict]:
+        """ Never touches the backend -> For alarms which must not depend on the DB. The snapshot is complete since all writes go through this object.
+        Raises StorageUnavailableError if it can't be loaded. """
+        self.loadSnapshotIfAvailable()
+        return self.getSnapshotUsers(isAdmin)
+
+    def getApprovedUsersFromSnapshot(self) -> Dict[str, dict]:
+        self.loadSnapshotIfAvailable()
+        return self.getSnapshotUsers(isApprovedOrAdmin)
+
+    def loadSnapshotIfAvailable(self) -> None:
+        """ Tries to load the snapshot via the backend e.g. if the backend was unavailable during startup """
+        if not self.isSnapshotLoaded:
+            self.execute(lambda: None, lambda: None)
+
+    def getUserIDs(self) -> List[str]:
+        return self.execute(self.storage.getUserIDs, lambda: list(self.getSnapshotUsers().keys()))
+
+    def hasUser(self, userID: str) -> bool:
+        def hasInSnapshot():
+            self.requireSnapshot()
+            return userID in self.snapshot
+
+        return self.execute(lambda: self.storage.hasUser(userID), hasInSnapshot)
+
+    def getUser(self, userID: str) -> Union[dict, None]:
+        def getFromSnapshot():
+            self.requireSnapshot()
+            with self.lock:
+                userDoc = self.snapshot.get(userID)
+                return withoutRevision(userDoc) if userDoc is not None else None
+
+        return self.execute(lambda: self.storage.getUser(userID), getFromSnapshot)
+
+    def getUsers(self) -> Iterator[Tuple[str, dict]]:
+        return iter(self.execute(lambda: self.loadSnapshot(self.storage.getUsers()), lambda: list(self.getSnapshotUsers().items())))
+
+    def getAdmins(self) -> Dict[str, dict]:
+        return self.execute(self.storage.getAdmins, self.getAdminsFromSnapshot)
+
+    def getApprovedUsers(self) -> Dict[str, dict]:
+        return self.execute(self.storage.getApprovedUsers, self.getApprovedUsersFromSnapshot)
+
+    def createUser(self, userID: str, userDoc: dict) -> None:
+        self.execute(lambda: self.storage.createUser(userID, userDoc), lambda: self.queueWrite(userID, self.storage.createUser, userID, withoutMetadata(userDoc)))
+        self.setSnapshotUser(userID, userDoc)
+
+    def saveUser(self, userDoc: dict) -> None:
+        userID = userDoc['_id']
+
+        def save():
+            if '_rev' in userDoc:
+                self.storage.saveUser(userDoc)
+            else:
+                # Doc has been served from the snapshot -> Its revision is unknown
+                self.storage.createUser(userID, withoutMetadata(userDoc))
+
+        # Revision of the doc might be outdated by the time it gets replayed -> Replay replaces the current doc instead
+        self.execute(save, lambda: self.queueWrite(userID, self.storage.createUser, userID, withoutMetadata(userDoc)))
+        self.setSnapshotUser(userID, userDoc)
+
+    def deleteUser(self, userID: str) -> bool:
+        def deleteInSnapshot():
+            self.queueWrite(userID, self.storage.deleteUser, userID)
+            return userID in self.snapshot
+
+        result = self.execute(lambda: self.storage.deleteUser(userID), deleteInSnapshot)
+        self.setSnapshotUser(userID, None)
+        return result
+
+    def getUserList(self, limit: int, cursor: Union[list, None] = None, skip: int = 0) -> List[UserRow]:
+        def getFromSnapshot():
+            rows = sorted((getUserRole(userDoc), getUserSortName(userDoc), userID, userDoc) for userID, userDoc in self.getSnapshotUsers().items())
+            if cursor is not None:
+                rows = [row for row in rows if row[:3] >= (cursor[0][0], cursor[0][1], cursor[1])]
+            else:
+                rows = rows[skip:]
+            return [UserRow(userID, [role, sortName], getUserSummary(userDoc)) for role, sortName, userID, userDoc in rows[:limit]]
+
+        return self.execute(lambda: self.storage.getUserList(limit, cursor=cursor, skip=skip), getFromSnapshot)
+
+    def searchUsers(self, searchTerm: str, limit: int) -> List[UserRow]:
+        def searchInSnapshot():
+            rows = []
+            for userID, userDoc in self.getSnapshotUsers().items():
+                for name in {name.lower() for name in (userDoc.get(USERDB.USERNAME), userDoc.get(USERDB.FIRST_NAME), userDoc.get(USERDB.LAST_NAME)) if name}:
+                    if name.startswith(searchTerm):
+                        rows.append((name, userID, userDoc))
+            rows.sort(key=lambda row: row[:2])
+            return [UserRow(userID, name, getUserSummary(userDoc)) for name, userID, userDoc in rows[:limit]]
+
+        return self.execute(lambda: self.storage.searchUsers(searchTerm, limit), searchInSnapshot)
+
+    def archiveUser(self, userID: str, archivedUserDoc: dict) -> None:
+        self.execute(lambda: self.storage.archiveUser(userID, archivedUserDoc), lambda: self.queueWrite(userID, self.storage.archiveUser, userID, withoutMetadata(archivedUserDoc)))
+        self.setSnapshotUser(userID, None)
+
+    def getArchivedUsers(self) -> Iterator[Tuple[str, dict]]:
+        return iter(self.execute(lambda: list(self.storage.getArchivedUsers()), self.raiseUnavailable))
+
+    def getBotDoc(self) -> dict:
+        def getFromSnapshot():
+            # Default bot state if it has never been loaded. Saving it is refused until then.
+            with self.lock:
+                return withoutRevision(self.botDoc)
+
+        return self.execute(lambda: self.loadBotDoc(self.storage.getBotDoc()), getFromSnapshot)
+
+    def saveBotDoc(self, botDoc: dict) -> None:
+        self.execute(lambda: self.storage.saveBotDoc(botDoc), lambda: self.queueWrite(self.BOT_DOC_KEY, self.storage.saveBotDoc, withoutMetadata(botDoc)))
+        with self.lock:
+            self.botDoc = dict(botDoc)
+
+    def compact(self) -> Tuple[int, int]:
+        return self.execute(self.storage.compact, self.raiseUnavailable)
+
+    def close(self) -> None:
+        self.storage.close()
+
+    @staticmethod
+    def raiseUnavailable():
+        raise StorageUnavailableError()
+
+
+def withoutRevision(doc: dict) -> dict:
+    return {key: value for key, value in doc.items() if key != '_rev'}
+
+
+def isAdmin(userDoc: dict) -> bool:
+    return bool(userDoc.get(USERDB.IS_ADMIN))
+
+
+def isApprovedOrAdmin(userDoc: dict) -> bool:
+    return bool(userDoc.get(USERDB.IS_ADMIN) or userDoc.get(USERDB.IS_APPROVED, False))
@@ -0,0 +1,220 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, root_validator
+
+from Sensor import Sensor, OPERATORS
+
+
+class RULETYPES:
+    ALL_WITHIN = 'ALL_WITHIN'  # All given sensors have been triggered within X seconds e.g. "Door open AND Movement within 30 seconds"
+    RISE = 'RISE'  # Value has changed by more than X within the last Y seconds e.g. "Temperature rising more than 5° in 10 minutes". Negative delta = falling
+    AVERAGE = 'AVERAGE'  # Average value of the last X seconds compared against trigger value e.g. "Battery average below 11.8V over the last hour"
+
+
+# Max. number of samples a windowed rule keeps in memory
+MAX_WINDOW_SAMPLES = 10000
+
+
+class RuleConfig(BaseModel):
+    """ One entry of thingspeak_rules """
+    name: str
+    type: str
+    fields: List[int] = []
+    field: Optional[int] = None
+    withinSeconds: float = 30
+    windowSeconds: float = 600
+    delta: float = 0
+    triggerValue: Optional[float] = Field(None, alias='trigger')
+    triggerOperator: str = Field('LESS', alias='operator')
+    # Composite rules usually stay triggered for a while -> Only alarm once by default
+    alarmOnlyOnceUntilUntriggered: bool = True
+    overridesSnooze: bool = False
+    adminOnly: bool = False
+    triggeredText: str = 'Ausgelöst'
+    unTriggeredText: str = 'Ok'
+
+    class Config:
+        allow_population_by_field_name = True
+
+    @root_validator(skip_on_failure=True)
+    def checkRuleType(cls, values):
+        ruleType = values['type']
+        if ruleType == RULETYPES.ALL_WITHIN:
+            if len(values['fields']) < 2:
+                raise ValueError('Rule ' + values['name'] + ': ' + RULETYPES.ALL_WITHIN + ' requires at least two "fields"')
+        elif ruleType in (RULETYPES.RISE, RULETYPES.AVERAGE):
+            if values['field'] is None:
+                raise ValueError('Rule ' + values['name'] + ': ' + ruleType + ' requires "field"')
+            if ruleType == RULETYPES.RISE and values['delta'] == 0:
+                raise ValueError('Rule ' + values['name'] + ': ' + RULETYPES.RISE + ' requires "delta"')
+            if ruleType == RULETYPES.AVERAGE and values['triggerValue'] is None:
+                raise ValueError('Rule ' + values['name'] + ': ' + RULETYPES.AVERAGE + ' requires "trigger"')
+        else:
+            raise ValueError('Rule ' + values['name'] + ': Unknown type ' + ruleType)
+        return values
+
+    def getFieldIDs(self) -> List[int]:
+        if self.field is not None:
+            return [self.field]
+        return self.fields
+
+
+class Rule(ABC):
+    """ Derived sensor whose trigger state is computed from samples of other sensors.
+    Provides the same alarm related methods as Sensor so AlarmSystem can handle both the same way.
+    All rules keep O(1) state per sample (running sums, monotonic queues) -> History is never rescanned. """
+    __slots__ = ('cfg', 'triggered', 'lastValue')
+
+    def __init__(self, cfg: RuleConfig):
+        self.cfg = cfg
+        self.triggered = False
+        self.lastValue = None
+
+    def getFieldIDs(self) -> List[int]:
+        return self.cfg.getFieldIDs()
+
+    @abstractmethod
+    def onSample(self, fieldID: int, sensor: Sensor, timestamp: float) -> None:
+        """ Feeds a new value of one of the fields of this rule. timestamp = serverside time of that value. """
+        pass
+
+    def getName(self) -> str:
+        return self.cfg.name
+
+    def getValue(self):
+        return self.lastValue
+
+    def isTriggered(self) -> bool:
+        return self.triggered
+
+    def isAlarmOnlyOnceUntilUntriggered(self) -> bool:
+        return self.cfg.alarmOnlyOnceUntilUntriggered
+
+    @property
+    def isAdminOnlyAlarm(self) -> bool:
+        return self.cfg.adminOnly
+
+    @property
+    def overridesSnooze(self) -> bool:
+        return self.cfg.overridesSnooze
+
+    def getStatusText(self) -> str:
+        if self.triggered:
+            return self.cfg.triggeredText
+        else:
+            return self.cfg.unTriggeredText
+
+
+class AllWithinRule(Rule):
+    __slots__ = ('lastTriggeredTimestamps',)
+
+    def __init__(self, cfg: RuleConfig):
+        super().__init__(cfg)
+        self.lastTriggeredTimestamps = {fieldID: None for fieldID in cfg.fields}
+
+    def onSample(self, fieldID: int, sensor: Sensor, timestamp: float) -> None:
+        if sensor.isTriggered():
+            self.lastTriggeredTimestamps[fieldID] = timestamp
+        oldestTimestamp = timestamp
+        for lastTriggeredTimestamp in self.lastTriggeredTimestamps.values():
+            if lastTriggeredTimestamp is None:
+                oldestTimestamp = None
+                break
+            oldestTimestamp = min(oldestTimestamp, lastTriggeredTimestamp)
+        self.triggered = oldestTimestamp is not None and timestamp - oldestTimestamp <= self.cfg.withinSeconds
+
+
+class RiseRule(Rule):
+    """ Compares current value against min (rising) or max (falling) of the window using a monotonic queue -> Amortized O(1) per sample. """
+    __slots__ = ('extremes',)
+
+    def __init__(self, cfg: RuleConfig):
+        super().__init__(cfg)
+        # (timestamp, value) with increasing (rising) or decreasing (falling) values
+        self.extremes = deque()
+
+    def onSample(self, fieldID: int, sensor: Sensor, timestamp: float) -> None:
+        value = sensor.getValue()
+        rising = self.cfg.delta > 0
+        extremes = self.extremes
+        while len(extremes) > 0 and ((rising and extremes[-1][1] >= value) or (not rising and extremes[-1][1] <= value)):
+            extremes.pop()
+        extremes.append((timestamp, value))
+        while extremes[0][0] < timestamp - self.cfg.windowSeconds or len(extremes) > MAX_WINDOW_SAMPLES:
+            extremes.popleft()
+        change = value - extremes[0][1]
+        self.lastValue = change
+        if rising:
+            self.triggered = change > self.cfg.delta
+        else:
+            self.triggered = change < self.cfg.delta
+
+
+class AverageRule(Rule):
+    """ Running sum over a ring buffer of the samples within the window -> O(1) per sample. """
+    __slots__ = ('samples', 'sum', 'operator')
+
+    def __init__(self, cfg: RuleConfig):
+        super().__init__(cfg)
+        self.samples = deque()
+        self.sum = 0.0
+        self.operator = OPERATORS.BY_NAME.get(cfg.triggerOperator, OPERATORS.EQ)
+
+    def onSample(self, fieldID: int, sensor: Sensor, timestamp: float) -> None:
+        value = sensor.getValue()
+        samples = self.samples
+        samples.append((timestamp, value))
+        self.sum += value
+        while samples[0][0] < timestamp - self.cfg.windowSeconds or len(samples) > MAX_WINDOW_SAMPLES:
+            self.sum -= samples.popleft()[1]
+        average = self.sum / len(samples)
+        self.lastValue = round(average, 2)
+        if self.operator == OPERATORS.LESS:
+            self.triggered = average < self.cfg.triggerValue
+        elif self.operator == OPERATORS.MORE:
+            self.triggered = average > self.cfg.triggerValue
+        else:
+            self.triggered = average == self.cfg.triggerValue
+
+
+RULE_CLASSES = {
+    RULETYPES.ALL_WITHIN: AllWithinRule,
+    RULETYPES.RISE: RiseRule,
+    RULETYPES.AVERAGE: AverageRule,
+}
+
+
+class RuleEngine:
+    """ Evaluates all rules incrementally whenever one of their fields gets a new value. """
+
+    def __init__(self, ruleConfigs: List[RuleConfig], oldEngine: 'RuleEngine' = None):
+        """ Pass the previous engine to keep the state of all rules whose config hasn't changed. """
+        oldRules = {}
+        if oldEngine is not None:
+            for rule in oldEngine.rules:
+                oldRules[rule.cfg.json()] = rule
+        self.rules = []
+        # fieldID -> Rules which depend on that field
+        self.rulesByField = {}
+        for ruleConfig in ruleConfigs:
+            rule = oldRules.get(ruleConfig.json())
+            if rule is None:
+                rule = RULE_CLASSES[ruleConfig.type](ruleConfig)
+            self.rules.append(rule)
+            for fieldID in rule.getFieldIDs():
+                self.rulesByField.setdefault(fieldID, []).append(rule)
+
+    def onSample(self, fieldID: int, sensor: Sensor, timestamp: float) -> list:
+        """ Returns rules which should raise an alarm because of this sample. """
+        rules = self.rulesByField.get(fieldID)
+        if rules is None:
+            return []
+        alarmRules = []
+        for rule in rules:
+            wasTriggeredBefore = rule.isTriggered()
+            rule.onSample(fieldID, sensor, timestamp)
+            if rule.isTriggered() and not (rule.isAlarmOnlyOnceUntilUntriggered() and wasTriggeredBefore):
+                alarmRules.append(rule)
+        return alarmRules
@@ -1,34 +1,97 @@
-from datetime import datetime
+from array import array
 
-from pydantic import BaseModel
-from typing import Optional, Union
+from pydantic import BaseModel, Field
+from typing import Optional
+
+from AnomalyDetector import AnomalyConfig
+from Clock import Clock, SYSTEM_CLOCK
 
 
 class SensorConfig(BaseModel):
+    """ One entry of thingspeak_fields_alarm_state_mapping """
     name: str
-    triggerValue: Union[int, float]
-    triggerOperator: str
+    # float: With Union[int, float] pydantic would cut off e.g. 11.5 to 11
+    triggerValue: float = Field(alias='trigger')
+    triggerOperator: str = Field(alias='operator')
     alarmOnlyOnceUntilUntriggered: Optional[bool] = False
     overridesSnooze: Optional[bool] = False
     triggeredText: str
     unTriggeredText: str
     adminOnly: Optional[bool] = False
+    # Optional statistical detection of unusual values. Its alarms are always admin-only.
+    anomaly: Optional[AnomalyConfig] = None
+
+    class Config:
+        allow_population_by_field_name = True
+
+
+class SensorValues:
+    """ Latest values, trigger flags and timestamps of all sensors of one channel stored in compact arrays.
+    Every sensor owns one slot (index) of these arrays. """
+    __slots__ = ('values', 'hasValue', 'isInteger', 'triggered', 'lastTimeTriggered', 'freeSlots', 'clock')
+
+    def __init__(self, clock: Clock = SYSTEM_CLOCK):
+        self.values = array('d')
+        self.hasValue = array('b')
+        self.isInteger = array('b')
+        self.triggered = array('b')
+        self.lastTimeTriggered = array('d')
+        self.freeSlots = []
+        # Timestamps of all sensors of this table come from this clock
+        self.clock = clock
+
+    def addSlot(self) -> int:
+        if len(self.freeSlots) > 0:
+            return self.freeSlots.pop()
+        self.values.append(0)
+        self.hasValue.append(0)
+        self.isInteger.append(0)
+        self.triggered.append(0)
+        self.lastTimeTriggered.append(-1)
+        return len(self.values) - 1
+
+    def freeSlot(self, slot: int) -> None:
+        self.hasValue[slot] = 0
+        self.triggered[slot] = 0
+        self.lastTimeTriggered[slot] = -1
+        self.freeSlots.append(slot)
+
+    def __len__(self):
+        return len(self.values) - len(self.freeSlots)
+
+
+class OPERATORS:
+    EQ = 0
+    LESS = 1
+    MORE = 2
+    BY_NAME = {'EQ': EQ, 'LESS': LESS, 'MORE': MORE}
 
 
 class Sensor:
+    __slots__ = ('name', 'triggerValue', 'triggerOperator', 'alarmOnceOnceUntilUntriggered', 'overridesSnooze', 'triggeredText', 'unTriggeredText',
+                 'isAdminOnlyAlarm', 'table', 'slot')
 
-    def __init__(self, cfg: SensorConfig):
-
+    def __init__(self, cfg: SensorConfig, table: SensorValues = None, slot: int = None):
+        """ Pass the slot of an existing sensor to keep its current value and trigger state e.g. when its config has changed. """
         self.name = cfg.name
         self.triggerValue = cfg.triggerValue
-        self.triggerOperator = cfg.triggerOperator
+        # Unknown operators are treated as "EQ"
+        self.triggerOperator = OPERATORS.BY_NAME.get(cfg.triggerOperator, OPERATORS.EQ)
         self.alarmOnceOnceUntilUntriggered = cfg.alarmOnlyOnceUntilUntriggered
         self.overridesSnooze = cfg.overridesSnooze
-        self.value = None
-        self.lastTimeTriggered = -1
         self.triggeredText = cfg.triggeredText
         self.unTriggeredText = cfg.unTriggeredText
         self.isAdminOnlyAlarm = cfg.adminOnly
+        if table is None:
+            table = SensorValues()
+        self.table = table
+        if slot is None:
+            self.slot = table.addSlot()
+        else:
+            self.slot = slot
+            # Trigger value/operator might have changed
+            if table.hasValue[slot]:
+                table.triggered[slot] = self.checkTriggered(table.values[slot])
 
     def getName(self):
         return self.name
@@ -42,24 +105,25 @@ class Sensor:
     #     return None
 
     def getStatusText(self):
-        if self.value is None:
+        if not self.table.hasValue[self.slot]:
             return "Undefiniert"
-        if self.isTriggered():
+        if self.table.triggered[self.slot]:
             return self.triggeredText
         else:
             return self.unTriggeredText
 
-    def isTriggered(self) -> bool:
+    def checkTriggered(self, value) -> bool:
         # TODO: Add support for more operators
-        if self.value is None:  # No value set yet -> Not triggered
-            return False
-        if self.triggerOperator == 'LESS':
-            return self.value < self.triggerValue
-        elif self.triggerOperator == 'MORE':
-            return self.value > self.triggerValue
+        if self.triggerOperator == OPERATORS.LESS:
+            return value < self.triggerValue
+        elif self.triggerOperator == OPERATORS.MORE:
+            return value > self.triggerValue
         else:
-            # Assume it's "EQ" -> operator 'equals'
-            return self.value == self.triggerValue
+            return value == self.triggerValue
+
+    def isTriggered(self) -> bool:
+        """ Trigger state gets evaluated once in setValue. No value set yet -> Not triggered """
+        return self.table.triggered[self.slot] == 1
 
     def isAlarmOnlyOnceUntilUntriggered(self) -> bool:
         return self.alarmOnceOnceUntilUntriggered
@@ -69,15 +133,31 @@ class Sensor:
         self.name = sensorName
 
     def setValue(self, value):
-        self.value = value
-        if self.isTriggered():
-            self.lastTimeTriggered = datetime.now().timestamp()
+        table = self.table
+        slot = self.slot
+        table.values[slot] = value
+        table.hasValue[slot] = 1
+        table.isInteger[slot] = isinstance(value, int)
+        triggered = self.checkTriggered(value)
+        table.triggered[slot] = triggered
+        if triggered:
+            table.lastTimeTriggered[slot] = table.clock.now()
 
     def setAdminOnlyAlarm(self, adminOnlyAlarm: bool):
         self.isAdminOnlyAlarm = adminOnlyAlarm
 
     def getValue(self):
-        return self.value
+        table = self.table
+        slot = self.slot
+        if not table.hasValue[slot]:
+            return None
+        elif table.isInteger[slot]:
+            return int(table.values[slot])
+        else:
+            return table.values[slot]
+
+    def getLastTimeTriggered(self) -> float:
+        return self.table.lastTimeTriggered[self.slot]
 
     def getAlarmText(self) -> str:
         """ Returns text to reflect alarm e.g. "Door | Open" """
@@ -87,10 +167,10 @@ class Sensor:
 if __name__ == '__main__':
     sensor1 = Sensor(SensorConfig(name="Batterie", triggerValue=11.4,
                                   triggerOperator="LESS",
-                                  alarmOnlyOnceUntilUntriggered=False))
+                                  alarmOnlyOnceUntilUntriggered=False, triggeredText="niedrig", unTriggeredText="ausreichend"))
     sensor1.setValue(11.4)
 
     sensorNew = Sensor(SensorConfig(name="Batterie2", triggerValue=11.4,
                                     triggerOperator="LESS",
-                                    alarmOnlyOnceUntilUntriggered=False))
+                                    alarmOnlyOnceUntilUntriggered=False, triggeredText="niedrig", unTriggeredText="ausreichend"))
     sensor1.setValue(11.4)
@@ -0,0 +1,428 @@
+import http.client
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Tuple, Union
+
+
+class DATABASES:
+    USERS = 'users'
+    BOTSTATE = 'botstate'
+    USERS_ARCHIVE = 'users_archive'  # Users who have blocked the bot for a long time
+
+
+class DatabaseNames:
+    """ DB names of one bot = DATABASES with the db_prefix of the bot. """
+
+    def __init__(self, prefix: str = ''):
+        self.users = prefix + DATABASES.USERS
+        self.botstate = prefix + DATABASES.BOTSTATE
+        self.usersArchive = prefix + DATABASES.USERS_ARCHIVE
+
+
+class USERDB:
+    USERNAME = 'username'
+    FIRST_NAME = 'first_name'
+    LAST_NAME = 'last_name'
+    IS_APPROVED = 'is_approved'
+    APPROVED_BY = 'approved_by'
+    IS_ADMIN = 'is_admin'
+    APPROVAL_REQUEST_HAS_BEEN_SENT = 'approval_request_has_been_sent'
+    TIMESTAMP_SNOOZE_UNTIL = 'timestamp_snooze_until'
+    TIMESTAMP_REGISTERED = 'timestamp_registered'  # Timestamp when user entered correct password
+    TIMESTAMP_LAST_SNOOZE = 'timestamp_last_snooze'  # Timestamp when user triggered a snooze last time
+    TIMESTAMP_LAST_BROADCAST_SENT = 'timestamp_last_broadcast_sent'
+    # TIMESTAMP_LAST_PASSWORD_TRY = 'timestamp_last_password_try'
+    TIMESTAMP_LAST_APPROVAL_REQUEST = 'timestamp_last_approval_request'
+    TIMESTAMP_APPROVED = 'timestamp_approved'
+    TIMESTAMP_LAST_TIME_REQUESTED_DSGVO_DATA = 'timestamp_last_time_requested_dsgvo_data'
+    TIMESTAMP_LAST_BLOCKED_BOT_ERROR = 'timestamp_last_blocked_bot_error'
+    MSG_ID_LAST_SNOOZE_NOTIFICATION = 'msg_id_last_snooze_notification'
+    MSG_IDS_APPROVAL_REQUESTS = 'msg_ids_approval_requests'
+    MSG_ID_LIVE_STATUS = 'msg_id_live_status'  # Pinned message which gets edited whenever sensor data changes
+
+
+class USERVIEWS:
+    """ CouchDB views on the users DB so that e.g. the ACP doesn't have to load every single user doc. """
+    DESIGN_DOC = '_design/users'
+    BY_ROLE_AND_NAME = 'users/by_role_and_name'
+    BY_NAME = 'users/by_name'
+    # Every row contains all fields required to render a user button -> No further doc fetches needed
+    _EMIT_VALUE = "{username: doc.username, first_name: doc.first_name, last_name: doc.last_name, is_admin: doc.is_admin, is_approved: doc.is_approved}"
+    DEFINITION = {
+        'views': {
+            'by_role_and_name': {
+                # Role: 0 = waiting for approval, 1 = admin, 2 = user
+                'map': "function(doc) { var role = doc.is_approved ? (doc.is_admin ? 1 : 2) : 0; "
+                       "emit([role, ((doc.first_name || '') + ' ' + (doc.last_name || '')).toLowerCase()], " + _EMIT_VALUE + "); }"
+            },
+            'by_name': {
+                'map': "function(doc) { var value = " + _EMIT_VALUE + "; "
+                       "[doc.username, doc.first_name, doc.last_name].forEach(function(name) { if (name) { emit(name.toLowerCase(), value); } }); }"
+            }
+        }
+    }
+
+
+class STORAGE_BACKENDS:
+    COUCHDB = 'couchdb'
+    SQLITE = 'sqlite'
+
+
+class UserRow:
+    """ One result of user list/search queries. Same shape as rows of CouchDB views. """
+    __slots__ = ('id', 'key', 'value')
+
+    def __init__(self, userID: str, key, value: dict):
+        self.id = userID
+        self.key = key
+        self.value = value
+
+
+def getUserRole(userDoc: dict) -> int:
+    """ 0 = waiting for approval, 1 = admin, 2 = user """
+    if not userDoc.get(USERDB.IS_APPROVED, False):
+        return 0
+    return 1 if userDoc.get(USERDB.IS_ADMIN, False) else 2
+
+
+def getUserSortName(userDoc: dict) -> str:
+    return ((userDoc.get(USERDB.FIRST_NAME) or '') + ' ' + (userDoc.get(USERDB.LAST_NAME) or '')).lower()
+
+
+def getUserSummary(userDoc: dict) -> dict:
+    """ Fields of a user list/search row -> Same fields the CouchDB views emit """
+    return {key: userDoc.get(key) for key in (USERDB.USERNAME, USERDB.FIRST_NAME, USERDB.LAST_NAME, USERDB.IS_ADMIN, USERDB.IS_APPROVED)}
+
+
+def withoutMetadata(doc: dict) -> dict:
+    """ Returns doc without backend specific fields like _id and _rev """
+    return {key: value for key, value in doc.items() if not key.startswith('_')}
+
+
+class Storage(ABC):
+    """ Users, archived users and the bot state of one bot.
+    User docs are dicts which contain their ID as "_id". Pass docs returned by getUser to saveUser after changing them. """
+
+    # Errors which mean that the backend is unreachable or overloaded (as opposed to e.g. conflicts)
+    UNAVAILABLE_ERRORS = (OSError, http.client.HTTPException)
+
+    @abstractmethod
+    def getUserIDs(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def hasUser(self, userID: str) -> bool:
+        pass
+
+    @abstractmethod
+    def getUser(self, userID: str) -> Union[dict, None]:
+        pass
+
+    @abstractmethod
+    def getUsers(self) -> Iterator[Tuple[str, dict]]:
+        """ Yields (userID, userDoc) of all users """
+
+    @abstractmethod
+    def getAdmins(self) -> Dict[str, dict]:
+        pass
+
+    @abstractmethod
+    def getApprovedUsers(self) -> Dict[str, dict]:
+        """ Returns approved users and admins """
+
+    @abstractmethod
+    def createUser(self, userID: str, userDoc: dict) -> None:
+        """ Stores a new user. Replaces an existing user with the same ID. """
+
+    @abstractmethod
+    def saveUser(self, userDoc: dict) -> None:
+        pass
+
+    @abstractmethod
+    def deleteUser(self, userID: str) -> bool:
+        """ Returns False if there was no such user """
+
+    @abstractmethod
+    def getUserList(self, limit: int, cursor: Union[list, None] = None, skip: int = 0) -> List[UserRow]:
+        """ Users sorted by role and name. cursor = [key, id] of the first row to return e.g. of the row after the last one of the previous page. """
+
+    @abstractmethod
+    def searchUsers(self, searchTerm: str, limit: int) -> List[UserRow]:
+        """ Prefix search on lowercase username, first name and last name. A user can be returned multiple times if several of their names match. """
+
+    @abstractmethod
+    def archiveUser(self, userID: str, archivedUserDoc: dict) -> None:
+        """ Moves a user to the archive """
+
+    @abstractmethod
+    def getArchivedUsers(self) -> Iterator[Tuple[str, dict]]:
+        pass
+
+    @abstractmethod
+    def getBotDoc(self) -> dict:
+        pass
+
+    @abstractmethod
+    def saveBotDoc(self, botDoc: dict) -> None:
+        pass
+
+    @abstractmethod
+    def compact(self) -> Tuple[int, int]:
+        """ Frees unused space. Returns (size of the users DB in bytes, approx. number of bytes freed). """
+
+    def close(self) -> None:
+        pass
+
+
+class CouchDBStorage(Storage):
+    """ Stores everything in three CouchDB DBs (see DATABASES). """
+
+    def __init__(self, server, databases: DatabaseNames):
+        import couchdb
+        self.UNAVAILABLE_ERRORS = Storage.UNAVAILABLE_ERRORS + (couchdb.ServerError,)
+        self.server = server
+        self.databases = databases
+        # Create required DBs
+        if databases.users not in server:
+            server.create(databases.users)
+        if databases.usersArchive not in server:
+            server.create(databases.usersArchive)
+        if databases.botstate not in server:
+            server.create(databases.botstate)
+            # Store everything in one doc
+            server[databases.botstate][DATABASES.BOTSTATE] = {}
+        self.userDB = server[databases.users]
+        self.archiveDB = server[databases.usersArchive]
+        self.botstateDB = server[databases.botstate]
+        self.ensureUserViews()
+
+    def ensureUserViews(self) -> None:
+        """ Creates/updates views of the users DB. """
+        designDoc = self.userDB.get(USERVIEWS.DESIGN_DOC)
+        if designDoc is None:
+            self.userDB[USERVIEWS.DESIGN_DOC] = USERVIEWS.DEFINITION
+        elif designDoc.get('views') != USERVIEWS.DEFINITION['views']:
+            designDoc['views'] = USERVIEWS.DEFINITION['views']
+            self.userDB.save(designDoc)
+
+    def getUserIDs(self) -> List[str]:
+        # Skip design docs
+        return [docID for docID in self.userDB if not docID.startswith('_design/')]
+
+    def hasUser(self, userID: str) -> bool:
+        return userID in self.userDB
+
+    def getUser(self, userID: str) -> Union[dict, None]:
+        return self.userDB.get(userID)
+
+    def getUsers(self) -> Iterator[Tuple[str, dict]]:
+        # One request for all docs instead of one per user
+        for row in self.userDB.view('_all_docs', include_docs=True):
+            if not row.id.startswith('_design/'):
+                yield row.id, row.doc
+
+    def getAdmins(self) -> Dict[str, dict]:
+        return {userID: userDoc for userID, userDoc in self.getUsers() if userDoc.get(USERDB.IS_ADMIN)}
+
+    def getApprovedUsers(self) -> Dict[str, dict]:
+        return {userID: userDoc for userID, userDoc in self.getUsers() if userDoc.get(USERDB.IS_ADMIN) or userDoc.get(USERDB.IS_APPROVED, False)}
+
+    def createUser(self, userID: str, userDoc: dict) -> None:
+        userDoc = dict(userDoc)
+        existingDoc = self.userDB.get(userID)
+        if existingDoc is not None:
+            userDoc['_rev'] = existingDoc['_rev']
+        self.userDB[userID] = userDoc
+
+    def saveUser(self, userDoc: dict) -> None:
+        self.userDB.save(userDoc)
+
+    def deleteUser(self, userID: str) -> bool:
+        if userID not in self.userDB:
+            return False
+        del self.userDB[userID]
+        return True
+
+    def getUserList(self, limit: int, cursor: Union[list, None] = None, skip: int = 0) -> List[UserRow]:
+        viewOptions = {'limit': limit}
+        if cursor is not None:
+            viewOptions['startkey'] = cursor[0]
+            viewOptions['startkey_docid'] = cursor[1]
+        elif skip > 0:
+            viewOptions['skip'] = skip
+        return [UserRow(row.id, row.key, row.value) for row in self.userDB.view(USERVIEWS.BY_ROLE_AND_NAME, **viewOptions)]
+
+    def searchUsers(self, searchTerm: str, limit: int) -> List[UserRow]:
+        rows = self.userDB.view(USERVIEWS.BY_NAME, startkey=searchTerm, endkey=searchTerm + '\ufff0', limit=limit)
+        return [UserRow(row.id, row.key, row.value) for row in rows]
+
+    def archiveUser(self, userID: str, archivedUserDoc: dict) -> None:
+        archivedUserDoc = withoutMetadata(archivedUserDoc)
+        existingDoc = self.archiveDB.get(userID)
+        if existingDoc is not None:
+            archivedUserDoc['_rev'] = existingDoc['_rev']
+        self.archiveDB[userID] = archivedUserDoc
+        self.deleteUser(userID)
+
+    def getArchivedUsers(self) -> Iterator[Tuple[str, dict]]:
+        for row in self.archiveDB.view('_all_docs', include_docs=True):
+            yield row.id, row.doc
+
+    def getBotDoc(self) -> dict:
+        return self.botstateDB[DATABASES.BOTSTATE]
+
+    def saveBotDoc(self, botDoc: dict) -> None:
+        if '_rev' not in botDoc:
+            # E.g. doc from another storage
+            botDoc = dict(botDoc)
+            botDoc['_id'] = DATABASES.BOTSTATE
+            existingDoc = self.botstateDB.get(DATABASES.BOTSTATE)
+            if existingDoc is not None:
+                botDoc['_rev'] = existingDoc['_rev']
+        self.botstateDB.save(botDoc)
+
+    def compact(self) -> Tuple[int, int]:
+        # Compaction runs asynchronously in CouchDB -> Reclaimable size = file size - size of live data
+        dbSizes = self.userDB.info().get('sizes', {})
+        self.userDB.compact()
+        self.userDB.cleanup()
+        return dbSizes.get('file', 0), dbSizes.get('file', 0) - dbSizes.get('active', 0)
+
+
+class SQLiteStorage(Storage):
+    """ Stores everything in one local SQLite file -> No DB server needed and every access takes microseconds instead of an HTTP request.
+    Docs are stored as JSON. Fields needed for queries are additionally stored in indexed columns. """
+
+    # E.g. "database is locked" or disk errors
+    UNAVAILABLE_ERRORS = (sqlite3.OperationalError,)
+
+    def __init__(self, path: str):
+        self.path = path
+        # Used by handler threads and the main loop
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # Only has an effect for new files -> compact() can free pages without rewriting the whole file
+        self.db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, doc TEXT NOT NULL, is_admin INTEGER NOT NULL, is_approved INTEGER NOT NULL, '
+                            'role INTEGER NOT NULL, sort_name TEXT NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS users_is_admin ON users (is_admin)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS users_is_approved ON users (is_approved)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS users_role_and_name ON users (role, sort_name, user_id)')
+            # Lowercase username, first- and last name of every user for prefix search
+            self.db.execute('CREATE TABLE IF NOT EXISTS user_names (name TEXT NOT NULL, user_id TEXT NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS user_names_name ON user_names (name, user_id)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS user_names_user_id ON user_names (user_id)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS users_archive (user_id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS botstate (id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+
+    @staticmethod
+    def loadDoc(userID: str, docJson: str) -> dict:
+        doc = json.loads(docJson)
+        doc['_id'] = userID
+        return doc
+
+    def getUserIDs(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT user_id FROM users')]
+
+    def hasUser(self, userID: str) -> bool:
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM users WHERE user_id = ?', (userID,)).fetchone() is not None
+
+    def getUser(self, userID: str) -> Union[dict, None]:
+        with self.lock:
+            row = self.db.execute('SELECT doc FROM users WHERE user_id = ?', (userID,)).fetchone()
+        return self.loadDoc(userID, row[0]) if row is not None else None
+
+    def getUsers(self) -> Iterator[Tuple[str, dict]]:
+        with self.lock:
+            rows = self.db.execute('SELECT user_id, doc FROM users').fetchall()
+        for userID, docJson in rows:
+            yield userID, self.loadDoc(userID, docJson)
+
+    def queryUsers(self, where: str) -> Dict[str, dict]:
+        with self.lock:
+            rows = self.db.execute('SELECT user_id, doc FROM users WHERE ' + where).fetchall()
+        return {userID: self.loadDoc(userID, docJson) for userID, docJson in rows}
+
+    def getAdmins(self) -> Dict[str, dict]:
+        return self.queryUsers('is_admin = 1')
+
+    def getApprovedUsers(self) -> Dict[str, dict]:
+        return self.queryUsers('is_admin = 1 OR is_approved = 1')
+
+    def createUser(self, userID: str, userDoc: dict) -> None:
+        userDoc = dict(userDoc)
+        userDoc['_id'] = userID
+        self.saveUser(userDoc)
+
+    def saveUser(self, userDoc: dict) -> None:
+        userID = userDoc['_id']
+        names = {name.lower() for name in (userDoc.get(USERDB.USERNAME), userDoc.get(USERDB.FIRST_NAME), userDoc.get(USERDB.LAST_NAME)) if name}
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO users (user_id, doc, is_admin, is_approved, role, sort_name) VALUES (?, ?, ?, ?, ?, ?)',
+                            (userID, json.dumps(withoutMetadata(userDoc)), bool(userDoc.get(USERDB.IS_ADMIN)), bool(userDoc.get(USERDB.IS_APPROVED)),
+                             getUserRole(userDoc), getUserSortName(userDoc)))
+            self.db.execute('DELETE FROM user_names WHERE user_id = ?', (userID,))
+            self.db.executemany('INSERT INTO user_names (name, user_id) VALUES (?, ?)', [(name, userID) for name in names])
+
+    def deleteUser(self, userID: str) -> bool:
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM user_names WHERE user_id = ?', (userID,))
+            return self.db.execute('DELETE FROM users WHERE user_id = ?', (userID,)).rowcount > 0
+
+    def getUserList(self, limit: int, cursor: Union[list, None] = None, skip: int = 0) -> List[UserRow]:
+        with self.lock:
+            if cursor is not None:
+                rows = self.db.execute('SELECT user_id, doc, role, sort_name FROM users WHERE (role, sort_name, user_id) >= (?, ?, ?) ORDER BY role, sort_name, user_id LIMIT ?',
+                                       (cursor[0][0], cursor[0][1], cursor[1], limit)).fetchall()
+            else:
+                rows = self.db.execute('SELECT user_id, doc, role, sort_name FROM users ORDER BY role, sort_name, user_id LIMIT ? OFFSET ?', (limit, skip)).fetchall()
+        return [UserRow(userID, [role, sortName], getUserSummary(json.loads(docJson))) for userID, docJson, role, sortName in rows]
+
+    def searchUsers(self, searchTerm: str, limit: int) -> List[UserRow]:
+        with self.lock:
+            rows = self.db.execute('SELECT user_names.name, users.user_id, users.doc FROM user_names JOIN users ON users.user_id = user_names.user_id '
+                                   'WHERE user_names.name >= ? AND user_names.name < ? ORDER BY user_names.name, users.user_id LIMIT ?',
+                                   (searchTerm, searchTerm + '\ufff0', limit)).fetchall()
+        return [UserRow(userID, name, getUserSummary(json.loads(docJson))) for name, userID, docJson in rows]
+
+    def archiveUser(self, userID: str, archivedUserDoc: dict) -> None:
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO users_archive (user_id, doc) VALUES (?, ?)', (userID, json.dumps(withoutMetadata(archivedUserDoc))))
+            self.deleteUser(userID)
+
+    def getArchivedUsers(self) -> Iterator[Tuple[str, dict]]:
+        with self.lock:
+            rows = self.db.execute('SELECT user_id, doc FROM users_archive').fetchall()
+        for userID, docJson in rows:
+            yield userID, self.loadDoc(userID, docJson)
+
+    def getBotDoc(self) -> dict:
+        with self.lock:
+            row = self.db.execute('SELECT doc FROM botstate WHERE id = ?', (DATABASES.BOTSTATE,)).fetchone()
+        return self.loadDoc(DATABASES.BOTSTATE, row[0]) if row is not None else {'_id': DATABASES.BOTSTATE}
+
+    def saveBotDoc(self, botDoc: dict) -> None:
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO botstate (id, doc) VALUES (?, ?)', (DATABASES.BOTSTATE, json.dumps(withoutMetadata(botDoc))))
+
+    def compact(self) -> Tuple[int, int]:
+        with self.lock:
+            pageSize = self.db.execute('PRAGMA page_size').fetchone()[0]
+            fileBytes = self.db.execute('PRAGMA page_count').fetchone()[0] * pageSize
+            freePagesBefore = self.db.execute('PRAGMA freelist_count').fetchone()[0]
+            # Frees one page per step and returns no rows -> execute() would only step once. executescript() runs it to completion.
+            self.db.executescript('PRAGMA incremental_vacuum')
+            freePagesAfter = self.db.execute('PRAGMA freelist_count').fetchone()[0]
+            self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        return fileBytes, (freePagesBefore - freePagesAfter) * pageSize
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,71 @@
+import argparse
+import sys
+from typing import List
+
+from Helper import BotConfig, loadBotConfigs
+from Storage import STORAGE_BACKENDS, Storage, CouchDBStorage, DatabaseNames, SQLiteStorage, withoutMetadata
+
+
+class MigrationResult:
+
+    def __init__(self):
+        self.numberOfUsers = 0
+        self.numberOfArchivedUsers = 0
+
+    def getSummary(self) -> str:
+        return "Users: " + str(self.numberOfUsers) + " | Archived users: " + str(self.numberOfArchivedUsers) + " | Bot state: 1"
+
+
+def openStorage(backend: str, config: BotConfig) -> Storage:
+    if backend == STORAGE_BACKENDS.SQLITE:
+        return SQLiteStorage(config.sqlite_file)
+    if config.db_url is None:
+        raise ValueError("db_url is required to use CouchDB")
+    import couchdb
+    return CouchDBStorage(couchdb.Server(config.db_url), DatabaseNames(config.db_prefix))
+
+
+def migrate(source: Storage, target: Storage) -> MigrationResult:
+    """ Copies users, archived users and the bot state. Existing docs with the same IDs in target get replaced. """
+    result = MigrationResult()
+    for userID, userDoc in source.getUsers():
+        target.createUser(userID, withoutMetadata(userDoc))
+        result.numberOfUsers += 1
+    for userID, archivedUserDoc in source.getArchivedUsers():
+        target.archiveUser(userID, archivedUserDoc)
+        result.numberOfArchivedUsers += 1
+    target.saveBotDoc(withoutMetadata(source.getBotDoc()))
+    return result
+
+
+def main(args: List[str] = None) -> int:
+    backends = [STORAGE_BACKENDS.COUCHDB, STORAGE_BACKENDS.SQLITE]
+    parser = argparse.ArgumentParser(description="Copies all users and the bot state from one storage backend to another. Set storage_backend in the config afterwards.")
+    parser.add_argument('--from', dest='source', choices=backends, required=True)
+    parser.add_argument('--to', dest='target', choices=backends, required=True)
+    parser.add_argument('--config', default='config.json', help="Config with db_url, sqlite_file and db_prefix of the bots")
+    parser.add_argument('--bot', default=None, help="db_prefix of the bot to migrate. Default: All bots")
+    parser.add_argument('--force', action='store_true', help="Migrate even if the target already contains users")
+    options = parser.parse_args(args)
+    if options.source == options.target:
+        parser.error("--from and --to must be different")
+    configs = [config for config in loadBotConfigs(options.config) if options.bot is None or config.db_prefix == options.bot]
+    if len(configs) == 0:
+        parser.error("No bot with db_prefix " + options.bot)
+    for config in configs:
+        source = openStorage(options.source, config)
+        target = openStorage(options.target, config)
+        try:
+            if not options.force and len(target.getUserIDs()) > 0:
+                print(config.bot_name + ": Target already contains users -> Skipping. Use --force to migrate anyway.")
+                continue
+            result = migrate(source, target)
+            print(config.bot_name + ": " + result.getSummary())
+        finally:
+            source.close()
+            target.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
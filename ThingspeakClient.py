@@ -0,0 +1,335 @@
+import codecs
+import logging
+import re
+import socket
+import threading
+from datetime import datetime
+from json import loads
+from typing import Union, Iterator, Callable, List, Tuple
+
+
+class ThingspeakConnection:
+    """ Persistent HTTP/2 connection to Thingspeak. Can be shared by the clients of several channels e.g. if multiple bots are served by one process.
+    Users must hold the lock for the whole request. """
+
+    HOST = 'api.thingspeak.com'
+    PORT = 443
+
+    def __init__(self, timeoutSeconds: float = 30):
+        self.timeoutSeconds = timeoutSeconds
+        self.connection = None
+        # Socket of the current connection. Published as soon as it exists so abort() can also interrupt connection setup
+        self.socket = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.connection is None:
+            # hyper is only needed once we actually talk to Thingspeak
+            from hyper import HTTP20Connection
+            from hyper.common.bufsocket import BufferedSocket
+            from hyper.tls import H2_NPN_PROTOCOLS, init_context
+            connection = HTTP20Connection(self.HOST, self.PORT)
+            # hyper's connect() has no timeout -> Connect ourselves and hand the socket over
+            sock = self.openSocket()
+            try:
+                # The TLS handshake and all later reads inherit the timeout of the socket
+                sock = init_context().wrap_socket(sock, server_hostname=self.HOST, do_handshake_on_connect=False)
+                self.socket = sock
+                sock.do_handshake()
+                protocol = sock.selected_alpn_protocol()
+                if protocol not in H2_NPN_PROTOCOLS:
+                    raise ConnectionError("Thingspeak doesn't support HTTP/2: " + str(protocol))
+                connection._sock = BufferedSocket(sock, connection.network_buffer_size)
+                connection._send_preamble()
+            except Exception:
+                sock.close()
+                self.socket = None
+                raise
+            self.connection = connection
+        return self.connection
+
+    def openSocket(self) -> socket.socket:
+        """ Like socket.create_connection() but the socket is published before connecting so abort() can interrupt a hanging connect. """
+        error = None
+        for family, socketType, protocol, _, address in socket.getaddrinfo(self.HOST, self.PORT, type=socket.SOCK_STREAM):
+            sock = socket.socket(family, socketType, protocol)
+            sock.settimeout(self.timeoutSeconds)
+            self.socket = sock
+            try:
+                sock.connect(address)
+                return sock
+            except OSError as e:
+                error = e
+                sock.close()
+                self.socket = None
+        raise error if error is not None else OSError("No address found for " + self.HOST)
+
+    def abort(self) -> None:
+        """ Can be called from any thread: Makes a request or connection setup which is currently stuck fail right away. The failing request resets the connection. """
+        sock = self.socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def reset(self) -> None:
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+        self.socket = None
+
+
+class ThingspeakClient:
+    """ Reads data of one Thingspeak channel via a persistent HTTP/2 connection.
+    API docs: https://community.thingspeak.com/documentation%20.../api/ """
+
+    def __init__(self, channelID: int, readAPIKey: str, connection: ThingspeakConnection = None):
+        self.channelID = channelID
+        self.readAPIKey = readAPIKey
+        if connection is None:
+            connection = ThingspeakConnection()
+        self.connection = connection
+        self.lock = connection.lock
+
+    def getConnection(self):
+        return self.connection.get()
+
+    def resetConnection(self) -> None:
+        self.connection.reset()
+
+    def getURL(self, path: str, extraParams: str = '') -> str:
+        return '/channels/' + str(self.channelID) + path + '?key=' + self.readAPIKey + '&offset=1' + extraParams
+
+    def getJson(self, path: str, extraParams: str = ''):
+        with self.lock:
+            try:
+                conn = self.getConnection()
+                conn.request("GET", self.getURL(path, extraParams))
+                return loads(conn.get_response().read())
+            except Exception:
+                # Connection might be broken -> Use a new one next time
+                self.resetConnection()
+                raise
+
+    def streamFeed(self, minEntryID: Union[int, None] = None, numberOfEntries: Union[int, None] = None, onChannelInfo: Callable[[dict], None] = None) -> Iterator[dict]:
+        """ Yields feed entries. The response is parsed while it's being downloaded so we never hold the full document in memory, only the entries we need.
+        The shared connection is released before the first entry is yielded -> Slow consumers don't block the requests of other channels.
+        :param minEntryID: Entries with entry_id <= minEntryID are skipped without being parsed
+        :param numberOfEntries: Number of entries to request. Thingspeak returns the last 100 entries by default and max. 8000.
+        :param onChannelInfo: Gets called with the channel info before the first entry is yielded
+        """
+        entries, channelInfo = self.downloadFeed(minEntryID, numberOfEntries)
+        if channelInfo is not None and onChannelInfo is not None:
+            onChannelInfo(channelInfo)
+        yield from entries
+
+    def downloadFeed(self, minEntryID: Union[int, None], numberOfEntries: Union[int, None]) -> Tuple[List[dict], Union[dict, None]]:
+        """ Returns (feed entries, channel info) """
+        channelInfos = []
+        parser = FeedStreamParser(minEntryID=minEntryID, onChannelInfo=channelInfos.append)
+        extraParams = ''
+        if numberOfEntries is not None:
+            extraParams = '&results=' + str(numberOfEntries)
+        entries = []
+        with self.lock:
+            try:
+                conn = self.getConnection()
+                conn.request("GET", self.getURL('/feed.json', extraParams))
+                for chunk in conn.get_response().read_chunked():
+                    entries += parser.feed(chunk)
+                if not parser.isDone():
+                    raise ValueError("Incomplete feed response")
+            except Exception:
+                self.resetConnection()
+                raise
+        return entries, channelInfos[0] if len(channelInfos) > 0 else None
+
+    def getLastEntryID(self) -> Union[int, None]:
+        """ Cheap check for new data: Only returns the ID of the newest entry. Returns None if the channel has no entries. """
+        lastEntry = self.getJson('/feeds/last.json')
+        if not isinstance(lastEntry, dict) or 'entry_id' not in lastEntry:
+            # Thingspeak returns "-1" for empty channels
+            logging.info("Failed to obtain last entry of channel: " + str(lastEntry))
+            return None
+        return lastEntry['entry_id']
+
+    def getFieldHistory(self, fieldID: int, seconds: int) -> List[Tuple[float, float]]:
+        """ Returns (timestamp, value) of all valid values of one field within the last X seconds (max. 8000 entries) sorted by time. """
+        response = self.getJson('/fields/' + str(fieldID) + '.json', '&minutes=' + str(max(1, seconds // 60)) + '&results=8000')
+        fieldKey = 'field' + str(fieldID)
+        points = []
+        for entry in response.get('feeds', []):
+            try:
+                value = float(entry.get(fieldKey))
+                timestamp = datetime.strptime(entry['created_at'], '%Y-%m-%dT%H:%M:%S%z').timestamp()
+            except (TypeError, ValueError, KeyError):
+                # Empty or invalid value e.g. "nan"
+                continue
+            if value == value:
+                points.append((timestamp, value))
+        return points
+
+
+class FeedStreamParser:
+    """ Incremental parser for the feed document of Thingspeak: {"channel": {...}, "feeds": [{...}, {...}]}
+    Works on chunks as they arrive and only creates dicts for feed entries we actually need. """
+
+    STRUCTURE = re.compile(r'["{}\[\]]')
+    STRING_SPECIAL = re.compile(r'["\\]')
+    LITERAL_END = re.compile(r'[,}\]\s]')
+    ENTRY_ID = re.compile(r'"entry_id"\s*:\s*(\d+)')
+    WHITESPACE = ' \t\r\n'
+
+    # States
+    START = 0
+    KEY = 1
+    COLON = 2
+    VALUE = 3
+    FEEDS = 4
+    DONE = 5
+
+    def __init__(self, minEntryID: Union[int, None] = None, onChannelInfo: Callable[[dict], None] = None):
+        self.minEntryID = minEntryID
+        self.onChannelInfo = onChannelInfo
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.state = self.START
+        self.key = None
+        # Scan state of the value which is currently being read. valueStart = None -> No value in progress
+        self.valueStart = None
+        self.scanPos = 0
+        self.depth = 0
+        self.inString = False
+
+    def isDone(self) -> bool:
+        return self.state == self.DONE
+
+    def feed(self, chunk: bytes) -> List[dict]:
+        """ Adds the next chunk and returns all feed entries which have been completed by it. """
+        self.buffer += self.decoder.decode(chunk)
+        entries = []
+        buf = self.buffer
+        while self.state != self.DONE:
+            if self.valueStart is None:
+                # Skip whitespace and separators until the next token
+                while self.pos < len(buf) and (buf[self.pos] in self.WHITESPACE or (buf[self.pos] == ',' and self.state in (self.KEY, self.FEEDS))):
+                    self.pos += 1
+                if self.pos >= len(buf):
+                    break
+                char = buf[self.pos]
+                if self.state == self.START:
+                    if char != '{':
+                        raise ValueError("Unexpected feed response: " + buf[:100])
+                    self.pos += 1
+                    self.state = self.KEY
+                    continue
+                elif self.state == self.COLON:
+                    if char != ':':
+                        raise ValueError("Expected ':' in feed response")
+                    self.pos += 1
+                    self.state = self.VALUE
+                    continue
+                elif self.state == self.KEY and char == '}':
+                    self.pos += 1
+                    self.state = self.DONE
+                    break
+                elif self.state == self.FEEDS and char == ']':
+                    self.pos += 1
+                    self.state = self.KEY
+                    continue
+                elif self.state == self.VALUE and self.key == 'feeds' and char == '[':
+                    self.pos += 1
+                    self.state = self.FEEDS
+                    continue
+                self.beginValue()
+            valueEnd = self.scanValue()
+            if valueEnd is None:
+                # Need more data
+                break
+            valueStart = self.valueStart
+            self.valueStart = None
+            self.pos = valueEnd
+            if self.state == self.KEY:
+                self.key = loads(buf[valueStart:valueEnd])
+                self.state = self.COLON
+            elif self.state == self.VALUE:
+                value = loads(buf[valueStart:valueEnd])
+                if self.key == 'channel' and self.onChannelInfo is not None:
+                    self.onChannelInfo(value)
+                self.state = self.KEY
+            else:
+                if self.minEntryID is not None:
+                    match = self.ENTRY_ID.search(buf, valueStart, valueEnd)
+                    if match is not None and int(match.group(1)) <= self.minEntryID:
+                        continue
+                entries.append(loads(buf[valueStart:valueEnd]))
+        # Drop everything we've already consumed
+        self.buffer = buf[self.pos:]
+        if self.valueStart is not None:
+            self.valueStart -= self.pos
+            self.scanPos -= self.pos
+        self.pos = 0
+        return entries
+
+    def beginValue(self) -> None:
+        self.valueStart = self.pos
+        self.depth = 0
+        char = self.buffer[self.pos]
+        if char == '"':
+            self.inString = True
+            self.scanPos = self.pos + 1
+        else:
+            self.inString = False
+            self.scanPos = self.pos
+
+    def scanValue(self) -> Union[int, None]:
+        """ Continues scanning the current value. Returns its end position or None if the value isn't complete yet. """
+        buf = self.buffer
+        firstChar = buf[self.valueStart]
+        if firstChar not in '{["':
+            # Number or true/false/null
+            match = self.LITERAL_END.search(buf, self.scanPos)
+            if match is None:
+                self.scanPos = len(buf)
+                return None
+            return match.start()
+        pos = self.scanPos
+        while True:
+            if self.inString:
+                match = self.STRING_SPECIAL.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                if match.group() == '\\':
+                    if match.end() >= len(buf):
+                        # Escaped char hasn't arrived yet
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self.inString = False
+                pos = match.end()
+                if firstChar == '"':
+                    return pos
+            else:
+                match = self.STRUCTURE.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                char = match.group()
+                pos = match.end()
+                if char == '"':
+                    self.inString = True
+                elif char in '{[':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return pos
+        self.scanPos = pos
+        return None
@@ -0,0 +1,82 @@
+import heapq
+import itertools
+import logging
+import threading
+from typing import Callable, Union
+
+from Clock import Clock, SYSTEM_CLOCK
+
+
+class TimerScheduler:
+    """ Runs callbacks at given deadlines e.g. when a snooze expires. Timers are kept in a heap so checking for due timers is O(1) and nothing has to be compared on every loop run.
+    Every timer has a key. Scheduling a key again replaces its previous timer. Deadlines are wall clock timestamps of the clock. """
+
+    def __init__(self, clock: Clock = SYSTEM_CLOCK):
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (deadline, sequence number, key)
+        self.heap = []
+        # key -> (deadline, sequence number, callback) of the currently valid timer
+        self.timers = {}
+        self.sequence = itertools.count()
+        # Wakes up the main loop when a timer has been added which is due earlier than expected
+        self.wakeUpEvent = threading.Event()
+
+    def schedule(self, key: str, deadline: float, callback: Callable[[], None]) -> None:
+        with self.lock:
+            sequenceNumber = next(self.sequence)
+            self.timers[key] = (deadline, sequenceNumber, callback)
+            heapq.heappush(self.heap, (deadline, sequenceNumber, key))
+        self.wakeUpEvent.set()
+
+    def cancel(self, key: str) -> None:
+        with self.lock:
+            # Heap entry stays and will be skipped once it is due
+            self.timers.pop(key, None)
+
+    def getDeadline(self, key: str) -> Union[float, None]:
+        with self.lock:
+            timer = self.timers.get(key)
+            return timer[0] if timer is not None else None
+
+    def popDueCallback(self) -> Union[Callable[[], None], None]:
+        now = self.clock.now()
+        with self.lock:
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                deadline, sequenceNumber, key = heapq.heappop(self.heap)
+                timer = self.timers.get(key)
+                if timer is None or timer[1] != sequenceNumber:
+                    # Cancelled or replaced
+                    continue
+                del self.timers[key]
+                return timer[2]
+        return None
+
+    def runDue(self) -> None:
+        """ Runs all callbacks whose deadline has been reached. """
+        while True:
+            callback = self.popDueCallback()
+            if callback is None:
+                return
+            try:
+                callback()
+            except:
+                logging.warning("Timer callback failed", exc_info=True)
+
+    def getSecondsUntilNextTimer(self) -> Union[float, None]:
+        with self.lock:
+            while len(self.heap) > 0:
+                deadline, sequenceNumber, key = self.heap[0]
+                timer = self.timers.get(key)
+                if timer is not None and timer[1] == sequenceNumber:
+                    return max(0.0, deadline - self.clock.now())
+                heapq.heappop(self.heap)
+        return None
+
+    def wait(self, maxSeconds: float) -> None:
+        """ Sleeps until the next timer is due, a new timer has been scheduled or maxSeconds have passed. """
+        seconds = self.getSecondsUntilNextTimer()
+        if seconds is None or seconds > maxSeconds:
+            seconds = maxSeconds
+        self.clock.waitForEvent(self.wakeUpEvent, seconds)
+        self.wakeUpEvent.clear()
@@ -0,0 +1,204 @@
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Union
+
+from Clock import Clock, SYSTEM_CLOCK
+from Helper import SYMBOLS
+from LogSetup import logFields
+from ThingspeakClient import ThingspeakConnection
+
+
+class PROBLEMS:
+    """ Keys of problems the watchdog detects. Per bot problems get the db_prefix of the bot appended. """
+    LOOP_STALLED = 'loop_stalled'
+    LANE_STALLED = 'lane_stalled_'
+    POLLS_FAILING = 'polls_failing_'
+    DISPATCHER_STALLED = 'dispatcher_stalled_'
+    TELEGRAM_THREADS_DEAD = 'telegram_threads_dead_'
+
+
+def sendTelegramMessageDirectly(botToken: str, chatID: Union[int, str], text: str, timeoutSeconds: float = 10) -> None:
+    """ Sends a message via its own HTTPS request without python-telegram-bot -> Works even if the dispatcher or the connection pool of the bot are stuck. """
+    data = urllib.parse.urlencode({'chat_id': chatID, 'text': text, 'parse_mode': 'HTML'}).encode('utf-8')
+    with urllib.request.urlopen('https://api.telegram.org/bot' + botToken + '/sendMessage', data=data, timeout=timeoutSeconds) as response:
+        response.read()
+
+
+class Watchdog:
+    """ Checks from its own thread that alarms are still being processed: Lag of the main loop, time since the last successful poll and liveness of the Telegram threads and handler lanes.
+    Admins get a message via a separate path when a problem occurs and once it is solved. Stuck requests and handler lanes get restarted.
+    Hanging or dead Telegram threads can't be restarted within the process -> Optionally exits so a supervisor e.g. systemd restarts the bot. """
+
+    def __init__(self, thingspeakConnection: ThingspeakConnection, handlerLanes: dict, stallSeconds: float = 300, maxPollAgeSeconds: float = 900,
+                 exitAfterSeconds: Union[float, None] = None, checkIntervalSeconds: float = 15, clock: Clock = SYSTEM_CLOCK):
+        self.thingspeakConnection = thingspeakConnection
+        self.handlerLanes = handlerLanes
+        self.stallSeconds = stallSeconds
+        self.maxPollAgeSeconds = maxPollAgeSeconds
+        self.exitAfterSeconds = exitAfterSeconds
+        self.checkIntervalSeconds = checkIntervalSeconds
+        # Admin IDs are refreshed at most this often and only while everything works -> Alerts never need the DB
+        self.adminRefreshIntervalSeconds = 600
+        self.clock = clock
+        self.bots = []
+        # Monotonic time at which the main loop should be awake again
+        self.expectedWakeUpMonotonic = self.clock.monotonic()
+        # Lane name -> (probe future, monotonic time it has been submitted)
+        self.laneProbes = {}
+        # db_prefix -> Monotonic time since which updates are waiting for the dispatcher
+        self.updatesWaitingSince = {}
+        # Problem key -> Monotonic time it has been detected
+        self.activeProblems = {}
+        # db_prefix -> IDs of all admins of the bot
+        self.adminIDs: Dict[str, List[str]] = {}
+        self.lastAdminRefreshMonotonic = None
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def addBot(self, bot) -> None:
+        """ :param bot: ABBot """
+        self.bots.append(bot)
+        self.refreshAdminIDs(bot)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name='Watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopEvent.set()
+
+    def run(self) -> None:
+        while not self.clock.waitForEvent(self.stopEvent, self.checkIntervalSeconds):
+            try:
+                self.check()
+            except:
+                logging.warning("Watchdog check failed", exc_info=True)
+
+    def onLoopWakeUp(self) -> float:
+        """ Called by the main loop after sleeping. Returns the lag = seconds the loop is running later than planned. """
+        return max(0.0, self.clock.monotonic() - self.expectedWakeUpMonotonic)
+
+    def onLoopSleep(self, seconds: float) -> None:
+        """ Called by the main loop right before it sleeps for max. the given number of seconds. """
+        self.expectedWakeUpMonotonic = self.clock.monotonic() + seconds
+
+    def check(self) -> None:
+        self.checkMainLoop()
+        self.checkHandlerLanes()
+        for bot in self.bots:
+            self.checkPolls(bot)
+            self.checkTelegramThreads(bot)
+        if len(self.activeProblems) == 0 and (self.lastAdminRefreshMonotonic is None or self.clock.monotonic() - self.lastAdminRefreshMonotonic >= self.adminRefreshIntervalSeconds):
+            for bot in self.bots:
+                self.refreshAdminIDs(bot)
+        self.exitIfStuckForTooLong()
+
+    def checkMainLoop(self) -> None:
+        stalledSeconds = self.clock.monotonic() - self.expectedWakeUpMonotonic
+        if stalledSeconds <= self.stallSeconds:
+            self.onSolved(PROBLEMS.LOOP_STALLED, self.bots, "Die Hauptschleife läuft wieder.")
+            return
+        # A stuck request to Thingspeak is the most likely cause -> Make it fail
+        self.thingspeakConnection.abort()
+        self.onProblem(PROBLEMS.LOOP_STALLED, self.bots, "Die Hauptschleife hängt seit " + formatMinutes(stalledSeconds) + ". Es werden gerade keine Alarme verarbeitet!")
+
+    def checkHandlerLanes(self) -> None:
+        for laneName, lane in self.handlerLanes.items():
+            problemKey = PROBLEMS.LANE_STALLED + laneName
+            probe = self.laneProbes.get(laneName)
+            if probe is None or probe[0].done():
+                self.onSolved(problemKey, self.bots, "Die Handler-Lane " + laneName + " arbeitet wieder.")
+                self.laneProbes[laneName] = (lane.probe(), self.clock.monotonic())
+                continue
+            stalledSeconds = self.clock.monotonic() - probe[1]
+            if stalledSeconds > self.stallSeconds:
+                self.onProblem(problemKey, self.bots, "Alle Worker der Handler-Lane " + laneName + " hängen seit " + formatMinutes(stalledSeconds) + " -> Lane wurde neu gestartet.")
+                lane.restart()
+                del self.laneProbes[laneName]
+
+    def checkPolls(self, bot) -> None:
+        problemKey = PROBLEMS.POLLS_FAILING + bot.cfg.db_prefix
+        secondsSinceLastPoll = self.clock.monotonic() - bot.lastSuccessfulPollMonotonic
+        if secondsSinceLastPoll <= self.maxPollAgeSeconds:
+            self.onSolved(problemKey, [bot], "Thingspeak wird wieder erfolgreich abgefragt.")
+            return
+        if self.onProblem(problemKey, [bot], "Seit " + formatMinutes(secondsSinceLastPoll) + " keine erfolgreiche Abfrage von Thingspeak. Alarme kommen evtl. nicht an!"):
+            self.thingspeakConnection.abort()
+
+    def checkTelegramThreads(self, bot) -> None:
+        updater = bot.updater
+        if not updater.running:
+            # Not started yet or stopped on purpose
+            return
+        threadPrefix = 'Bot:' + str(updater.bot.id) + ':'
+        aliveThreads = {thread.name for thread in threading.enumerate() if thread.is_alive()}
+        deadThreads = [name for name in ('dispatcher', 'updater') if threadPrefix + name not in aliveThreads]
+        problemKey = PROBLEMS.TELEGRAM_THREADS_DEAD + bot.cfg.db_prefix
+        if len(deadThreads) > 0:
+            self.onProblem(problemKey, [bot], "Telegram Threads beendet: " + ', '.join(deadThreads) + ". Der Bot reagiert nicht mehr auf Eingaben!")
+        else:
+            self.onSolved(problemKey, [bot], "Telegram Threads laufen wieder.")
+        # Updates are waiting but the dispatcher hasn't started a new one for a long time -> A handler outside of the lanes is stuck
+        now = self.clock.monotonic()
+        problemKey = PROBLEMS.DISPATCHER_STALLED + bot.cfg.db_prefix
+        if updater.dispatcher.update_queue.qsize() == 0:
+            self.updatesWaitingSince.pop(bot.cfg.db_prefix, None)
+            self.onSolved(problemKey, [bot], "Der Bot verarbeitet wieder Eingaben.")
+            return
+        waitingSince = self.updatesWaitingSince.setdefault(bot.cfg.db_prefix, now)
+        stalledSeconds = now - max(waitingSince, bot.lastUpdateStartedMonotonic)
+        if stalledSeconds > self.stallSeconds:
+            self.onProblem(problemKey, [bot], "Der Bot hat seit " + formatMinutes(stalledSeconds) + " keine Eingaben mehr verarbeitet.")
+        else:
+            self.onSolved(problemKey, [bot], "Der Bot verarbeitet wieder Eingaben.")
+
+    def exitIfStuckForTooLong(self) -> None:
+        if self.exitAfterSeconds is None:
+            return
+        now = self.clock.monotonic()
+        for problemKey, detectedMonotonic in self.activeProblems.items():
+            if problemKey.startswith((PROBLEMS.LOOP_STALLED, PROBLEMS.DISPATCHER_STALLED, PROBLEMS.TELEGRAM_THREADS_DEAD)) and now - detectedMonotonic >= self.exitAfterSeconds:
+                logging.critical("Watchdog: Problem " + problemKey + " persists for " + str(int(now - detectedMonotonic)) + "s -> Exiting so the bot gets restarted")
+                # Give the log thread a moment to write everything
+                time.sleep(1)
+                os._exit(1)
+
+    def onProblem(self, problemKey: str, bots: list, text: str) -> bool:
+        """ Alerts admins once per problem. Returns True if the problem is new. """
+        if problemKey in self.activeProblems:
+            return False
+        self.activeProblems[problemKey] = self.clock.monotonic()
+        logging.warning("Watchdog: " + text, extra=logFields(problem=problemKey))
+        self.alertAdmins(bots, SYMBOLS.WARNING + "<b>Watchdog</b>\n" + text)
+        return True
+
+    def onSolved(self, problemKey: str, bots: list, text: str) -> None:
+        if self.activeProblems.pop(problemKey, None) is None:
+            return
+        logging.info("Watchdog: " + text, extra=logFields(problem=problemKey))
+        self.alertAdmins(bots, SYMBOLS.CONFIRM + "<b>Watchdog</b>\n" + text)
+
+    def alertAdmins(self, bots: list, text: str) -> None:
+        for bot in bots:
+            for adminID in self.adminIDs.get(bot.cfg.db_prefix, []):
+                try:
+                    sendTelegramMessageDirectly(bot.cfg.bot_token, adminID, text)
+                except:
+                    logging.warning("Watchdog failed to alert admin " + adminID, exc_info=True)
+
+    def refreshAdminIDs(self, bot) -> None:
+        try:
+            self.adminIDs[bot.cfg.db_prefix] = list(bot.getAdmins().keys())
+            self.lastAdminRefreshMonotonic = self.clock.monotonic()
+        except:
+            # Keep the last known admins
+            logging.warning("Watchdog failed to refresh admins", exc_info=True)
+
+
+def formatMinutes(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    return str(minutes) + (" Minute" if minutes == 1 else " Minuten")
@@ -0,0 +1,34 @@
+import random
+
+import pytest
+
+from AnomalyDetector import AnomalyConfig, AnomalyDetector
+
+
+def createValues(seed: int, count: int, base: float = 20, std: float = 0.5, spike: float = 25) -> list:
+    rng = random.Random(seed)
+    values = [base + rng.gauss(0, std) for _ in range(count)]
+    # Some spikes which must raise alarms
+    for index in range(600, count, 700):
+        values[index] += spike
+    return values
+
+
+# Temperature in °C and illuminance in lux with glitches of 1e6
+@pytest.mark.parametrize('magnitude', [(20, 0.5, 25), (1e5, 50, 1e6)])
+@pytest.mark.parametrize('alpha', [0.01, 0.5, 0.99])
+def test_vectorizedPathMatchesScalarPath(alpha, magnitude):
+    pytest.importorskip('numpy')
+    cfg = AnomalyConfig(alpha=alpha, warmupSamples=20)
+    values = createValues(1, 3000, *magnitude)
+    scalar = AnomalyDetector(cfg, 'Temperatur')
+    scalarAlarms = [(index, alarm) for index, value in enumerate(values) for alarm in [scalar.onSample(value)] if alarm is not None]
+    vectorized = AnomalyDetector(cfg, 'Temperatur')
+    # Split into two batches -> Second batch continues from existing state
+    vectorizedAlarms = vectorized.onSamples(values[:1000]) + [(1000 + index, alarm) for index, alarm in vectorized.onSamples(values[1000:])]
+    assert len(scalarAlarms) > 0
+    assert [index for index, alarm in vectorizedAlarms] == [index for index, alarm in scalarAlarms]
+    assert vectorized.mean == pytest.approx(scalar.mean, rel=1e-9)
+    assert vectorized.variance == pytest.approx(scalar.variance, rel=1e-6)
+    assert vectorized.numberOfSamples == scalar.numberOfSamples
+    assert vectorized.triggered == scalar.triggered
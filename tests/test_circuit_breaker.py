@@ -0,0 +1,22 @@
+from Clock import VirtualClock
+from ResilientStorage import CircuitBreaker
+
+
+def test_opensAfterThresholdAndRecoversViaTrialRequest():
+    clock = VirtualClock()
+    breaker = CircuitBreaker(failureThreshold=2, openSeconds=30, clock=clock)
+    assert breaker.onFailure() is False
+    assert breaker.allowRequest()
+    assert breaker.onFailure() is True
+    assert not breaker.allowRequest()
+    clock.advance(30)
+    # Only one trial request at a time
+    assert breaker.allowRequest()
+    assert not breaker.allowRequest()
+    # Failed trial keeps it open for another period
+    assert breaker.onFailure() is False
+    assert not breaker.allowRequest()
+    clock.advance(30)
+    assert breaker.allowRequest()
+    assert breaker.onSuccess() is True
+    assert breaker.isClosed() and breaker.allowRequest()
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from ThingspeakClient import FeedStreamParser
+
+FEED = {'channel': {'id': 1, 'name': 'Alarmanlage {Haus}', 'last_entry_id': 5},
+        'feeds': [{'entry_id': entryID, 'created_at': '2021-05-01T10:00:0' + str(entryID) + 'Z', 'field1': str(entryID % 2), 'field2': 'Tür "auf" \\ zu ü'} for entryID in range(1, 6)]}
+
+
+def parseInChunks(document: bytes, chunkSize: int, minEntryID: int = None) -> tuple:
+    channelInfos = []
+    parser = FeedStreamParser(minEntryID=minEntryID, onChannelInfo=channelInfos.append)
+    entries = []
+    for index in range(0, len(document), chunkSize):
+        entries += parser.feed(document[index:index + chunkSize])
+    assert parser.isDone()
+    return channelInfos, entries
+
+
+@pytest.mark.parametrize('chunkSize', [1, 3, 7, 64, 100000])
+def test_chunkBoundariesDontMatter(chunkSize):
+    # Multi-byte characters get split by small chunks
+    document = json.dumps(FEED, ensure_ascii=False, indent=1).encode('utf-8')
+    channelInfos, entries = parseInChunks(document, chunkSize)
+    assert channelInfos == [FEED['channel']]
+    assert entries == FEED['feeds']
+
+
+def test_entriesUpToMinEntryIDAreSkipped():
+    channelInfos, entries = parseInChunks(json.dumps(FEED).encode('utf-8'), 10, minEntryID=3)
+    assert [entry['entry_id'] for entry in entries] == [4, 5]
+
+
+def test_unexpectedResponseRaises():
+    with pytest.raises(ValueError):
+        FeedStreamParser().feed(b'-1')
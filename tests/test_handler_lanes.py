@@ -0,0 +1,97 @@
+import threading
+from datetime import datetime
+from queue import Queue
+from types import SimpleNamespace
+
+import pytest
+from telegram import Bot, CallbackQuery, Chat, Message, Update, User
+from telegram.ext import CallbackQueryHandler, ConversationHandler, Dispatcher
+
+from Bot import ABBot
+from HandlerLanes import HandlerLane
+from Helper import BotException
+
+
+def createContext(errors: list) -> SimpleNamespace:
+    return SimpleNamespace(dispatcher=SimpleNamespace(dispatch_error=lambda update, error, promise=None: errors.append(error)))
+
+
+def test_fullLaneRejectsUpdatesAndReleasesSlots():
+    release = threading.Event()
+    lane = HandlerLane('test', workers=1, maxQueueSize=1)
+    callback = lane.wrap(lambda update, context: release.wait(5) and 'DONE')
+    context = createContext([])
+    promises = [callback(None, context), callback(None, context)]
+    with pytest.raises(BotException):
+        callback(None, context)
+    release.set()
+    assert [promise.result(5) for promise in promises] == ['DONE', 'DONE']
+    # Slots are free again
+    assert callback(None, context).result(5) == 'DONE'
+    lane.shutdown()
+
+
+def test_errorsAreRoutedToErrorHandler():
+    errors = []
+    lane = HandlerLane('test', workers=1, maxQueueSize=1)
+
+    def failingCallback(update, context):
+        raise ValueError('Kaputt')
+
+    lane.wrap(failingCallback)(None, createContext(errors))
+    # Waits for the callback and the error routing
+    lane.executor.shutdown(wait=True)
+    assert [str(error) for error in errors] == ['Kaputt']
+
+
+def test_restartUnblocksStuckLane():
+    release = threading.Event()
+    lane = HandlerLane('test', workers=1, maxQueueSize=0)
+    callback = lane.wrap(lambda update, context: release.wait(5))
+    context = createContext([])
+    callback(None, context)
+    assert not lane.probe().done()
+    with pytest.raises(BotException):
+        callback(None, context)
+    lane.restart()
+    assert lane.probe().result(5) is None
+    release.set()
+    lane.shutdown()
+
+
+class FakeTelegram:
+    """ Records answers to button presses instead of sending them """
+
+    def __init__(self):
+        self.answers = []
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self.answers.append(text)
+
+
+def createButtonUpdate(telegram: FakeTelegram, updateID: int, data: str) -> Update:
+    user = User(1, 'Test', False)
+    message = Message(updateID, datetime.now(), Chat(1, Chat.PRIVATE), from_user=user)
+    return Update(updateID, callback_query=CallbackQuery(str(updateID), user, 'chat', message=message, data=data, bot=telegram))
+
+
+def test_updatesWhilePromiseIsPendingGetAnswered():
+    release = threading.Event()
+    lane = HandlerLane('test', workers=1, maxQueueSize=1)
+    sentMessages = []
+    bot = SimpleNamespace(sendMessage=lambda **kwargs: sentMessages.append(kwargs))
+    bot.botBusy = lambda update, context: ABBot.botBusy(bot, update, context)
+    dispatcher = Dispatcher(Bot('123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi'), Queue())
+    dispatcher.add_handler(ConversationHandler(entry_points=[CallbackQueryHandler(lane.wrap(lambda update, context: release.wait(5) and 1), pattern='^MENU_ACP$')],
+                                               states={1: [], ConversationHandler.WAITING: ABBot.getWaitingHandlers(bot)}, fallbacks=[]))
+    telegram = FakeTelegram()
+    try:
+        dispatcher.process_update(createButtonUpdate(telegram, 1, 'MENU_ACP'))
+        dispatcher.process_update(createButtonUpdate(telegram, 2, 'MENU_MAIN'))
+        assert len(telegram.answers) == 1 and 'noch bearbeitet' in telegram.answers[0]
+        # Approvals are handled by another ConversationHandler
+        dispatcher.process_update(createButtonUpdate(telegram, 3, 'APPROVE_USER42'))
+        assert len(telegram.answers) == 1
+    finally:
+        release.set()
+        lane.executor.shutdown(wait=True)
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+from Bot import ABBot
+from Clock import VirtualClock
+from MessageEditCache import MessageEditCache
+
+CHAT_ID = '1'
+MESSAGE_ID = 7
+
+
+class FakeTelegram:
+    """ Records edits and scheduled jobs instead of sending them """
+
+    def __init__(self):
+        self.sentTexts = []
+        self.jobs = []
+
+    def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.sentTexts.append(text)
+
+    def run_once(self, callback, when, context):
+        self.jobs.append((callback, context))
+
+
+def createBot(clock: VirtualClock) -> SimpleNamespace:
+    telegram = FakeTelegram()
+    bot = SimpleNamespace(editCache=MessageEditCache(coalesceSeconds=1.0, clock=clock), updater=SimpleNamespace(bot=telegram, job_queue=telegram), telegram=telegram)
+    bot.editMessageCoalesced = lambda *args, **kwargs: ABBot.editMessageCoalesced(bot, *args, **kwargs)
+    bot.flushPendingEdit = lambda context: ABBot.flushPendingEdit(bot, context)
+    bot.editMessage = lambda *args: ABBot.editMessage(bot, *args)
+    return bot
+
+
+def runJobs(bot: SimpleNamespace) -> None:
+    jobs = bot.telegram.jobs
+    bot.telegram.jobs = []
+    for callback, context in jobs:
+        callback(SimpleNamespace(job=SimpleNamespace(context=context)))
+
+
+def test_burstEndingWithSentStateDropsPendingEdit():
+    clock = VirtualClock()
+    bot = createBot(clock)
+    bot.editMessageCoalesced(CHAT_ID, MESSAGE_ID, 'Y')
+    bot.editMessageCoalesced(CHAT_ID, MESSAGE_ID, 'X')
+    bot.editMessageCoalesced(CHAT_ID, MESSAGE_ID, 'Y')
+    clock.advance(2)
+    runJobs(bot)
+    assert bot.telegram.sentTexts == ['Y']
+
+
+def test_burstSendsOnlyLatestState():
+    clock = VirtualClock()
+    bot = createBot(clock)
+    for text in ('A', 'B', 'C', 'D'):
+        bot.editMessageCoalesced(CHAT_ID, MESSAGE_ID, text)
+    assert len(bot.telegram.jobs) == 1
+    clock.advance(2)
+    runJobs(bot)
+    assert bot.telegram.sentTexts == ['A', 'D']
+    # Same render again -> No request
+    clock.advance(2)
+    bot.editMessageCoalesced(CHAT_ID, MESSAGE_ID, 'D')
+    assert bot.telegram.sentTexts == ['A', 'D'] and bot.telegram.jobs == []
+
+
+def test_directEditSupersedesPendingEdit():
+    clock = VirtualClock()
+    bot = createBot(clock)
+    bot.editMessageCoalesced(CHAT_ID, MESSAGE_ID, 'A')
+    bot.editMessageCoalesced(CHAT_ID, MESSAGE_ID, 'B')
+    bot.editMessage(CHAT_ID, MESSAGE_ID, 'C')
+    clock.advance(2)
+    runJobs(bot)
+    assert bot.telegram.sentTexts == ['A', 'C']
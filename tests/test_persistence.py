@@ -0,0 +1,85 @@
+import pickle
+import threading
+from datetime import datetime
+from queue import Queue
+
+from telegram import Bot, Chat, Message, MessageEntity, Update, User
+from telegram.ext import CommandHandler, ConversationHandler, Dispatcher
+from telegram.ext.utils.promise import Promise
+
+from Persistence import SQLitePersistence
+
+MENU_MAIN = 1
+MENU_SETTINGS = 2
+
+
+def createCommandUpdate(bot: Bot, updateID: int, command: str) -> Update:
+    text = '/' + command
+    message = Message(updateID, datetime.now(), Chat(1, Chat.PRIVATE), from_user=User(1, 'Test', False), text=text,
+                      entities=[MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text))], bot=bot)
+    return Update(updateID, message=message)
+
+
+def createDispatcher(persistence: SQLitePersistence, errors: list, handlerDone: threading.Event) -> Dispatcher:
+    def start(update, context):
+        handlerDone.set()
+        return MENU_MAIN
+
+    def settings(update, context):
+        handlerDone.set()
+        return MENU_SETTINGS
+
+    bot = Bot('123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi')
+    # Command filters need the username of the bot -> No getMe request
+    bot._bot = User(123456, 'TestBot', True, username='TestBot')
+    dispatcher = Dispatcher(bot, Queue(), workers=2, persistence=persistence)
+    dispatcher.add_handler(ConversationHandler(entry_points=[CommandHandler('start', start, run_async=True)],
+                                               states={MENU_MAIN: [CommandHandler('settings', settings, run_async=True)], MENU_SETTINGS: []},
+                                               fallbacks=[], name='main', persistent=True))
+    dispatcher.add_error_handler(lambda update, context: errors.append(context.error))
+    # Starts the worker threads of run_async handlers
+    ready = threading.Event()
+    threading.Thread(target=dispatcher.start, kwargs={'ready': ready}, daemon=True).start()
+    assert ready.wait(5)
+    return dispatcher
+
+
+def processAndWait(dispatcher: Dispatcher, update: Update, handlerDone: threading.Event) -> None:
+    handlerDone.clear()
+    dispatcher.process_update(update)
+    assert handlerDone.wait(5)
+
+
+def test_runAsyncHandlersArePersistedOncePromisesAreResolved(tmp_path):
+    path = str(tmp_path / 'state.sqlite')
+    persistence = SQLitePersistence(path, flushIntervalSeconds=3600)
+    errors = []
+    handlerDone = threading.Event()
+    dispatcher = createDispatcher(persistence, errors, handlerDone)
+    try:
+        processAndWait(dispatcher, createCommandUpdate(dispatcher.bot, 1, 'start'), handlerDone)
+        processAndWait(dispatcher, createCommandUpdate(dispatcher.bot, 2, 'settings'), handlerDone)
+        # Resolves the pending promise of /settings
+        dispatcher.process_update(createCommandUpdate(dispatcher.bot, 3, 'unknown'))
+    finally:
+        dispatcher.stop()
+    assert errors == []
+    persistence.close()
+    reloaded = SQLitePersistence(path, flushIntervalSeconds=3600)
+    try:
+        assert reloaded.get_conversations('main') == {(1, 1): MENU_SETTINGS}
+    finally:
+        reloaded.close()
+
+
+def test_pendingPromiseKeepsPersistedState(tmp_path):
+    persistence = SQLitePersistence(str(tmp_path / 'state.sqlite'), flushIntervalSeconds=3600)
+    try:
+        persistence.update_conversation('main', (1, 1), MENU_MAIN)
+        promise = Promise(lambda: MENU_SETTINGS, [], {})
+        # Nested tuple as passed by PTB while the promise is pending. Contains locks -> Must never be pickled.
+        persistence.update_conversation('main', (1, 1), ((MENU_MAIN, promise), promise))
+        assert persistence.get_conversations('main')[(1, 1)] == MENU_MAIN
+        assert pickle.loads(persistence.pendingConversations[('main', pickle.dumps((1, 1)))]) == MENU_MAIN
+    finally:
+        persistence.close()
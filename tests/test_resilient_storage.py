@@ -0,0 +1,138 @@
+import pytest
+
+from Clock import VirtualClock
+from ResilientStorage import CircuitBreaker, ResilientStorage, StorageUnavailableError
+from Storage import DATABASES, USERDB, Storage, withoutMetadata
+
+
+class ConflictError(Exception):
+    pass
+
+
+class RevisionedStorage(Storage):
+    """ In-memory backend with CouchDB like revisions which can be switched off """
+    UNAVAILABLE_ERRORS = (ConnectionError,)
+
+    def __init__(self, users: dict = None):
+        self.isReachable = True
+        self.docs = {}
+        for userID, userDoc in (users or {}).items():
+            self.createUser(userID, userDoc)
+        self.docs[DATABASES.BOTSTATE] = {'_id': DATABASES.BOTSTATE, '_rev': '1'}
+
+    def checkReachable(self):
+        if not self.isReachable:
+            raise ConnectionError("DB is down")
+
+    def getUserIDs(self):
+        self.checkReachable()
+        return [userID for userID in self.docs if userID != DATABASES.BOTSTATE]
+
+    def hasUser(self, userID):
+        return userID in self.getUserIDs()
+
+    def getUser(self, userID):
+        self.checkReachable()
+        return dict(self.docs[userID]) if userID in self.docs else None
+
+    def getUsers(self):
+        return [(userID, self.getUser(userID)) for userID in self.getUserIDs()]
+
+    def getAdmins(self):
+        return {userID: userDoc for userID, userDoc in self.getUsers() if userDoc.get(USERDB.IS_ADMIN)}
+
+    def getApprovedUsers(self):
+        return {userID: userDoc for userID, userDoc in self.getUsers() if userDoc.get(USERDB.IS_ADMIN) or userDoc.get(USERDB.IS_APPROVED)}
+
+    def createUser(self, userID, userDoc):
+        self.checkReachable()
+        existingDoc = self.docs.get(userID)
+        userDoc = withoutMetadata(userDoc)
+        userDoc['_id'] = userID
+        userDoc['_rev'] = str(int(existingDoc['_rev']) + 1) if existingDoc is not None else '1'
+        self.docs[userID] = userDoc
+
+    def saveUser(self, userDoc):
+        self.checkReachable()
+        if userDoc.get('_rev') != self.docs[userDoc['_id']]['_rev']:
+            raise ConflictError(userDoc['_id'])
+        userDoc['_rev'] = str(int(userDoc['_rev']) + 1)
+        self.docs[userDoc['_id']] = dict(userDoc)
+
+    def deleteUser(self, userID):
+        self.checkReachable()
+        return self.docs.pop(userID, None) is not None
+
+    def getUserList(self, limit, cursor=None, skip=0):
+        return []
+
+    def searchUsers(self, searchTerm, limit):
+        return []
+
+    def archiveUser(self, userID, archivedUserDoc):
+        self.deleteUser(userID)
+
+    def getArchivedUsers(self):
+        return []
+
+    def getBotDoc(self):
+        return self.getUser(DATABASES.BOTSTATE)
+
+    def saveBotDoc(self, botDoc):
+        self.createUser(DATABASES.BOTSTATE, botDoc)
+
+    def compact(self):
+        return 0, 0
+
+
+def createStorage(backend: RevisionedStorage, clock: VirtualClock) -> ResilientStorage:
+    return ResilientStorage(backend, clock=clock, breaker=CircuitBreaker(failureThreshold=1, openSeconds=30, clock=clock))
+
+
+def test_unavailableDuringStartupNeverPretendsThereAreNoUsers():
+    clock = VirtualClock()
+    backend = RevisionedStorage({'1': {USERDB.IS_ADMIN: True, USERDB.IS_APPROVED: True}})
+    backend.isReachable = False
+    storage = createStorage(backend, clock)
+    assert storage.getBotDoc()['_id'] == DATABASES.BOTSTATE
+    with pytest.raises(StorageUnavailableError):
+        storage.getUserIDs()
+    with pytest.raises(StorageUnavailableError):
+        storage.getAdminsFromSnapshot()
+    with pytest.raises(StorageUnavailableError):
+        storage.createUser('2', {USERDB.IS_ADMIN: True})
+    with pytest.raises(StorageUnavailableError):
+        storage.saveBotDoc({'snoozed': True})
+    assert storage.getNumberOfPendingWrites() == 0
+    # Snapshot gets loaded once the backend is back
+    backend.isReachable = True
+    clock.advance(31)
+    assert list(storage.getAdminsFromSnapshot().keys()) == ['1']
+    assert backend.getUser('2') is None
+
+
+def test_docsReadDuringOutageCanBeSavedAfterReplay():
+    clock = VirtualClock()
+    backend = RevisionedStorage({'1': {USERDB.FIRST_NAME: 'Anna'}})
+    storage = createStorage(backend, clock)
+    list(storage.getUsers())
+    backend.isReachable = False
+    userDoc = storage.getUser('1')
+    userDoc[USERDB.FIRST_NAME] = 'Berta'
+    storage.saveUser(userDoc)
+    assert storage.getNumberOfPendingWrites() == 1
+    # Read during outage, saved after recovery
+    staleDoc = storage.getUser('1')
+    backend.isReachable = True
+    clock.advance(31)
+    staleDoc[USERDB.LAST_NAME] = 'Muster'
+    storage.saveUser(staleDoc)
+    assert storage.getNumberOfPendingWrites() == 0
+    assert backend.getUser('1')[USERDB.LAST_NAME] == 'Muster'
+    # Read, modify, save after recovery
+    userDoc = storage.getUser('1')
+    userDoc[USERDB.USERNAME] = 'berta'
+    storage.saveUser(userDoc)
+    assert withoutMetadata(backend.getUser('1')) == {USERDB.FIRST_NAME: 'Berta', USERDB.LAST_NAME: 'Muster', USERDB.USERNAME: 'berta'}
+    # Snapshot has the revision of the replayed doc
+    assert storage.snapshot['1']['_rev'] == backend.getUser('1')['_rev']
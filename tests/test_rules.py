@@ -0,0 +1,36 @@
+import json
+import os
+
+import pytest
+from pydantic import ValidationError
+
+from Helper import BotConfig
+from Rules import Rule, RuleConfig
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json.default')
+
+
+def createConfig(rules: list) -> dict:
+    with open(DEFAULT_CONFIG_PATH) as infile:
+        config = json.load(infile)
+    config['thingspeak_rules'] = rules
+    return config
+
+
+def test_rulesOnConfiguredFieldsAreAccepted():
+    config = BotConfig(**createConfig([{'name': 'Einbruch', 'type': 'ALL_WITHIN', 'fields': [1, 2]}, {'name': 'Hitze', 'type': 'RISE', 'field': 3, 'delta': 5}]))
+    assert [ruleConfig.getFieldIDs() for ruleConfig in config.thingspeak_rules] == [[1, 2], [3]]
+
+
+@pytest.mark.parametrize('rule', [{'name': 'Einbruch', 'type': 'ALL_WITHIN', 'fields': [1, 99]}, {'name': 'Batterie', 'type': 'AVERAGE', 'field': 99, 'trigger': 11.8}])
+def test_rulesOnUnknownFieldsAreRejected(rule):
+    with pytest.raises(ValidationError, match='99'):
+        BotConfig(**createConfig([rule]))
+
+
+def test_ruleRequiresOnSample():
+    class IncompleteRule(Rule):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteRule(RuleConfig(name='Test', type='RISE', field=1, delta=1))
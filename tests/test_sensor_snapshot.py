@@ -0,0 +1,57 @@
+import threading
+
+from AlarmEngine import ITEM_KINDS, SensorSnapshot
+
+
+def createItems(generation: int) -> list:
+    # All values of one write are equal -> Mixed values would reveal a torn read
+    return [(ITEM_KINDS.SENSOR, fieldID, 1, 0, generation % 2, float(generation)) for fieldID in range(1, 9)]
+
+
+def test_readReturnsLastWriteAndNoneIfUnchanged(tmp_path):
+    path = str(tmp_path / 'sensors.snapshot')
+    writer = SensorSnapshot(path, create=True)
+    reader = SensorSnapshot(path)
+    assert reader.read() is None
+    writer.write(1620000000.0, 42, False, createItems(1))
+    state = reader.read()
+    assert (state.lastSensorUpdateTimestamp, state.lastEntryID, state.noDataAlarmActive) == (1620000000.0, 42, False)
+    assert state.items == createItems(1)
+    assert reader.read(state.sequence) is None
+    writer.write(1620000015.0, None, True, createItems(2))
+    state = reader.read(state.sequence)
+    assert (state.lastEntryID, state.noDataAlarmActive, state.items) == (None, True, createItems(2))
+    # Restarted writer continues the sequence -> Readers notice its first write
+    restartedWriter = SensorSnapshot(path)
+    restartedWriter.write(1620000030.0, 43, False, createItems(3))
+    assert reader.read(state.sequence).lastEntryID == 43
+    for snapshot in (writer, restartedWriter, reader):
+        snapshot.close()
+
+
+def test_concurrentReadsAreNeverTorn(tmp_path):
+    path = str(tmp_path / 'sensors.snapshot')
+    writer = SensorSnapshot(path, create=True)
+    reader = SensorSnapshot(path)
+    writer.write(0.0, 0, False, createItems(0))
+    stop = threading.Event()
+
+    def writeContinuously():
+        generation = 0
+        while not stop.is_set():
+            generation += 1
+            writer.write(float(generation), generation, False, createItems(generation))
+
+    thread = threading.Thread(target=writeContinuously)
+    thread.start()
+    try:
+        for _ in range(5000):
+            state = reader.read()
+            assert state is not None
+            assert len({item[5] for item in state.items}) == 1
+            assert state.items[0][5] == state.lastEntryID
+    finally:
+        stop.set()
+        thread.join()
+    writer.close()
+    reader.close()
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from Storage import USERDB, SQLiteStorage, Storage
+
+
+def test_compactFreesAllUnusedPages(tmp_path):
+    path = str(tmp_path / 'bot.sqlite')
+    storage = SQLiteStorage(path)
+    try:
+        for index in range(2000):
+            storage.createUser(str(index), {USERDB.FIRST_NAME: 'User' + str(index), 'padding': 'x' * 1000})
+        for index in range(2000):
+            storage.deleteUser(str(index))
+        pageSize = storage.db.execute('PRAGMA page_size').fetchone()[0]
+        freePages = storage.db.execute('PRAGMA freelist_count').fetchone()[0]
+        assert freePages > 100
+        fileBytes, freedBytes = storage.compact()
+        assert storage.db.execute('PRAGMA freelist_count').fetchone()[0] == 0
+        assert freedBytes == freePages * pageSize
+        assert os.path.getsize(path) < fileBytes - freedBytes // 2
+        # Nothing left to free
+        assert storage.compact()[1] == 0
+    finally:
+        storage.close()
+
+
+def test_backendRequiresAllMethods():
+    class IncompleteStorage(Storage):
+        def getUserIDs(self):
+            return []
+
+    with pytest.raises(TypeError):
+        IncompleteStorage()
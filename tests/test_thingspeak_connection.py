@@ -0,0 +1,86 @@
+import json
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from ThingspeakClient import ThingspeakClient, ThingspeakConnection
+
+
+@pytest.fixture
+def blackhole():
+    """ Listening socket whose accept queue is full -> Further connects get no answer. """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(0)
+    port = server.getsockname()[1]
+    clients = []
+    while True:
+        client = socket.socket()
+        client.settimeout(0.2)
+        try:
+            client.connect(('127.0.0.1', port))
+        except socket.timeout:
+            client.close()
+            break
+        clients.append(client)
+    yield port
+    for client in clients:
+        client.close()
+    server.close()
+
+
+def makeConnection(port: int, timeoutSeconds: float) -> ThingspeakConnection:
+    connection = ThingspeakConnection(timeoutSeconds=timeoutSeconds)
+    connection.HOST = '127.0.0.1'
+    connection.PORT = port
+    return connection
+
+
+def test_blackholedConnectFailsWithinTimeout(blackhole):
+    connection = makeConnection(blackhole, 0.5)
+    start = time.monotonic()
+    with pytest.raises(socket.timeout):
+        connection.openSocket()
+    assert time.monotonic() - start < 2
+    assert connection.socket is None
+
+
+def test_abortInterruptsHangingConnect(blackhole):
+    connection = makeConnection(blackhole, 30)
+    threading.Timer(0.3, connection.abort).start()
+    start = time.monotonic()
+    with pytest.raises(OSError):
+        connection.openSocket()
+    assert time.monotonic() - start < 5
+
+
+class FakeHTTPConnection:
+    """ Serves one feed document in small chunks """
+
+    def __init__(self, document: bytes):
+        self.document = document
+
+    def request(self, method, url):
+        pass
+
+    def get_response(self):
+        return SimpleNamespace(read_chunked=lambda: (self.document[index:index + 10] for index in range(0, len(self.document), 10)))
+
+
+def test_sharedConnectionIsFreeWhileEntriesAreConsumed():
+    feed = {'channel': {'id': 1, 'name': 'Haus'}, 'feeds': [{'entry_id': entryID, 'field1': '1'} for entryID in range(1, 4)]}
+    connection = ThingspeakConnection()
+    connection.connection = FakeHTTPConnection(json.dumps(feed).encode('utf-8'))
+    client = ThingspeakClient(1, 'KEY', connection)
+    channelInfos = []
+    entryIDs = []
+    for entry in client.streamFeed(minEntryID=1, onChannelInfo=channelInfos.append):
+        # Other channels sharing the connection can make requests in the meantime
+        assert connection.lock.acquire(blocking=False)
+        connection.lock.release()
+        entryIDs.append(entry['entry_id'])
+    assert channelInfos == [feed['channel']]
+    assert entryIDs == [2, 3]